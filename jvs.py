@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
-from argparse import ArgumentParser
-from serial import Serial
-from time import sleep, time
+from time import sleep, time, monotonic
 import sys, os
+import threading
+try:
+    import fcntl, termios
+except ImportError:     # Windows
+    fcntl = termios = None
 from jvsmacros import *
+from jvscodec import JVS_Codec, JVS_Error, applyFeatures, decodeCoins, gpoBytes, gpoCommands, packGPO, packSwitches, packCoins, switchBytes
 from dataclasses import dataclass, field
 from enum import IntEnum
-from bitstring import BitArray
 
 animationCycle = [ 
     # M 1:UDLR 2:UDLR St:21 Sub:RL Mq: BR BL TR TL
@@ -29,15 +32,91 @@ class ConnectState(IntEnum):
     RETRYING = 4
     CONNECTED = 5
 
-@dataclass
+# Steps of one request/reply transaction in waitForReply()
+class TxState(IntEnum):
+    WAITING = 0     # Request is out, reading whatever comes back
+    RESEND = 1      # Request was lost or arrived damaged, send the whole frame again
+    RETRY = 2       # Reply arrived damaged, ask for it again with DATARETRY
+    FAILED = 3
+
+# Modem status lines that can carry the JVS sense signal. Names match the GUI's "JVS Sense In" list.
+SENSE_LINES = {
+    "DSR": termios.TIOCM_DSR if termios else 0x100,
+    "DCD": termios.TIOCM_CD if termios else 0x040
+}
+
+# RS-485 transmitter switching, see JVS.setDirectionControl()
+DIRECTION_MODES = ("auto", "kernel", "rts", "none")
+
+# Baud rates COMCHG can switch the bus to, and the code it takes for each. Boards start at 115200 and go back to it on reset.
+COMCHG_RATES = {115200: 0x00, 1000000: 0x01, 3000000: 0x02}
+COMCHG_SETTLE = 0.1     # Seconds boards get to change over before the next frame
+
+JVS_MAX_FRAME = 258         # Sync, node, #bytes and up to 255 bytes after that (before escaping)
+JVS_RX_BUFFER_SIZE = 2048
+
+@dataclass(slots = True)
 class JVS_Frame:
     sync: int = 0
     numBytes: int = 0
     nodeID: int = 0
     status: int = 0
     sum: int = 0
-    data: bytearray = field(default_factory = bytearray)
+    data: bytearray = field(default_factory = bytearray)    # Received frames hold a view into the JVS decode buffer instead
     tcount: int = 0
+    pooled: bool = False    # Sitting in a JVS_FramePool
+
+_EMPTY_PAYLOAD = memoryview(b'')
+
+class JVS_FramePool():
+    def __init__(self, size: int = 8):
+        """Recycles JVS_Frame objects across poll cycles. Request frames own their data, reply frames view the shared decode buffer.
+        Each kind is kept on a fixed size stack, so taking and handing back frames never resizes a list."""
+        self.size = size
+        self._requests = [None] * size
+        self._requestCount = 0
+        self._replies = [None] * size
+        self._replyCount = 0
+
+    def get(self):
+        """Returns a blank request frame."""
+        if self._requestCount:
+            self._requestCount -= 1
+            frame = self._requests[self._requestCount]
+            self._requests[self._requestCount] = None
+            frame.pooled = False
+            return frame
+        return JVS_Frame()
+
+    def getReply(self):
+        """Returns a blank reply frame."""
+        if self._replyCount:
+            self._replyCount -= 1
+            frame = self._replies[self._replyCount]
+            self._replies[self._replyCount] = None
+            frame.pooled = False
+            return frame
+        return JVS_Frame(data=_EMPTY_PAYLOAD)
+
+    def release(self, *frames):
+        """Hands frames back to the pool. Anything that isn't a frame (None, 0, -1 from failed reads) is ignored."""
+        for frame in frames:
+            if not isinstance(frame, JVS_Frame) or frame.pooled:
+                continue
+            frame.sync = frame.numBytes = frame.nodeID = frame.status = frame.sum = frame.tcount = 0
+            if isinstance(frame.data, memoryview):
+                # The view belongs to the decode buffer's kept slices, just let go of it
+                frame.data = _EMPTY_PAYLOAD
+                if self._replyCount < self.size:
+                    frame.pooled = True
+                    self._replies[self._replyCount] = frame
+                    self._replyCount += 1
+            else:
+                del frame.data[:]
+                if self._requestCount < self.size:
+                    frame.pooled = True
+                    self._requests[self._requestCount] = frame
+                    self._requestCount += 1
 
 @dataclass
 class JVSIO:
@@ -67,99 +146,334 @@ class JVSIO:
     character_type: JVS_CharaOutputTypes = JVS_CharaOutputTypes.JVS_CHARACTER_NONE
     backupSupport: bool = False
 
-class JVS_Error(Exception):
-    pass
+def _escapeByte(packet: bytearray, length: int, byte: int):
+    """Puts byte into packet at length, escaped if it's SYNC or MARK. Returns the new length."""
+    if byte == JVS_SYNC or byte == JVS_MARK:
+        packet[length] = JVS_MARK
+        packet[length + 1] = byte - 1
+        return length + 2
+    packet[length] = byte
+    return length + 1
 
 def insert_point(string):
     index = 1
     return string[:index] + '.' + string[index:]
 
 class JVS():
-    def __init__(self, port: Serial, ioBoard: JVSIO, master: bool = True):
-        """JVS handler library. Requires a PySerial Serial object and a JVSIO object (This is the first IO board in the chain)"""
+    def __init__(self, port: 'JVS_Transport', ioBoard: JVSIO, master: bool = True, sense: str = None, onStateChange = None):
+        """JVS handler library. Requires a PySerial Serial object (or another transport from jvstransport) and a JVSIO object (This is the first IO board in the chain).
+        sense can be "DSR" or "DCD" to watch that modem status line for the JVS sense signal, onStateChange is called with the new ConnectState whenever it changes."""
         self.cuPort = port
+        # Set before anything can raise, __del__ needs them
+        self._senseThread = None
+        self._senseStop = threading.Event()
+        self._senseCond = threading.Condition()
+        if sense == "None": sense = None
+        if sense is not None and sense not in SENSE_LINES:
+            raise ValueError('Unknown sense line: ' + str(sense))
         self.ioBoard = ioBoard
         self.connectState = ConnectState.DISCONNECTED # 0= disconnected, 1= failed, 2= connecting, 3= retrying, 4= connected
         self.ioBoardCount = 0
+        self.framePool = JVS_FramePool()
+        self.codec = JVS_Codec(ioBoard)
         self.lastSentFrame = JVS_Frame()
         self.isMaster = master
+        # Raw bytes from the port, and the unescaped frame that reply frames point into
+        self._rxBuffer = bytearray(JVS_RX_BUFFER_SIZE)
+        self._rxStart = 0
+        self._rxEnd = 0
+        self._rxView = memoryview(self._rxBuffer)
+        self._frameBuffer = bytearray(JVS_MAX_FRAME)
+        self._frameView = memoryview(self._frameBuffer)
+        self._txBuffer = bytearray(2 * JVS_MAX_FRAME)
+        self._txView = memoryview(self._txBuffer)
+        # Slices of those buffers, made the first time each length is needed and kept, see _keptSlice()
+        self._rxSlices = [None] * (JVS_RX_BUFFER_SIZE + 1)
+        self._txSlices = [None] * (len(self._txBuffer) + 1)
+        self._dataSlices = [None] * (JVS_MAX_FRAME + 1)
+        self._reportSlices = [None] * (JVS_MAX_FRAME + 1)
+        self._dataStart = 3 if master else 2     # Where a frame's data starts in the decode buffer, after node, #bytes (and status)
+        self._readRequests = {}     # Switch, coin and analog read requests by command, see _readRequest()
+        self.onStateChange = onStateChange
+        self.directionControl = "rts"  # How the RS-485 transmitter is switched, see setDirectionControl()
+        self.replyInterval = 0.01   # How long waitForReply() sleeps between checks for a reply, 0 just yields
+        self.replyTimeout = 1       # How long waitForReply() gives each attempt before sending again
+        self.replyRetries = 3       # Extra sends (frame resends and DATARETRY requests together) waitForReply() may make per request
+        self.resendCount = 0        # Totals of each, for diagnostics
+        self.dataRetryCount = 0
+        self.replyDamaged = False   # readPacket() threw away a malformed frame since the last send
+        self.inputFilters = []  # Callables run on every switch report from getInputs(), each takes and returns the bytearray
+        self.lastStatus = None  # Status of the last reply frame
+        # GPO state as last accepted by the board (None = not known, e.g. after a reset), and whether it takes GENERICOUT2/3 (None = not tried yet)
+        self.gpo = None
+        self.gpoPartial = None
+        # Sense line monitoring
+        self.senseLine = sense
+        self.senseInterval = 0.001  # Poll interval when the port can't wait on modem status changes
+        self.senseLevel = None
+        self.senseChangedAt = 0.0   # monotonic() timestamp of the last sense line change seen
+        self._senseIoctl = fcntl is not None and hasattr(termios, 'TIOCMIWAIT')
     
     def __del__(self):
+        self.stopSenseMonitor()
         self.cuPort.close() 
 
+    def setDirectionControl(self, mode: str = "auto"):
+        """Chooses how write() switches the RS-485 transmitter. "kernel" has the UART driver do it (TIOCSRS485) so a frame is a single write(),
+        "rts" toggles RTS around each frame and waits for it to drain, "none" is for adapters that switch by themselves.
+        "auto" tries kernel and falls back to rts. Returns the mode in use."""
+        if mode not in DIRECTION_MODES:
+            raise ValueError('Unknown direction control: ' + str(mode))
+        from jvstransport import setKernelRS485
+        if self.directionControl == "kernel" and mode != "kernel":
+            setKernelRS485(self.cuPort, False)
+        if mode in ("kernel", "auto"):
+            mode = "kernel" if setKernelRS485(self.cuPort) else "rts"
+        self.directionControl = mode
+        if mode != "rts":
+            # Leave RTS where the driver wants it
+            self.cuPort.rts = True
+        return mode
+
+    def setConnectState(self, state: ConnectState):
+        """Updates the connection state and notifies onStateChange if it changed."""
+        if state == self.connectState:
+            return state
+        self.connectState = state
+        if self.onStateChange:
+            self.onStateChange(state)
+        return state
+
+    def readSense(self):
+        """Returns True if the sense line reports an IO board present, or None if no sense line is in use."""
+        match self.senseLine:
+            case "DSR":
+                return bool(self.cuPort.dsr)
+            case "DCD":
+                return bool(self.cuPort.cd)
+        return None
+
+    def startSenseMonitor(self):
+        """Starts watching the sense line in the background. A board dropping off the line moves the connection to LOST straight away."""
+        if self.senseLine is None or (self._senseThread and self._senseThread.is_alive()):
+            return
+        self.senseLevel = self.readSense()
+        self.senseChangedAt = monotonic()
+        self._senseStop.clear()
+        self._senseThread = threading.Thread(target=self._senseMonitor, name='JVS sense monitor', daemon=True)
+        self._senseThread.start()
+
+    def stopSenseMonitor(self):
+        """Stops the sense line monitor, if running."""
+        self._senseStop.set()
+        thread = self._senseThread
+        self._senseThread = None
+        if thread and thread is not threading.current_thread():
+            # A thread blocked in TIOCMIWAIT only wakes on a line change, so don't wait on it forever.
+            thread.join(0.1)
+
+    def waitForSense(self, level: bool = True, timeout: float = 0.25):
+        """Waits until the sense line reads level. Without a sense line this just sleeps for timeout, as before."""
+        if self.senseLine is None:
+            sleep(timeout)
+            return True
+        deadline = monotonic() + timeout
+        with self._senseCond:
+            while self.readSense() != level:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                # The monitor notifies on every change, fall back to polling if it isn't running.
+                self._senseCond.wait(remaining if self._senseThread else min(remaining, self.senseInterval))
+        return True
+
+    def _waitSenseEvent(self):
+        """Blocks until the modem status lines might have changed."""
+        waiter = getattr(self.cuPort, 'waitModemChange', None)
+        if waiter:
+            waiter(self.senseInterval)
+            return
+        if self._senseIoctl:
+            try:
+                fcntl.ioctl(self.cuPort.fileno(), termios.TIOCMIWAIT, SENSE_LINES[self.senseLine])
+                return
+            except (OSError, AttributeError, ValueError):
+                # ptys and most USB adapters without modem lines don't support it
+                self._senseIoctl = False
+        self._senseStop.wait(self.senseInterval)
+
+    def _senseMonitor(self):
+        while not self._senseStop.is_set():
+            self._waitSenseEvent()
+            if self._senseStop.is_set():
+                break
+            try:
+                level = self.readSense()
+            except (OSError, ValueError, TypeError):
+                # Port went away underneath us
+                level = False
+            if level == self.senseLevel:
+                continue
+            self.senseLevel = level
+            self.senseChangedAt = monotonic()
+            with self._senseCond:
+                self._senseCond.notify_all()
+            if not level and self.connectState in (ConnectState.CONNECTED, ConnectState.CONNECTING, ConnectState.RETRYING):
+                self.setConnectState(ConnectState.LOST)
+
+    def request(self, *commands, nodeID: int = None):
+        """Sends several commands in one frame and decodes all of their reports in one pass.
+        Each command is a tuple of (code or name, *args) as taken by JVS_Codec.pack(). Returns a list with a result for each command that gets a report (None where the board didn't report normal), or None if the request failed."""
+        reply = self.requestRaw(self.codec.packAll(commands), nodeID)
+        if reply is None:
+            return None
+        try:
+            return self.codec.decodeReply(commands, reply)
+        except (JVS_Error, IndexError) as e:
+            print('Reply didn\'t match request: ' + str(e))
+            return None
+
+    def requestRaw(self, payload: bytes, nodeID: int = None):
+        """Sends an already packed frame payload and returns the reply's report data as bytes, or None if there was no good reply."""
+        report = self.framePool.get()
+        report.nodeID = self.ioBoard.nodeID if nodeID is None else nodeID
+        report.data += payload
+        self.write(report)
+        state = self.waitForReply(report)
+        reply = bytes(state.data) if state else None
+        self.framePool.release(report, state)
+        return reply
+
+    def poll(self):
+        """Reads switches, coins and analog inputs (whichever the board has) in one frame. Returns decoded (switches, coins, analog) as given by JVS_Codec, with None for anything not read."""
+        board = self.ioBoard
+        commands = []
+        if board.playerCount:
+            commands.append((JVS_READSWITCH_CODE, board.playerCount, switchBytes(board)))
+        if board.coinCount:
+            commands.append((JVS_READCOIN_CODE, board.coinCount))
+        if board.analogCount:
+            commands.append((JVS_READANALOG_CODE, board.analogCount))
+        results = self.request(*commands) if commands else None
+        if results is None:
+            return None
+        polled = {}
+        for command, result in zip(commands, results):
+            polled[command[0]] = result
+        return polled.get(JVS_READSWITCH_CODE), polled.get(JVS_READCOIN_CODE), polled.get(JVS_READANALOG_CODE)
+
     def setGPO(self, state: bytes):
-        """Set IO board's GP outputs. Only tested on IO boards with 8 or less outputs"""
-        # Uses GPO 1 command which is most compatible
+        """Sets the IO board's GP outputs. state is the output bitmap as the board takes it, GPO 1 in the top bit of the first byte (see jvscodec.packGPO()).
+        Only changed bytes are sent, with GENERICOUT2/3, when that's shorter than the whole bitmap. Boards that don't know those commands (Sega Type 1) get GENERICOUT1 from then on."""
         if self.ioBoard.gpoCount == 0:
             return 0
-        report = JVS_Frame()
-        report.nodeID = self.ioBoard.nodeID
-        byteCount = int((1 * (self.ioBoard.gpoCount / 8)) + 1)
-        
-        report.data.append(JVS_GENERICOUT1_CODE)
-        report.data.append(byteCount)
-        for b in range(0, byteCount):
-            report.data.append(state[byteCount - (1 + b)])
-        self.write(report)
-        state = self.waitForReply(report)
-        return state
-    
-    def getInputs(self, player: int = 0):
-        """Requests switch data from IO board. If player=0, will get all players, else you can specify how many players to read from (Starting from P1)"""
-        report = JVS_Frame()
-        report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_READSWITCH_CODE)
-        if player == 0:
-            report.data.append(self.ioBoard.playerCount)
-        btnBytes = 0
-        for x in range(0, (int((1 * (self.ioBoard.switchCount / 8))) + 1)):
-            btnBytes += 1
-        report.data.append(btnBytes)
+        byteCount = gpoBytes(self.ioBoard)
+        state = bytes(state[:byteCount]).ljust(byteCount, b'\x00')
+        commands = gpoCommands(state, self.gpo if self.gpoPartial is not False else None)
+        if not commands:
+            return 1
+        partial = commands[0][0] != JVS_GENERICOUT1_CODE
+        results = self.request(*commands)
+        if results is None and partial and self.lastStatus == JVS_StatusCodes.JVS_STATUS_UNKNOWNCMD:
+            self.gpoPartial = partial = False
+            results = self.request((JVS_GENERICOUT1_CODE, state))
+        if not results or not all(results):
+            # Some may have been applied, send the whole bitmap next time
+            self.gpo = None
+            return 0
+        if partial:
+            self.gpoPartial = True
+        self.gpo = state
+        return 1
+
+    def setOutput(self, output: int, level: bool):
+        """Turns one GP output (from 0) on or off, leaving the others as they were last set."""
+        if not 0 <= output < self.ioBoard.gpoCount:
+            raise ValueError('No GPO output ' + str(output))
+        state = bytearray(self.gpo if self.gpo is not None else gpoBytes(self.ioBoard))
+        if level:
+            state[output >> 3] |= 0x80 >> (output & 7)
+        else:
+            state[output >> 3] &= ~(0x80 >> (output & 7)) & 0xFF
+        return self.setGPO(state)
+
+    def getOutput(self, output: int):
+        """Level of one GP output as last set, False if not known."""
+        return bool(self.gpo and self.gpo[output >> 3] & (0x80 >> (output & 7)))
+
+    def _readRequest(self, code: int, count: int, size: int = 0):
+        """Request frame for a switch, coin or analog read. One is kept for each command and only rebuilt when what it asks for changes, so polling sends the same frame each time.
+        It isn't from framePool, don't release it."""
+        frame = self._readRequests.get(code)
+        if frame is None:
+            frame = self._readRequests[code] = JVS_Frame()
+        data = frame.data
+        if len(data) != (3 if size else 2) or data[1] != count or (size and data[2] != size):
+            del data[:]
+            data.append(code)
+            data.append(count)
+            if size:
+                data.append(size)
+        frame.nodeID = self.ioBoard.nodeID
+        return frame
+
+    def _keptSlice(self, slices: list, view: memoryview, start: int, end: int):
+        """view[start:end], made the first time it's needed and kept in slices (indexed by end, one list for each start) so reads and writes don't make a new memoryview every time."""
+        kept = slices[end]
+        if kept is None:
+            kept = slices[end] = view[start:end]
+        return kept
+
+    def _reportData(self, reply: JVS_Frame):
+        """A decoded reply's data after its report byte."""
+        start = self._dataStart + 1
+        return self._keptSlice(self._reportSlices, self._frameView, start, start + len(reply.data) - 1)
+
+    def getInputs(self, player: int = 0, into: bytearray = None):
+        """Requests switch data from IO board. If player=0, will get all players, else you can specify how many players to read from (Starting from P1).
+        Pass a bytearray as into to have it refilled instead of allocating a new one each poll."""
+        report = self._readRequest(JVS_READSWITCH_CODE, self.ioBoard.playerCount if player == 0 else player, switchBytes(self.ioBoard))
         self.write(report)
         state = self.waitForReply(report)
+        switches = 0
         if state and state.data[0] == JVS_ReportCodes.JVS_REPORT_NORMAL:
-            switches = bytearray(state.data[1:])
-            return switches
-        return 0
+            switches = into if into is not None else bytearray()
+            switches[:] = self._reportData(state)
+            for inputFilter in self.inputFilters:
+                switches = inputFilter(switches)
+        self.framePool.release(state)
+        return switches
     
-    def getCoinCount(self, slots: int = 0):
+    def getCoinCount(self, slots: int = 0, into: bytearray = None):
         """Requests coin count from IO board. If player=0, will get all slots, else you can specify how many slots to read from (Starting from coin 1)"""
-        report = JVS_Frame()
-        report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_READCOIN_CODE)
-        if slots == 0:
-            report.data.append(self.ioBoard.coinCount)
-        else:
-            report.data.append(slots)
+        report = self._readRequest(JVS_READCOIN_CODE, self.ioBoard.coinCount if slots == 0 else slots)
         self.write(report)
         state = self.waitForReply(report)
+        coins = 0
         if state and state.data[0] == JVS_ReportCodes.JVS_REPORT_NORMAL:
-            coins = bytearray(state.data[1:])
-            return coins
-        return 0
+            coins = into if into is not None else bytearray()
+            coins[:] = self._reportData(state)
+        self.framePool.release(state)
+        return coins
     
-    def decCoinCounter(self, slots: int = 0):
-        """Decrements 1 coin from IO board. If player=0, will decrement the first slot"""
-        report = JVS_Frame()
-        report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_COINDECREASE_CODE)
-        if slots == 0:
-            report.data.append(0x01)
-        else:
-            report.data.append(slots)
-        report.data.append(0x00)    # MSB of int to decrement
-        report.data.append(0x01)    # LSB of int to decrement
+    def getAnalog(self, channels: int = 0, into: bytearray = None):
+        """Requests analog input values from IO board. If channels=0, will get all channels, else you can specify how many channels to read from (Starting from channel 1). Each channel is 2 bytes, MSB first."""
+        if self.ioBoard.analogCount == 0:
+            return 0
+        report = self._readRequest(JVS_READANALOG_CODE, self.ioBoard.analogCount if channels == 0 else channels)
         self.write(report)
         state = self.waitForReply(report)
+        analog = 0
         if state and state.data[0] == JVS_ReportCodes.JVS_REPORT_NORMAL:
-            return 1
-        return 0
-    
-    def incCoinCounter(self, slots: int = 0):
-        """Decrements 1 coin from IO board. If player=0, will decrement the first slot"""
-        report = JVS_Frame()
+            analog = into if into is not None else bytearray()
+            analog[:] = self._reportData(state)
+        self.framePool.release(state)
+        return analog
+
+    def _coinCounter(self, code: int, slots: int = 0):
+        report = self.framePool.get()
         report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_COININCREASE_CODE)
+        report.data.append(code)
         if slots == 0:
             report.data.append(0x01)
         else:
@@ -168,43 +482,67 @@ class JVS():
         report.data.append(0x01)    # LSB of int to decrement
         self.write(report)
         state = self.waitForReply(report)
+        result = 0
         if state and state.data[0] == JVS_ReportCodes.JVS_REPORT_NORMAL:
-            return 1
-        return 0
+            result = 1
+        self.framePool.release(report, state)
+        return result
+
+    def decCoinCounter(self, slots: int = 0):
+        """Decrements 1 coin from IO board. If player=0, will decrement the first slot"""
+        return self._coinCounter(JVS_COINDECREASE_CODE, slots)
+    
+    def incCoinCounter(self, slots: int = 0):
+        """Increments 1 coin on IO board. If player=0, will increment the first slot"""
+        return self._coinCounter(JVS_COININCREASE_CODE, slots)
 
     def connect(self):
         """Connects to the first IO board on the JVS line"""
-        self.connectState = ConnectState.CONNECTING
+        self.setConnectState(ConnectState.CONNECTING)
         self.cuPort.reset_input_buffer()
         self.cuPort.reset_output_buffer()
         #print(self.cuPort)
-        sleep(0.25)
         if not self.cuPort.is_open:
             raise Exception('TTY port couldn\'t connect to given port')
             return
+        self.startSenseMonitor()
+        # Enumerate as soon as a board shows up on the sense line rather than always sleeping
+        if not self.waitForSense(True, 0.25):
+            print('No IO board on the sense line')
+            return self.setConnectState(ConnectState.FAILED)
         print('Connecting to JVS IO on given port...')
+        self.gpoPartial = None
         try:
             self.sendReset()
+            # Without a sense line there's nothing to wait for, the board answers once it has reset
+            if self.senseLine is not None and not self.waitForSense(True, 1):
+                raise JVS_Error('IO board did not come back after reset')
             self.assignID()
             self.requestName()
             self.requestVersions()
             self.requestFeatures()
             # If no errors up to this point, or atleast one IO was found, call it good.
-            self.connectState = ConnectState.CONNECTED
+            if self.connectState == ConnectState.LOST:
+                raise JVS_Error('IO board was lost during enumeration')
+            self.setConnectState(ConnectState.CONNECTED)
             self.ioBoardCount += 1
 
         except JVS_Error:
             print('Error whilst trying to connect')
-        # Verify the sense line maybe
         
         return self.connectState
     
     def disconnect(self):
         """Tell IO board to reset and then disconnect from UART port."""
         print('Disconnecting from JVS-IO')
-        self.sendReset()
-        self.cuPort.flush()
+        self.stopSenseMonitor()
+        if self.connectState not in (ConnectState.FAILED, ConnectState.DISCONNECTED):
+            self.sendReset()
+            self.cuPort.flush()
+        if self.directionControl == "kernel":
+            self.setDirectionControl("rts")
         self.cuPort.close()
+        self.setConnectState(ConnectState.DISCONNECTED)
         return
     
     def update(self):
@@ -213,20 +551,12 @@ class JVS():
 
     def requestName(self):
         """Request IO board identity name. IO board will return a string with up to 99 characters and deliminated with semicolons (\';\')."""
-        report = JVS_Frame()
-        report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_IOIDENT_CODE)
-
-        self.write(report)
-        name = self.waitForReply(report)
-
-        if not name:
+        results = self.request((JVS_IOIDENT_CODE,))
+        if not results:
             raise JVS_Error()
-        if name.data[0] == JVS_ReportCodes.JVS_REPORT_NORMAL:
-            name.data.replace(bytes(0), bytes(9))
-            self.ioBoard.name = bytearray.decode(name.data, encoding="ASCII")
-        else:
+        if results[0] is None:
             raise JVS_Error("IO Board does not support name command.")
+        self.ioBoard.name = results[0]
 
     
     def printName(self):
@@ -235,79 +565,13 @@ class JVS():
     
     def requestFeatures(self):
         """Request IO board feature list. Each feature is then processed and added to the IO Board object (JVSIO)."""
-        report = JVS_Frame()
-        #report.numBytes = 5
-        report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_FEATCHK_CODE)
-        self.write(report)
-        atr = self.waitForReply(report)
-        if not atr:
+        results = self.request((JVS_FEATCHK_CODE,))
+        if not results:
             raise JVS_Error()
-        if int(atr.data.pop(0)) == JVS_ReportCodes.JVS_REPORT_NORMAL:    # Report
-            index = 0
-            data = 0
-            done = False
-            while not done:
-                data = atr.data.pop(0)
-                match bcd2dec(data):
-                    case JVS_FeatureCodes.JVS_FEATURE_END:
-                        done = True
-                    # INPUTS
-                    case JVS_FeatureCodes.JVS_FEATURE_SWITCH:
-                        self.ioBoard.playerCount = atr.data.pop(0)
-                        self.ioBoard.switchCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_COIN:
-                        self.ioBoard.coinCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_ANALOG:
-                        self.ioBoard.analogCount = atr.data.pop(0)
-                        self.ioBoard.analogPrecision = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_ROTARY:
-                        self.ioBoard.rotaryCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_KEYCODE:
-                        # Document doesn't cover this and I don't know how to either
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_SCREEN:
-                        self.ioBoard.screen_x = atr.data.pop(0)
-                        self.ioBoard.screen_y = atr.data.pop(0)
-                        self.ioBoard.screen_c = atr.data.pop(0)
-                    case JVS_FeatureCodes.JVS_FEATURE_MISC:
-                        msb = atr.data.pop(0)
-                        lsb = atr.data.pop(0)
-                        self.ioBoard.extraSwitchCount = (lsb + (msb << 8))
-                    # OUTPUTS
-                    case JVS_FeatureCodes.JVS_FEATURE_CARD:
-                        self.ioBoard.cardCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_MEDAL:
-                        self.ioBoard.medalCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_GPO:
-                        self.ioBoard.gpoCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_ANALOG_OUT:
-                        self.ioBoard.analogOutCount = atr.data.pop(0)
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                    case JVS_FeatureCodes.JVS_FEATURE_CHARACTER:
-                        self.ioBoard.character_w = atr.data.pop(0)
-                        self.ioBoard.character_h = atr.data.pop(0)
-                        self.ioBoard.character_type = atr.data.pop(0)
-                    case JVS_FeatureCodes.JVS_FEATURE_BACKUP:
-                        self.ioBoard.backupSupport = True
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
-                        atr.data.pop(0)   # Dump unused byte
+        if results[0] is not None:
+            applyFeatures(self.ioBoard, results[0])
+        # Reply layouts depend on the feature counts
+        self.codec.compile()
         return
     
     def printFeatures(self):
@@ -357,20 +621,13 @@ class JVS():
 
     def requestVersions(self):
         """Request the IO board\'s command, JVS and communications versions and is added to the IO Board object (JVSIO)."""
-        report = JVS_Frame()
-        report.nodeID = self.ioBoard.nodeID
-        report.data.append(JVS_CMDREV_CODE)
-        report.data.append(JVS_JVSREV_CODE)
-        report.data.append(JVS_COMVER_CODE)
-
-        self.write(report)
-        atr = self.waitForReply(report)
-        if not atr:
+        results = self.request((JVS_CMDREV_CODE,), (JVS_JVSREV_CODE,), (JVS_COMVER_CODE,))
+        if not results:
             raise JVS_Error()
-
-        if int(atr.data.pop(0)) == JVS_ReportCodes.JVS_REPORT_NORMAL: self.ioBoard.cmdver = bcd2dec(atr.data.pop(0))
-        if int(atr.data.pop(0)) == JVS_ReportCodes.JVS_REPORT_NORMAL: self.ioBoard.jvsver = bcd2dec(atr.data.pop(0))
-        if int(atr.data.pop(0)) == JVS_ReportCodes.JVS_REPORT_NORMAL: self.ioBoard.comver = bcd2dec(atr.data.pop(0))
+        cmdver, jvsver, comver = results
+        if cmdver is not None: self.ioBoard.cmdver = cmdver
+        if jvsver is not None: self.ioBoard.jvsver = jvsver
+        if comver is not None: self.ioBoard.comver = comver
 
     def printVersions(self):
         """Prints the software versions of the IO Board object (JVSIO)."""
@@ -380,168 +637,247 @@ class JVS():
 
     def sendReset(self):
         """Tells all IO boards in the chain to reset. Command is sent three times to be sure all IO boards are reset."""
-        report = JVS_Frame()
+        report = self.framePool.get()
         report.nodeID = JVS_BROADCAST_ADDR
         report.data.append(JVS_RESET_CODE)
         report.data.append(0xD9)
+        # Reset turns the outputs off, but send the whole bitmap next time to be sure
+        self.gpo = None
 
         self.write(report)
         sleep(0.01)
         self.write(report)
         sleep(0.01)
         self.write(report)
+        self.framePool.release(report)
         return
+
+    def changeBaud(self, baud: int):
+        """Tells all IO boards to change to baud with COMCHG, then follows them. Boards before communication version 2.0 only talk at 115200."""
+        if baud not in COMCHG_RATES:
+            raise ValueError('COMCHG has no ' + str(baud) + ' baud rate')
+        if baud != 115200 and self.ioBoard.comver < 20:
+            raise ValueError('IO board only talks at 115200 baud')
+        if baud == self.cuPort.baudrate:
+            return
+        report = self.framePool.get()
+        report.nodeID = JVS_BROADCAST_ADDR
+        report.data.append(JVS_COMCHG_CODE)
+        report.data.append(COMCHG_RATES[baud])
+        self.write(report)
+        self.framePool.release(report)
+        # The frame has to be out at the old rate before the port changes
+        self.cuPort.flush()
+        self.cuPort.baudrate = baud
+        sleep(COMCHG_SETTLE)
     
     def _sendRetry(self):
         """Requests that the IO Board resend the last transmitted packet (i.e. in-case of a checksum error)."""
-        report = JVS_Frame()
+        report = self.framePool.get()
         report.nodeID = self.ioBoard.nodeID
         report.data.append(JVS_DATARETRY_CODE)
+        lastSent = self.lastSentFrame
         self.write(report)
+        # Keep the original request around in case the board asks for it again
+        self.lastSentFrame = lastSent
+        self.framePool.release(report)
         return
 
-    def readPacket(self, doRetry: bool = True, force_read: bool = False, index: int = 0):
-        """Reads and returns a JVS_Frame object if one is available. Set doRetry to False if you don't want to ask the IO board to resend the packet in case of read failure."""
-        packet = JVS_Frame() 
-        #index = fIndex
-        counter = 0
-        tcount = 0
-        mark_received: bool = False
+    def _fillReceiveBuffer(self):
+        """Moves whatever the port has waiting into the receive buffer. Returns the number of bytes read."""
+        waiting = self.cuPort.in_waiting
+        if not waiting:
+            return 0
+        buf = self._rxBuffer
+        if self._rxEnd + waiting > len(buf) and self._rxStart > 0:
+            # Slide the unread bytes down to make room. memoryview assignment is a memmove, so overlapping is fine and nothing is allocated.
+            remaining = self._rxEnd - self._rxStart
+            self._rxView[0:remaining] = self._rxView[self._rxStart:self._rxEnd]
+            self._rxStart = 0
+            self._rxEnd = remaining
+        size = len(buf) - self._rxEnd
+        if size <= 0:
+            # Receive buffer is full of junk, drop it
+            self._rxStart = self._rxEnd = 0
+            size = len(buf)
+        size = min(waiting, size)
+        if self._rxEnd == 0:
+            # Usually the buffer is empty between replies
+            count = self.cuPort.readinto(self._keptSlice(self._rxSlices, self._rxView, 0, size))
+        else:
+            count = self.cuPort.readinto(self._rxView[self._rxEnd:self._rxEnd + size])
+        self._rxEnd += count
+        return count
 
-        # A JVS frame cannot be less than 5 bytes (6 if master) (Sync, Node, #Bytes, (Status), Data, sum.)
-        if self.cuPort.in_waiting < 5 and not force_read:
-            return None
-        
-        #response = self.cuPort.read_all()
-        while index < 6:
-            byte = self.cuPort.read()[0]
-            if byte == JVS_SYNC and index != 0:
-                return self.readPacket(index=1)
-            if not byte == JVS_MARK:
-                if mark_received == True:
-                    byte -= 1
+    def _decodeFrame(self, packet: JVS_Frame):
+        """Decodes the next frame in the receive buffer into packet, unescaping into the shared decode buffer.
+        Returns True for a good frame, False for a malformed one (which is consumed) or None if a whole frame hasn't arrived yet."""
+        buf = self._rxBuffer
+        out = self._frameBuffer
+        while True:
+            pos = self._rxStart
+            end = self._rxEnd
+            while pos < end and buf[pos] != JVS_SYNC:
+                pos += 1
+            if pos >= end:
+                self._rxStart = self._rxEnd = 0
+                return None
+            self._rxStart = pos
+            count = 0
+            need = 0
+            mark_received = False
+            index = pos + 1
+            while index < end:
+                byte = buf[index]
+                index += 1
+                if byte == JVS_SYNC:
+                    # A new frame started before this one finished
+                    self._rxStart = index - 1
+                    return False
+                if byte == JVS_MARK:
+                    mark_received = True
+                    continue
+                if mark_received:
+                    byte += 1
                     mark_received = False
-                match index:
-                    case 0:
-                        packet.sync = byte       # Sync
-                        if packet.sync == JVS_SYNC: index += 1
-                    case 1:
-                        packet.nodeID = byte
-                        if (packet.nodeID == 0x00 and self.isMaster) \
-                            or ((packet.nodeID == self.ioBoard.nodeID or packet.nodeID == JVS_BROADCAST_ADDR) and not self.isMaster):
-                            index += 1
-                        else:
-                            return -1
-                    case 2:
-                        packet.numBytes = byte
-                        inBuffer = self.cuPort.in_waiting 
-                        if (inBuffer < packet.numBytes): 
-                            if not self._waitForBytes(packet.numBytes):
-                                break
-                        if packet.numBytes < 3:
-                            index += 2
-                        else:
-                            index += 1
-                    case 3:
-                        if(self.isMaster): packet.status = byte
-                        else: 
-                            packet.data.append(byte)
-                            counter += 1
-                        if packet.status != JVS_StatusCodes.JVS_STATUS_NORMAL:
-                            index += 1
-                        index += 1
-                    case 4:
-                        packet.data.append(byte)
-                        counter += 1
-                        if self.isMaster and counter >= (packet.numBytes - 2):
-                            index += 1
-                        elif not self.isMaster and counter >= (packet.numBytes - 1):   # 2 bytes for status, sum
-                            index += 1
-                    case 5:
-                        packet.sum = byte
-                        index += 1
-            else:
-                mark_received = True
-
-        #print(packet)
-        if (packet.sync == JVS_SYNC) and (self._calculateSum(packet, False) == packet.sum):
-            if self.isMaster:
-                match packet.status:
-                    case JVS_StatusCodes.JVS_STATUS_NORMAL:
-                        return packet
-                    case JVS_StatusCodes.JVS_STATUS_CHECKSUMERROR:
-                        self.write(self.lastSentFrame)
-                        return self.waitForReply(self.lastSentFrame)
-                    case JVS_StatusCodes.JVS_STATUS_UNKNOWNCMD:
-                        print('IO reported unknown commmand')
-                        return None
-                    case JVS_StatusCodes.JVS_STATUS_OVERFLOW:
-                        print('IO reported overflow')
-                        return None
-        else:
-            print('Packet was malformed')
-            if doRetry and self.isMaster:
-                report = None
-                tcount = 0
-                while tcount < 3:
-                    tcount += 1
-                    self._sendRetry()
-                    self._waitForBytes(4)
-                    report = self.readPacket(doRetry=False)
-                    if report:
-                        return report
-                if not report:
-                    print('Too many malformed packets')
-                    return None
-            else:
+                out[count] = byte
+                count += 1
+                if count == 2:
+                    need = byte + 2     # Node and #bytes, then #bytes more
+                    if byte < (2 if self.isMaster else 1):
+                        self._rxStart = index
+                        return False
+                if count == need:
+                    break
+            if count != need or need == 0:
                 return None
+            self._rxStart = index
+            if self._rxStart == self._rxEnd:
+                self._rxStart = self._rxEnd = 0
+            # Sum covers node, #bytes and everything up to the sum byte
+            frameSum = 0
+            for n in range(0, count - 1):
+                frameSum += out[n]
+            if (frameSum % 256) != out[count - 1]:
+                return False
+            nodeID = out[0]
+            if self.isMaster:
+                if nodeID != JVS_HOST_ADDR:
+                    continue    # Another board's traffic
+            elif nodeID != self.ioBoard.nodeID and nodeID != JVS_BROADCAST_ADDR:
+                continue
+            packet.sync = JVS_SYNC
+            packet.nodeID = nodeID
+            packet.numBytes = out[1]
+            packet.sum = out[count - 1]
+            if self.isMaster:
+                packet.status = out[2]
+            packet.data = self._keptSlice(self._dataSlices, self._frameView, self._dataStart, count - 1)
+            return True
 
-    def _waitForBytes(self, totalBytes: int, timeout: int = 1):
-        interval = 0.01  # Update interval
-        timeout = 1     # Timeout period
-        start = time()
-        while not (self.cuPort.in_waiting >= totalBytes):
-            if ((time() - start) > timeout):
-                    print('Request timed out')
-                    return 0
-            else: 
-                sleep(interval)
-        return self.cuPort.in_waiting
+    def readPacket(self):
+        """Reads and returns a JVS_Frame object if a good one is available, else None. Never sends anything, waitForReply() decides how to recover from damaged or missing replies.
+        The frame comes from framePool and its data is only valid until the next read, release it back to the pool when done."""
+        self._fillReceiveBuffer()
+        packet = self.framePool.getReply()
+        result = self._decodeFrame(packet)
+        if result is None:
+            self.framePool.release(packet)
+            return None
+        if not result:
+            self.framePool.release(packet)
+            self.replyDamaged = True
+            print('Packet was malformed')
+            return None
+        if self.isMaster:
+            self.lastStatus = packet.status
+            match packet.status:
+                case JVS_StatusCodes.JVS_STATUS_NORMAL:
+                    return packet
+                case JVS_StatusCodes.JVS_STATUS_CHECKSUMERROR:
+                    pass    # waitForReply() resends
+                case JVS_StatusCodes.JVS_STATUS_UNKNOWNCMD:
+                    print('IO reported unknown commmand')
+                case JVS_StatusCodes.JVS_STATUS_OVERFLOW:
+                    print('IO reported overflow')
+            self.framePool.release(packet)
+            return None
+        return packet
 
     def waitForReply(self, frame):
-        """Wait for the IO board to reply after sending a packet with write(Frame). If IO board does not reply within 1 second, this will return None"""
-        tcount = 0
-        interval = 0.01  # Update interval
-        timeout = 1     # Timeout period
-        start = time()
-        report = None
-        while not report:
-            while not (self.cuPort.in_waiting >= 5):
-                if (time() - start > timeout):
-                    if tcount > 0 and tcount < 3:
-                        self.write(frame)
-                        start = time()
-                    elif tcount > 3:
+        """Waits for the IO board's reply to a frame sent with write(), recovering from bus errors. Returns the reply frame, or None if there wasn't a good one.
+        One TxState loop per request, with replyRetries extra sends between all its recovery steps: a damaged reply is asked for again with DATARETRY, which the board answers
+        without running the request again; a request the board reports damaged, or one that got no reply at all within replyTimeout, is sent again whole. Frames with
+        non-idempotent commands (coin and payout counters, set address) aren't sent again after a timeout, the board may have run them and only the reply was lost."""
+        budget = self.replyRetries
+        interval = self.replyInterval
+        deadline = time() + self.replyTimeout
+        self.lastStatus = None
+        self.replyDamaged = False
+        state = TxState.WAITING
+        while True:
+            match state:
+                case TxState.WAITING:
+                    report = self.readPacket()
+                    if report:
+                        return report
+                    if self.connectState == ConnectState.LOST:
+                        # Sense line says the board is gone, don't sit out the timeout
+                        state = TxState.FAILED
+                    elif self.lastStatus == JVS_StatusCodes.JVS_STATUS_CHECKSUMERROR:
+                        # Board never ran the damaged request, so sending it again is always safe
+                        state = TxState.RESEND
+                    elif self.lastStatus is not None:
+                        # Unknown command or overflow, sending it again won't change the answer
+                        state = TxState.FAILED
+                    elif self.replyDamaged:
+                        state = TxState.RETRY
+                    elif time() > deadline:
+                        if self._rxEnd > self._rxStart:
+                            # Part of a reply came back, so the board has the request
+                            state = TxState.RETRY
+                        elif self.codec.idempotent(frame.data):
+                            state = TxState.RESEND
+                        else:
+                            print('No reply, not sending again in case the board already ran it')
+                            state = TxState.FAILED
+                    else:
+                        sleep(interval)
+                case TxState.RESEND | TxState.RETRY:
+                    if budget == 0:
                         print('Request timed out')
-                        return None
-                    tcount += 1
-                else: 
-                    sleep(interval)
-            report = self.readPacket()
-        return report
+                        state = TxState.FAILED
+                        continue
+                    budget -= 1
+                    # Whatever is buffered belongs to the attempt being abandoned
+                    self._rxStart = self._rxEnd = 0
+                    self.lastStatus = None
+                    self.replyDamaged = False
+                    if state == TxState.RESEND:
+                        self.resendCount += 1
+                        self.write(frame)
+                    else:
+                        self.dataRetryCount += 1
+                        self._sendRetry()
+                    deadline = time() + self.replyTimeout
+                    state = TxState.WAITING
+                case TxState.FAILED:
+                    return None
 
     def assignID(self, id = 1):
         """Assign an ID number to an IO board. Note, this works on a first come first serve basis down the IO board chain."""
-        report = JVS_Frame()
+        report = self.framePool.get()
         #report.numBytes = 3
         report.nodeID = JVS_BROADCAST_ADDR
         report.data.append(JVS_SETADDR_CODE)
         report.data.append(id)
         self.write(report)
         reply = self.waitForReply(report) 
+        accepted = reply and reply.data[0] == JVS_ReportCodes.JVS_REPORT_NORMAL
+        self.framePool.release(report, reply)
         if not reply:
             raise JVS_Error('JVS IO board didn\'t respond to Set ID command')
-        elif reply.data[0] != JVS_ReportCodes.JVS_REPORT_NORMAL:
+        elif not accepted:
             raise JVS_Error('JVS IO board didn\t accept Set ID command')
         else:
             self.ioBoard.nodeID = id
@@ -553,41 +889,40 @@ class JVS():
         or self.connectState == ConnectState.FAILED \
         or self.connectState == ConnectState.DISCONNECTED:
             raise Exception(__name__ + ': Not connected to JVS IO.')
-        frame.numBytes = (len(frame.data) + 1)
-        packet = bytearray()
-        packet.append(0xE0)
-        packet.append(frame.nodeID)
-        packet.append(len(frame.data) + 1)
-        if not self.isMaster: packet.append(frame.status)
-        for bytes in frame.data:
-            packet.append(bytes)
-        packet.append(self._calculateSum(frame, True))
-
-        index = 0
-        for f in packet:
-            if (int(f) == JVS_SYNC or int(f) == JVS_MARK) and index != 0:
-                packet[index] = JVS_MARK
-                packet.insert(index + 1, int(f) - 1)
-            index += 1
+        # #bytes counts everything after itself: (status,) data and sum
+        frame.numBytes = (len(frame.data) + 1) if self.isMaster else (len(frame.data) + 2)
+        packet = self._txBuffer
+        packet[0] = JVS_SYNC
+        length = _escapeByte(packet, 1, frame.nodeID)
+        length = _escapeByte(packet, length, frame.numBytes)
+        if not self.isMaster:
+            length = _escapeByte(packet, length, frame.status)
+        for f in frame.data:
+            length = _escapeByte(packet, length, f)
+        length = _escapeByte(packet, length, self._calculateSum(frame, True))
+        data = self._keptSlice(self._txSlices, self._txView, 0, length)
 
         self.lastSentFrame = frame
 
         # Write packet
-        self.cuPort.rts = False
-        self.cuPort.write(packet)
-        self.cuPort.flush()
-        self.cuPort.rts = True
+        if self.directionControl == "rts":
+            self.cuPort.rts = False
+            self.cuPort.write(data)
+            self.cuPort.flush()
+            self.cuPort.rts = True
+        else:
+            # The driver or adapter turns the line around, don't wait for the drain
+            self.cuPort.write(data)
         return
     
     def _calculateSum(self, _f: JVS_Frame, send: bool = False):
-        """Calculates a sum value for a given frame. You must specify send=True if acting as an IO Board."""
+        """Calculates the sum value for a frame as it goes out on the wire. Includes the status byte when acting as an IO Board."""
         _s: int[0:255] = 0
         _s = _f.nodeID
-        _s += (len(_f.data) + 1) #_f.numBytes
-        if send == False:
-            _s += (_f.status + 1)   # +1 for Status Byte to numBytes
-        #for bytes in _f.data:
-        #    _s += bytes
+        if self.isMaster:
+            _s += (len(_f.data) + 1)
+        else:
+            _s += (len(_f.data) + 2) + _f.status    # +1 for Status Byte to numBytes
         _s += sum(_f.data)
         _s = _s % 256
         return _s
@@ -595,12 +930,292 @@ class JVS():
 def cls():
     os.system('cls' if os.name=='nt' else 'clear')
 
+def monitor(jvsIO, args):
+    """Interactive demo: live switch, coin and GPO state on a terminal dashboard, with the GPOs animated and coins counted up and down."""
+    publisher = None
+    if args.shm:
+        from jvsshm import JVS_InputPublisher
+        publisher = JVS_InputPublisher(args.shm)
+    ledger = None
+    if args.ledger:
+        from jvsledger import JVS_CoinLedger
+        ledger = JVS_CoinLedger(args.ledger)
+    print("Connected to:")
+    jvsIO.printName()
+    jvsIO.printVersions()
+    jvsIO.printFeatures()
+    sleep(1)
+    from jvsdash import JVS_Dashboard, JVS_PollStats
+    dash = JVS_Dashboard(fps=args.fps)
+    stats = JVS_PollStats()
+    board = jvsIO.ioBoard
+    btnBytes = switchBytes(board)
+    switches = bytearray()
+    coins = bytearray()
+    lastSwitches = None
+    lastCoins = None
+    switchRead = 0
+    gpoWrite = 0
+    coinSlot = [0,0,0,0]
+    gpoI = 0
+    # Dashboard rows
+    statsRow = 1
+    switchRow = 3
+    coinRow = switchRow + 4 + board.playerCount
+    gpoRow = coinRow + max(board.coinCount, 1) + 1
+    messageRow = gpoRow + 2
+    dash.set(0, board.name.strip('\x00\x01').replace(';', ' / '))
+    dash.set(switchRow, 'Switches:')
+    dash.set(switchRow + 1, '\t\tT123xxxx (Test, Tilt 123)'.expandtabs())
+    dash.set(switchRow + 3, '\t\tS$UDLR12 345678+'.expandtabs())
+    dash.start()
+    try:
+        while True:
+            if jvsIO.connectState == ConnectState.LOST:
+                dash.set(messageRow, "Connection lost (sense line)")
+                break
+            if (time() - switchRead >= 0.005):
+                switchRead = time()
+                started = monotonic()
+                if publisher:
+                    # Switches, coins and analog in one frame, all of it goes to shared memory
+                    polled = jvsIO.poll()
+                    read = polled is not None and polled[0] is not None
+                    if read:
+                        publisher.publishPolled(polled, board.playerCount, btnBytes)
+                        switches[:] = packSwitches(*polled[0], btnBytes)
+                else:
+                    read = jvsIO.getInputs(into=switches)
+                stats.add(monotonic() - started)
+                if not read:
+                    dash.set(messageRow, "Error reading switches")
+                elif switches != lastSwitches:
+                    # Only format what changed
+                    lastSwitches = bytes(switches)
+                    dash.set(switchRow + 2, ('\t Cab:\t' + format(switches[0], '08b')).expandtabs())
+                    for p in range(1, board.playerCount + 1):
+                        start = 1 + (btnBytes * (p - 1))
+                        dash.set(switchRow + 3 + p, ('\t P' + str(p) + ':\t' + ' '.join(format(b, '08b') for b in switches[start:start + btnBytes])).expandtabs())
+                if publisher:
+                    read = polled is not None and polled[1] is not None
+                    if read:
+                        coins[:] = packCoins(polled[1])
+                else:
+                    read = jvsIO.getCoinCount(into=coins)
+                if not read:
+                    dash.set(messageRow, "Error reading coins")
+                elif coins != lastCoins:
+                    lastCoins = bytes(coins)
+                    if ledger:
+                        ledger.update(coins)
+                    for c, (condition, count) in enumerate(decodeCoins(coins)):
+                        coinSlot[c] = count
+                        text = "Coin slot " + str(c + 1) + ': ' + str(count) + ' COIN(S)'
+                        match condition:
+                            case JVS_CoinCodes.JVS_COIN_JAM:
+                                text += ' E: Jammed'
+                            case JVS_CoinCodes.JVS_COIN_BUSY:
+                                text += ' I: Busy'
+                            case JVS_CoinCodes.JVS_COIN_NOCOUNTER:
+                                text += ' E: No Coin Counter'
+                        dash.set(coinRow + c, text)
+            if (time() - gpoWrite >= 0.15) and board.gpoCount > 0:
+                gpoWrite = time()
+                # The animation is drawn for 17 outputs, show what fits on this board
+                gpo = int(animationCycle[gpoI], 2) & ((1 << board.gpoCount) - 1)
+                if jvsIO.setGPO(packGPO(gpo, board.gpoCount)):
+                    dash.set(gpoRow, 'GPO: ' + ' '.join(format(b, '08b') for b in jvsIO.gpo) + ' 0x' + format(gpo, '05x'))
+                    gpoI = (gpoI + 1) % len(animationCycle)
+                else:
+                    dash.set(messageRow, "Error setting outputs")
+
+                if(coinSlot[0] > 0):
+                    coinDec = jvsIO.decCoinCounter()
+                    if not coinDec:
+                        dash.set(messageRow, "Error decrementing coin slot 0")
+                else:
+                    coinInc = jvsIO.incCoinCounter()
+                    if not coinInc:
+                        dash.set(messageRow, "Error incrementing coin slot 0")
+            if dash.due():
+                dash.set(statsRow, stats.text())
+                dash.render()
+    except KeyboardInterrupt:
+        pass
+    dash.close()
+    if ledger:
+        ledger.close()
+    jvsIO.sendReset()
+    return 0
+
+def probe(jvsIO, args):
+    """Prints the board's name. Connecting already proved it's there."""
+    print(jvsIO.ioBoard.name.strip('\x00\x01'))
+    return 0
+
+def boardInfo(board: JVSIO):
+    """Name, versions and features of a connected board as a dict."""
+    from dataclasses import asdict
+    info = asdict(board)
+    info['name'] = board.name.strip('\x00\x01')
+    info['character_type'] = int(board.character_type)
+    return info
+
+def dumpFeatures(jvsIO, args):
+    if args.json:
+        import json
+        print(json.dumps(boardInfo(jvsIO.ioBoard), indent=2))
+        return 0
+    jvsIO.printName()
+    jvsIO.printVersions()
+    jvsIO.printFeatures()
+    return 0
+
+def pollInputs(jvsIO, args):
+    """Polls switches, coins and analog inputs count times, one line per poll."""
+    if args.json:
+        import json
+    ledger = None
+    if args.ledger:
+        from jvsledger import JVS_CoinLedger
+        ledger = JVS_CoinLedger(args.ledger)
+    failed = 0
+    for n in range(0, args.count):
+        if n:
+            sleep(args.interval)
+        polled = jvsIO.poll()
+        if not polled:
+            failed += 1
+            print('error' if not args.json else '{"error": "no reply"}', flush=True)
+            continue
+        switches, coins, analog = polled
+        if ledger and coins:
+            ledger.update(coins)
+        if args.json:
+            print(json.dumps({
+                'system': switches[0] if switches else None,
+                'players': list(switches[1]) if switches else None,
+                'coins': [count for condition, count in coins] if coins else None,
+                'coinConditions': [int(condition) for condition, count in coins] if coins else None,
+                'analog': list(analog) if analog else None
+            }), flush=True)
+            continue
+        line = []
+        if switches:
+            digits = '0' + str(2 * switchBytes(jvsIO.ioBoard)) + 'x'
+            line.append('sys=' + format(switches[0], '02x'))
+            for p, value in enumerate(switches[1]):
+                line.append('p' + str(p + 1) + '=' + format(value, digits))
+        if coins:
+            line.append('coins=' + ','.join(str(count) for condition, count in coins))
+        if analog:
+            line.append('analog=' + ','.join(str(value) for value in analog))
+        print(' '.join(line), flush=True)
+    if ledger:
+        ledger.close()
+    return 0 if failed == 0 else 1
+
+def setOutputs(jvsIO, args):
+    """Sets the GPOs to a number, bit 0 = output 1."""
+    count = jvsIO.ioBoard.gpoCount
+    value = int(args.value, 0)
+    if count == 0:
+        print('IO board has no GPO outputs', file=sys.stderr)
+        return 1
+    if value >= (1 << count):
+        print('Value too big for ' + str(count) + ' outputs', file=sys.stderr)
+        return 1
+    return 0 if jvsIO.setGPO(packGPO(value, count)) else 1
+
+def coin(jvsIO, args):
+    """Adds or takes coins from a slot, then prints every slot's count."""
+    for n in range(0, args.add):
+        if not jvsIO.incCoinCounter(args.slot):
+            print('Error incrementing coin slot ' + str(args.slot), file=sys.stderr)
+            return 1
+    for n in range(0, args.sub):
+        if not jvsIO.decCoinCounter(args.slot):
+            print('Error decrementing coin slot ' + str(args.slot), file=sys.stderr)
+            return 1
+    coins = jvsIO.getCoinCount()
+    if not coins:
+        print('Error reading coins', file=sys.stderr)
+        return 1
+    print(' '.join(str(count) for condition, count in decodeCoins(coins)))
+    return 0
+
+def startupTime():
+    """Imports jvs in a fresh interpreter under -X importtime. Returns the cumulative import time of jvs in seconds."""
+    import subprocess
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import jvs'], capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == 'jvs':
+            return int(fields[1]) / 1000000
+    return None
+
+def measureWrites(jvsIO, count: int = 1000):
+    """Times write() of a switch request under each direction control mode the port supports. Returns {mode: seconds per frame}.
+    The frames go to a node nobody answers to, so nothing comes back."""
+    frame = jvsIO.framePool.get()
+    frame.nodeID = 0x7E
+    frame.data += bytes((JVS_READSWITCH_CODE, 2, 2))
+    saved = jvsIO.directionControl
+    results = {}
+    for mode in ("rts", "none", "kernel"):
+        if jvsIO.setDirectionControl(mode) != mode:
+            continue
+        start = monotonic()
+        for n in range(0, count):
+            jvsIO.write(frame)
+        results[mode] = (monotonic() - start) / count
+    jvsIO.setDirectionControl(saved)
+    jvsIO.framePool.release(frame)
+    return results
+
+def bench(jvsIO, args):
+    """Times getInputs() round trips and write() per direction control mode, and checks the import time budget."""
+    status = 0
+    if args.startup_budget:
+        startup = startupTime()
+        if startup is None:
+            print('Couldn\'t measure import time')
+            status = 1
+        else:
+            ok = startup * 1000 <= args.startup_budget
+            print('Import time: ' + format(startup * 1000, '.1f') + ' ms (budget ' + format(args.startup_budget, '.1f') + ' ms) ' + ('ok' if ok else 'OVER'))
+            if not ok:
+                status = 1
+    if jvsIO is None:
+        return status
+    switches = bytearray()
+    times = []
+    failed = 0
+    start = monotonic()
+    for n in range(0, args.count):
+        started = monotonic()
+        if not jvsIO.getInputs(into=switches):
+            failed += 1
+        times.append(monotonic() - started)
+    elapsed = monotonic() - start
+    times.sort()
+    print(str(args.count) + ' polls in ' + format(elapsed, '.2f') + ' s, ' + format(args.count / elapsed, '.1f') + ' polls/s' + (', ' + str(failed) + ' failed' if failed else ''))
+    print('\tmin ' + format(times[0] * 1000, '.3f') + ' ms, median ' + format(times[len(times) // 2] * 1000, '.3f') \
+        + ' ms, p99 ' + format(times[int(0.99 * (len(times) - 1))] * 1000, '.3f') + ' ms, max ' + format(times[-1] * 1000, '.3f') + ' ms')
+    if args.writes:
+        print('write() per frame (' + str(args.writes) + ' frames):')
+        for mode, perFrame in measureWrites(jvsIO, args.writes).items():
+            print('\t' + mode.ljust(8) + format(perFrame * 1000000, '.1f') + ' us')
+    return status if failed == 0 else 1
+
 def main(args = None):
-    parser = ArgumentParser(description = "JVS handler script.")
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description = "JVS handler script. Runs the interactive monitor unless a command is given.")
     parser.add_argument(
 		"-p", "--port",
 		type = str,
-		help = "serial port to use",
+		help = "serial port to use, tty:<device> for the raw tty transport or loopback for an emulated board",
 		metavar = "port"
 	)
     parser.add_argument(
@@ -610,109 +1225,157 @@ def main(args = None):
 		help = "override default baud rate (115200)",
 		metavar = "value"
 	)
+    parser.add_argument(
+		"-s", "--sense",
+		type = str,
+		choices = list(SENSE_LINES),
+		help = "modem status line wired to JVS sense",
+	)
+    parser.add_argument(
+		"-d", "--direction",
+		type = str,
+		choices = list(DIRECTION_MODES),
+		default = "auto",
+		help = "RS-485 transmitter switching: kernel (TIOCSRS485), rts toggling, none, or auto to use kernel if the port supports it (default)",
+	)
+    parser.add_argument(
+		"--shm",
+		type = str,
+		help = "publish input state to this shared memory file for other processes",
+		metavar = "path"
+	)
+    parser.add_argument(
+		"--ledger",
+		type = str,
+		help = "record coins to this ledger file (see jvsledger.py)",
+		metavar = "path"
+	)
+    parser.add_argument(
+		"--fps",
+		type = float,
+		default = 30,
+		help = "screen refresh rate cap (default 30)",
+		metavar = "value"
+	)
 	# the -h/--help option is added automatically by default
-
-    # now, to clear the screen
-    cls()
+    commands = parser.add_subparsers(dest = "command", metavar = "command")
+    commands.add_parser("monitor", help = "interactive dashboard (default)")
+    commands.add_parser("probe", help = "print the board name, exit status 0 if a board answered")
+    command = commands.add_parser("dump-features", help = "print the board's versions and features")
+    command.add_argument(
+		"--json",
+		action = "store_true",
+		help = "print as JSON"
+	)
+    command = commands.add_parser("poll", help = "print switch, coin and analog state")
+    command.add_argument(
+		"-n", "--count",
+		type = int,
+		default = 1,
+		help = "number of polls (default 1)",
+		metavar = "count"
+	)
+    command.add_argument(
+		"-i", "--interval",
+		type = float,
+		default = 0.1,
+		help = "seconds between polls (default 0.1)",
+		metavar = "seconds"
+	)
+    command.add_argument(
+		"--json",
+		action = "store_true",
+		help = "print one JSON object per poll"
+	)
+    command = commands.add_parser("set-gpo", help = "set the GPO outputs")
+    command.add_argument(
+		"value",
+		type = str,
+		help = "output state as a number, e.g. 0x0F, bit 0 is output 1"
+	)
+    command = commands.add_parser("coin", help = "add or take coins, then print the coin counts")
+    command.add_argument(
+		"--slot",
+		type = int,
+		default = 1,
+		help = "coin slot (default 1)",
+		metavar = "slot"
+	)
+    command.add_argument(
+		"--add",
+		type = int,
+		default = 0,
+		help = "coins to add",
+		metavar = "count"
+	)
+    command.add_argument(
+		"--sub",
+		type = int,
+		default = 0,
+		help = "coins to take",
+		metavar = "count"
+	)
+    command = commands.add_parser("bench", help = "time switch reads (on the loopback emulator if no port is given) and check import time")
+    command.add_argument(
+		"-n", "--count",
+		type = int,
+		default = 1000,
+		help = "number of polls (default 1000)",
+		metavar = "count"
+	)
+    command.add_argument(
+		"--startup-budget",
+		type = float,
+		default = 0,
+		help = "fail if importing jvs takes longer than this",
+		metavar = "ms"
+	)
+    command.add_argument(
+		"--writes",
+		type = int,
+		default = 0,
+		help = "also time this many frame writes under each direction control mode",
+		metavar = "count"
+	)
 
     args = parser.parse_args(args)
-    print("Serial port is", args.port)
-    jvsIOBoard = JVSIO()
-    with Serial(args.port, args.baud) as port:
-        sleep(0.25)
-
-        jvsIO = JVS(port, jvsIOBoard)
-        ioState = jvsIO.connect()
-        if ioState == ConnectState.CONNECTED:
-            print("Connected to:")
-            jvsIO.printName()
-            jvsIO.printVersions()
-            jvsIO.printFeatures()
-            gpo = 0x00
-            switchRead = 0
-            gpoWrite = 0
-            coinSlot = [0,0,0,0]
-            endConnection = False
-            print("\033[s")
-            gpoI = 0
-            while not endConnection:
-                print("\033[u")
-                if (time() - switchRead >= 0.005):
-                    switchRead = time()
-                    switches = jvsIO.getInputs()
-                    if(switches):
-                        btnBytes = 0
-                        byteMax = int((1 * (jvsIO.ioBoard.switchCount / 8) + 1))
-                        for x in range(0, byteMax):
-                            btnBytes += 1
-
-                        print('Switches:')
-                        print('\t\tT123xxxx (Test, Tilt 123)')
-                        print(str('\t Cab:\t' + format(int(switches[0]), '08b')))
-                        print('\t\tS$UDLR12 345678+')
-                        for p in range(1, jvsIO.ioBoard.playerCount + 1):
-                            print(str('\t P' + str(p) + ':\t'), end='')
-                            for x in range(0, btnBytes):
-                                i = (x + (btnBytes * (p - 1))) + 1
-                                print(format(int(switches[i]), '08b') + ' ', end='')
-                            print()
-                    else:
-                        print("Error reading switches")
-
-                    print()
-                    coins: bytearray = jvsIO.getCoinCount()
-                    if(coins):
-                        for c in range(0, jvsIO.ioBoard.coinCount):
-                            condition = coins.pop(0)
-                            count = (((condition & 0x3F) << 8) + coins.pop(0))
-                            print("Coin slot " + str(c + 1) + ': ' + str(count) + ' COIN(S)', end='')
-                            condition = condition >> 6
-                            coinSlot[c] = count
-                            match condition:
-                                case JVS_CoinCodes.JVS_COIN_JAM:
-                                    print(' E: Jammed')
-                                case JVS_CoinCodes.JVS_COIN_BUSY:
-                                    print(' I: Busy')
-                                case JVS_CoinCodes.JVS_COIN_NOCOUNTER:
-                                    print(' E: No Coin Counter')
-                                case JVS_CoinCodes.JVS_COIN_NORMAL:
-                                    print()
-                    else:
-                        print("Error reading coins")
-                if (time() - gpoWrite >= 0.15) and jvsIO.ioBoard.gpoCount > 0:
-                    print()
-                    gpoWrite = time()
-                    
-                    #if gpo == 0:
-                    #    gpo = 0x01
-                    #elif gpo > 0 and gpo < 0x10000 :
-                    #    gpo = gpo << 1
-                    #else:
-                    #    gpo = 0
-                    gpoResult = jvsIO.setGPO(bin=animationCycle[gpoI].tobytes)
-                    if(gpoResult):
-                        if gpoI < len(animationCycle) - 1:
-                            gpoI += 1
-                        else:
-                            gpoI = 0
-                        print('GPO: ' + format((BitArray(bin=animationCycle[gpoI]).int) >> 16 & 0xFF, '08b') \
-                                + ' ' + format((BitArray(bin=animationCycle[gpoI]).int) >> 8 & 0xFF, '08b') \
-                                + ' ' + format((BitArray(bin=animationCycle[gpoI]).int) & 0xFF, '08b') \
-                                + ' 0x' + format(BitArray(bin=animationCycle[gpoI]).int, '05x') )
-                    else:
-                        print("Error setting outputs")
-                    
-                    if(coinSlot[0] > 0):
-                        coinDec = jvsIO.decCoinCounter()
-                        if not coinDec:
-                            print("Error decrementing coin slot 0")
-                    else:
-                        coinInc = jvsIO.incCoinCounter()
-                        if not coinInc:
-                            print("Error decrementing coin slot 0")
-                
-        jvsIO.sendReset()
+    command = args.command if args.command else "monitor"
+    handler = {
+        "monitor": monitor, "probe": probe, "dump-features": dumpFeatures, "poll": pollInputs,
+        "set-gpo": setOutputs, "coin": coin, "bench": bench
+    }[command]
+    if args.port is None:
+        if command != "bench":
+            parser.error("a serial port is needed (-p)")
+        if args.count == 0:
+            return bench(None, args)
+        args.port = "loopback"
+
+    if command == "monitor":
+        # now, to clear the screen
+        cls()
+        print("Serial port is", args.port)
+    from contextlib import redirect_stdout, nullcontext
+    # Only the monitor talks on stdout while connecting, for everything else it's the command's output
+    chatter = nullcontext() if command == "monitor" else redirect_stdout(sys.stderr)
+    from jvstransport import openTransport
+    with openTransport(args.port, args.baud) as port:
+        if command == "monitor":
+            sleep(0.25)
+        jvsIO = JVS(port, JVSIO(), sense=args.sense)
+        jvsIO.setDirectionControl(args.direction)
+        with chatter:
+            ioState = jvsIO.connect()
+        if ioState != ConnectState.CONNECTED:
+            print("No IO board found on " + str(args.port), file=sys.stderr)
+            result = 1
+        else:
+            result = handler(jvsIO, args)
+            if command != "monitor":
+                with redirect_stdout(sys.stderr):
+                    jvsIO.disconnect()
+    return result
 
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
\ No newline at end of file
+    sys.exit(main(sys.argv[1:]))
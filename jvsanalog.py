@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Analog output waveform streaming through JVS_ANALOGOUT_CODE, for force feedback and motor cabinets.
+#
+# Per channel sample arrays are converted to wire bytes up front, one ready-made frame payload per
+# sample with every channel in it, so the streaming loop only has to hand payloads to the bus on
+# schedule. The conversion uses NumPy when it is installed and the array module otherwise. Both
+# interleave and byte swap without a Python level loop over the samples; only scaling float samples
+# without NumPy goes value by value.
+
+from argparse import ArgumentParser
+from array import array
+from dataclasses import dataclass
+from time import sleep, monotonic
+import sys, math
+from jvsmacros import *
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+@dataclass
+class JVS_StreamStats:
+    samples: int = 0        # Samples in the waveform(s) played
+    sent: int = 0           # Frames the board acknowledged
+    failed: int = 0         # Frames the board didn't acknowledge
+    underruns: int = 0      # Samples that went out later than one period after their deadline
+    dropped: int = 0        # Samples skipped to catch back up
+    maxLateness: float = 0.0
+    elapsed: float = 0.0
+    targetRate: float = 0.0
+
+    @property
+    def achievedRate(self):
+        return (self.sent / self.elapsed) if self.elapsed > 0 else 0.0
+
+def _scale(samples):
+    """Integer samples pass through as 16 bit values, floats are taken as 0.0 to 1.0 of full scale."""
+    if numpy is not None:
+        data = numpy.asarray(samples)
+        if data.dtype.kind == 'f':
+            data = numpy.rint(numpy.clip(data, 0.0, 1.0) * 0xFFFF)
+        else:
+            data = numpy.clip(data, 0, 0xFFFF)
+        return data.astype(numpy.uint16)
+    if isinstance(samples, array) and samples.typecode in 'BH':
+        return array('H', samples)
+    values = list(samples)
+    if values and isinstance(values[0], float):
+        return array('H', (int(min(max(v, 0.0), 1.0) * 0xFFFF + 0.5) for v in values))
+    # Clamp to 16 bits like the NumPy path, array('H') raises on anything outside
+    return array('H', (min(max(v, 0), 0xFFFF) for v in values))
+
+def packSamples(*channels):
+    """Converts per channel sample arrays (NumPy arrays, array.array or sequences, all the same length) into one JVS_ANALOGOUT_CODE payload per sample.
+    Returns the payloads back to back as bytes and the size of each one."""
+    count = len(channels)
+    if count == 0:
+        raise ValueError('No channels given')
+    frameSize = 2 + (2 * count)
+    scaled = [_scale(samples) for samples in channels]
+    length = len(scaled[0])
+    for samples in scaled:
+        if len(samples) != length:
+            raise ValueError('Channels must have the same number of samples')
+    if numpy is not None:
+        block = numpy.empty((length, frameSize), dtype=numpy.uint8)
+        block[:, 0] = JVS_ANALOGOUT_CODE
+        block[:, 1] = count
+        values = numpy.stack(scaled, axis=1).astype('>u2')    # (samples, channels), big endian on the wire
+        block[:, 2:] = values.view(numpy.uint8).reshape(length, 2 * count)
+        return block.tobytes(), frameSize
+    # array fallback: interleave the channels with strided slice assignment, then swap to big endian
+    interleaved = array('H', bytes(2 * length * count))
+    for c, samples in enumerate(scaled):
+        interleaved[c::count] = samples
+    if sys.byteorder == 'little':
+        interleaved.byteswap()
+    data = array('B', interleaved.tobytes())
+    block = array('B', bytes(length * frameSize))
+    block[0::frameSize] = array('B', [JVS_ANALOGOUT_CODE]) * length
+    block[1::frameSize] = array('B', [count]) * length
+    for k in range(0, 2 * count):
+        block[2 + k::frameSize] = data[k::2 * count]
+    return block.tobytes(), frameSize
+
+class JVS_AnalogStreamer():
+    def __init__(self, jvsIO, rate: float):
+        """Streams waveforms to a connected JVS board's analog outputs at rate samples per second."""
+        if jvsIO.ioBoard.analogOutCount == 0:
+            raise ValueError('IO board has no analog outputs')
+        self.jvs = jvsIO
+        self.rate = rate
+        self.dropLate = True    # Skip samples that are already a period late rather than falling further behind
+        self._block = b''
+        self._frameSize = 0
+        self._samples = 0
+        self._stop = False
+
+    def load(self, *channels):
+        """Loads one sample array per analog output, starting from output 1. Fewer channels than the board has is fine."""
+        if len(channels) > self.jvs.ioBoard.analogOutCount:
+            raise ValueError('IO board only has ' + str(self.jvs.ioBoard.analogOutCount) + ' analog outputs')
+        self._block, self._frameSize = packSamples(*channels)
+        self._samples = len(self._block) // self._frameSize
+
+    def stop(self):
+        """Stops play() from another thread."""
+        self._stop = True
+
+    def play(self, loops: int = 1):
+        """Streams the loaded waveform loops times (0 = until stop()). Returns a JVS_StreamStats."""
+        stats = JVS_StreamStats(targetRate=self.rate)
+        if self._samples == 0:
+            return stats
+        period = 1.0 / self.rate
+        view = memoryview(self._block)
+        frameSize = self._frameSize
+        self._stop = False
+        # waitForReply() sleeps replyInterval before each check, which alone would cap the rate at 1/replyInterval
+        savedInterval = self.jvs.replyInterval
+        self.jvs.replyInterval = 0
+        start = monotonic()
+        tick = 0
+        loop = 0
+        try:
+            while not self._stop and (loops == 0 or loop < loops):
+                for i in range(0, self._samples):
+                    if self._stop:
+                        break
+                    deadline = start + (tick * period)
+                    tick += 1
+                    now = monotonic()
+                    if deadline > now:
+                        wait = deadline - now
+                        if wait > 0.002:
+                            sleep(wait - 0.001)     # Sleep most of the way, spin the rest for accuracy
+                        while monotonic() < deadline:
+                            pass
+                    else:
+                        late = now - deadline
+                        stats.maxLateness = max(stats.maxLateness, late)
+                        if late > period:
+                            stats.underruns += 1
+                            if self.dropLate:
+                                stats.dropped += 1
+                                continue
+                    reply = self.jvs.requestRaw(view[i * frameSize:(i + 1) * frameSize])
+                    if reply and reply[0] == JVS_ReportCodes.JVS_REPORT_NORMAL:
+                        stats.sent += 1
+                    else:
+                        stats.failed += 1
+                stats.samples += self._samples
+                loop += 1
+        finally:
+            self.jvs.replyInterval = savedInterval
+        stats.elapsed = monotonic() - start
+        return stats
+
+def sineWave(rate: float, frequency: float, seconds: float, amplitude: float = 0.5, offset: float = 0.5):
+    """Float samples (0.0 to 1.0) of a sine wave, as NumPy array if available."""
+    count = int(rate * seconds)
+    if numpy is not None:
+        t = numpy.arange(count) / rate
+        return offset + (amplitude * numpy.sin(2 * numpy.pi * frequency * t))
+    return [offset + (amplitude * math.sin(2 * math.pi * frequency * (n / rate))) for n in range(0, count)]
+
+def main(args = None):
+    parser = ArgumentParser(description = "Stream a test waveform to a JVS board's analog outputs.")
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		default = "loopback",
+		help = "port to use, as for jvs.py -p (default loopback)",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-r", "--rate",
+		type = float,
+		default = 200,
+		help = "samples per second (default 200)",
+		metavar = "hz"
+	)
+    parser.add_argument(
+		"-f", "--frequency",
+		type = float,
+		default = 1,
+		help = "sine frequency (default 1 Hz)",
+		metavar = "hz"
+	)
+    parser.add_argument(
+		"-t", "--time",
+		type = float,
+		default = 5,
+		help = "seconds to stream (default 5)",
+		metavar = "seconds"
+	)
+    args = parser.parse_args(args)
+
+    from jvs import JVS, JVSIO, ConnectState
+    from jvstransport import openTransport
+    jvsIO = JVS(openTransport(args.port, args.baud), JVSIO())
+    if jvsIO.connect() != ConnectState.CONNECTED:
+        print('Couldn\'t connect to an IO board on ' + args.port)
+        return 1
+    streamer = JVS_AnalogStreamer(jvsIO, args.rate)
+    wave = sineWave(args.rate, args.frequency, args.time)
+    streamer.load(*([wave] * jvsIO.ioBoard.analogOutCount))
+    stats = streamer.play()
+    print('Sent ' + str(stats.sent) + '/' + str(stats.samples) + ' samples in ' + format(stats.elapsed, '.2f') + ' s')
+    print('\tRate: ' + format(stats.achievedRate, '.1f') + ' Hz of ' + format(stats.targetRate, '.1f') + ' Hz')
+    print('\tUnderruns: ' + str(stats.underruns) + ' (' + str(stats.dropped) + ' dropped), worst lateness ' + format(stats.maxLateness * 1000, '.2f') + ' ms')
+    if stats.failed:
+        print('\tFailed: ' + str(stats.failed))
+    jvsIO.disconnect()
+    return 0 if stats.failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
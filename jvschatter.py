@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+# Switch chatter and debounce analysis.
+#
+# JVS_InputHistory sits in the JVS input pipeline (JVS.inputFilters) and records every switch state
+# transition as a row of (timestamp, bit index, new state) in fixed size NumPy columns used as a ring,
+# so memory stays bounded however long it runs. Polls where nothing changed cost one compare.
+# analyze() works over the columns in a few vectorized passes: press durations, bounces (transitions
+# that follow another on the same bit within a window) and bits that have been held too long.
+#
+# JVS_Debouncer is an optional filter for the same pipeline.
+#
+# Bit index 0 is the MSB of the first byte of the switch report (the cabinet Test switch), bit 8 is the
+# MSB of Player 1's first byte, and so on, matching the order main() prints them in.
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from time import monotonic
+import sys
+import numpy
+from jvscodec import switchBytes
+
+@dataclass
+class JVS_BitReport:
+    bit: int = 0
+    transitions: int = 0
+    presses: int = 0
+    bounces: int = 0
+    minPress: float = 0.0
+    meanPress: float = 0.0
+    maxPress: float = 0.0
+    held: float = 0.0       # How long it has been active, if it still is
+    stuck: bool = False
+
+def bitName(bit: int, switchBytes: int):
+    """Human name for a bit index, e.g. 'Cab 0' or 'P1 3'."""
+    if bit < 8:
+        return 'Cab ' + str(bit)
+    player, index = divmod(bit - 8, 8 * switchBytes)
+    return 'P' + str(player + 1) + ' ' + str(index)
+
+class JVS_InputHistory():
+    def __init__(self, capacity: int = 1 << 20):
+        """Records switch transitions in a ring of capacity rows."""
+        self.capacity = capacity
+        self.timestamps = numpy.zeros(capacity, dtype=numpy.float64)
+        self.bits = numpy.zeros(capacity, dtype=numpy.uint16)
+        self.states = numpy.zeros(capacity, dtype=numpy.uint8)
+        self.count = 0          # Rows ever written, the ring holds the last min(count, capacity)
+        self.polls = 0
+        self.startTime = None
+        self.lastTime = None
+        self._last = None       # Previous report as an int
+        self._width = 0         # Bits in the report
+
+    def __call__(self, switches):
+        """Input pipeline hook for JVS.inputFilters. Records and passes the report through unchanged."""
+        self.record(switches)
+        return switches
+
+    def record(self, switches, timestamp: float = None):
+        """Records one switch report."""
+        now = monotonic() if timestamp is None else timestamp
+        value = int.from_bytes(switches, 'big')
+        self.polls += 1
+        self.lastTime = now
+        if self._last is None:
+            self.startTime = now
+            self._width = 8 * len(switches)
+            self._last = value
+            # Record bits that start out active so durations and stuck checks see them
+            changed = value
+        else:
+            changed = value ^ self._last
+            if not changed:
+                return
+            self._last = value
+        width = self._width
+        while changed:
+            low = changed & -changed
+            position = low.bit_length() - 1
+            changed ^= low
+            row = self.count % self.capacity
+            self.timestamps[row] = now
+            self.bits[row] = width - 1 - position
+            self.states[row] = 1 if (value & low) else 0
+            self.count += 1
+
+    def rows(self):
+        """The recorded (timestamps, bits, states) columns, oldest first."""
+        if self.count <= self.capacity:
+            return self.timestamps[:self.count], self.bits[:self.count], self.states[:self.count]
+        start = self.count % self.capacity
+        order = numpy.concatenate((numpy.arange(start, self.capacity), numpy.arange(0, start)))
+        return self.timestamps[order], self.bits[order], self.states[order]
+
+    @property
+    def overflowed(self):
+        return self.count > self.capacity
+
+    def analyze(self, window: float = 0.005, stuckAfter: float = 10.0, now: float = None):
+        """Works out per bit statistics from the recorded transitions. Returns a list of JVS_BitReport for bits that changed or are stuck.
+        Transitions within window seconds of the previous one on the same bit count as bounces, presses shorter than window are ignored for durations."""
+        timestamps, bits, states = self.rows()
+        if len(bits) == 0:
+            return []
+        now = self.lastTime if now is None else now
+        # Group by bit, in time order within each bit
+        order = numpy.lexsort((timestamps, bits))
+        t = timestamps[order]
+        b = bits[order]
+        s = states[order]
+        sameBit = b[1:] == b[:-1]
+        gaps = numpy.diff(t)
+        # Bounces: a transition soon after the previous one on the same bit
+        bounce = sameBit & (gaps < window)
+        # Presses: an on transition followed by an off on the same bit
+        press = sameBit & (s[:-1] == 1) & (s[1:] == 0)
+        durations = gaps[press]
+        pressBits = b[:-1][press]
+        real = durations >= window
+        durations = durations[real]
+        pressBits = pressBits[real]
+
+        uniqueBits, firstIndex, counts = numpy.unique(b, return_index=True, return_counts=True)
+        bounceCounts = numpy.bincount(b[1:][bounce], minlength=int(b.max()) + 1)
+        pressCounts = numpy.bincount(pressBits, minlength=int(b.max()) + 1)
+        sums = numpy.bincount(pressBits, weights=durations, minlength=int(b.max()) + 1)
+        mins = numpy.full(int(b.max()) + 1, numpy.inf)
+        maxs = numpy.zeros(int(b.max()) + 1)
+        numpy.minimum.at(mins, pressBits, durations)
+        numpy.maximum.at(maxs, pressBits, durations)
+        # Last row for each bit tells whether it's still held
+        lastIndex = firstIndex + counts - 1
+        lastState = s[lastIndex]
+        lastTime = t[lastIndex]
+
+        reports = []
+        for i, bit in enumerate(uniqueBits):
+            bit = int(bit)
+            report = JVS_BitReport(bit=bit, transitions=int(counts[i]), presses=int(pressCounts[bit]), bounces=int(bounceCounts[bit]))
+            if report.presses:
+                report.minPress = float(mins[bit])
+                report.maxPress = float(maxs[bit])
+                report.meanPress = float(sums[bit] / report.presses)
+            if lastState[i]:
+                report.held = float(now - lastTime[i])
+                report.stuck = report.held >= stuckAfter
+            reports.append(report)
+        return reports
+
+class JVS_Debouncer():
+    def __init__(self, window: float = 0.005, eager: bool = True):
+        """Debounce filter for JVS.inputFilters.
+        Eager mode passes a change straight through and then holds that bit for window seconds, so presses aren't delayed.
+        Otherwise a change is only passed once the bit has been steady for window seconds."""
+        self.window = window
+        self.eager = eager
+        self._output = None     # Debounced state as an int
+        self._pending = 0       # Bits that differ from the output
+        self._since = {}        # Bit mask -> time it last changed (or was accepted, in eager mode)
+
+    def __call__(self, switches, timestamp: float = None):
+        now = monotonic() if timestamp is None else timestamp
+        value = int.from_bytes(switches, 'big')
+        if self._output is None:
+            self._output = value
+            return switches
+        output = self._output
+        changed = value ^ output
+        if self.eager:
+            while changed:
+                low = changed & -changed
+                changed ^= low
+                if now - self._since.get(low, -self.window) >= self.window:
+                    output ^= low
+                    self._since[low] = now
+        else:
+            # Restart the timer for any bit whose raw value moved since the last poll
+            moved = (value ^ output) ^ self._pending
+            while moved:
+                low = moved & -moved
+                moved ^= low
+                self._since[low] = now
+            self._pending = changed
+            while changed:
+                low = changed & -changed
+                changed ^= low
+                if now - self._since.get(low, now) >= self.window:
+                    output ^= low
+                    self._pending &= ~low
+        if output != self._output:
+            self._output = output
+            switches[:] = output.to_bytes(len(switches), 'big')
+        elif output != value:
+            switches[:] = output.to_bytes(len(switches), 'big')
+        return switches
+
+def printReport(reports: list, history: JVS_InputHistory, switchBytes: int):
+    elapsed = (history.lastTime - history.startTime) if history.polls else 0
+    print(str(history.polls) + ' polls over ' + format(elapsed, '.1f') + ' s, ' + str(history.count) + ' transitions' \
+        + (' (oldest dropped)' if history.overflowed else ''))
+    for r in reports:
+        line = '\t' + bitName(r.bit, switchBytes).ljust(8) + ' ' + str(r.presses) + ' presses, ' + str(r.bounces) + ' bounces'
+        if r.presses:
+            line += ', held ' + format(r.minPress * 1000, '.1f') + '/' + format(r.meanPress * 1000, '.1f') + '/' + format(r.maxPress * 1000, '.1f') + ' ms (min/mean/max)'
+        if r.stuck:
+            line += ', STUCK for ' + format(r.held, '.1f') + ' s'
+        elif r.bounces:
+            line += ', BOUNCING'
+        print(line)
+
+def main(args = None):
+    parser = ArgumentParser(description = "Record switch transitions and look for bouncing or stuck switches.")
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		required = True,
+		help = "serial port to use",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-t", "--time",
+		type = float,
+		default = 60,
+		help = "seconds to record (default 60)",
+		metavar = "seconds"
+	)
+    parser.add_argument(
+		"-w", "--window",
+		type = float,
+		default = 5,
+		help = "bounce window (default 5 ms)",
+		metavar = "ms"
+	)
+    parser.add_argument(
+		"--stuck",
+		type = float,
+		default = 10,
+		help = "seconds held before a switch counts as stuck (default 10)",
+		metavar = "seconds"
+	)
+    parser.add_argument(
+		"-d", "--debounce",
+		type = float,
+		default = 0,
+		help = "debounce the inputs after recording them (ms, default off)",
+		metavar = "ms"
+	)
+    args = parser.parse_args(args)
+
+    from serial import Serial
+    from jvs import JVS, JVSIO, ConnectState
+    jvsIO = JVS(Serial(args.port, args.baud), JVSIO())
+    if jvsIO.connect() != ConnectState.CONNECTED:
+        print('Couldn\'t connect to an IO board on ' + args.port)
+        return 1
+    history = JVS_InputHistory()
+    jvsIO.inputFilters.append(history)
+    if args.debounce > 0:
+        jvsIO.inputFilters.append(JVS_Debouncer(args.debounce / 1000))
+    switches = bytearray()
+    end = monotonic() + args.time
+    print('Recording for ' + str(args.time) + ' s, press buttons now...')
+    try:
+        while monotonic() < end:
+            jvsIO.getInputs(into=switches)
+    except KeyboardInterrupt:
+        pass
+    printReport(history.analyze(args.window / 1000, args.stuck), history, switchBytes(jvsIO.ioBoard))
+    jvsIO.disconnect()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+# Table driven codec for the JVS command set.
+#
+# Every command is described once in JVS_COMMANDS: the struct layout of its parameters, how its report
+# data is laid out (usually depending on the request parameters, which depend on the board's feature
+# counts) and how the unpacked values become a result. JVS_Codec compiles those layouts into struct.Struct
+# objects for a particular board, packs requests and decodes a reply holding several reports in one pass.
+
+import struct
+from dataclasses import dataclass
+from jvsmacros import *
+
+class JVS_Error(Exception):
+    pass
+
+# Special reply layouts that can't be expressed as a struct format
+REPLY_STRING = 'z'          # Null terminated ASCII string
+REPLY_FEATURES = 'features' # 4 byte feature entries up to an end code
+
+@dataclass(frozen = True, slots = True)
+class JVS_CommandSpec:
+    code: int
+    name: str
+    request: str = ''       # struct format of the fixed parameters after the command code
+    counted: str = ''       # Items following the fixed parameters: a struct code repeated count times (count is sent first), or 'z' for a null terminated string
+    reply: object = ''      # struct format of the report data, a function (args) -> format, or one of the REPLY_ layouts
+    decode: object = None   # Turns the tuple of unpacked values into the result. Defaults to True for empty reports, the value itself for single values, else the tuple
+    report: bool = True     # False for commands the board never answers (reset)
+    idempotent: bool = True # False if running the command twice has a different effect to running it once
+
+def _switchLayout(args):
+    # Cabinet byte, then one value per player. Odd widths come out as bytes and get converted in _decodeSwitches().
+    players, switchBytes = args
+    return 'B' + ({1: 'B', 2: 'H', 4: 'I'}.get(switchBytes, str(switchBytes) + 's') * players)
+
+def _decodeSwitches(values):
+    # (cabinet byte, (P1, P2, ...)) with each player's first switch byte in the high bits
+    players = values[1:]
+    if players and not isinstance(players[0], int):
+        players = tuple(int.from_bytes(p, 'big') for p in players)
+    return (values[0], players)
+
+def _decodeCoins(values):
+    # Condition in the top 2 bits, count in the low 14
+    return tuple((v >> 14, v & 0x3FFF) for v in values)
+
+JVS_COMMANDS = {}
+
+def _command(*args, **kwargs):
+    spec = JVS_CommandSpec(*args, **kwargs)
+    JVS_COMMANDS[spec.code] = spec
+    JVS_COMMANDS[spec.name] = spec
+
+# Broadcast commands
+_command(JVS_RESET_CODE, 'reset', 'B', report=False)
+_command(JVS_SETADDR_CODE, 'setaddr', 'B', idempotent=False)    # Sent twice, the next board down the chain takes the address too
+_command(JVS_COMCHG_CODE, 'comchg', 'B', report=False)
+# Init commands
+_command(JVS_IOIDENT_CODE, 'ioident', reply=REPLY_STRING)
+_command(JVS_CMDREV_CODE, 'cmdrev', reply='B', decode=lambda values: bcd2dec(values[0]))
+_command(JVS_JVSREV_CODE, 'jvsrev', reply='B', decode=lambda values: bcd2dec(values[0]))
+_command(JVS_COMVER_CODE, 'comver', reply='B', decode=lambda values: bcd2dec(values[0]))
+_command(JVS_FEATCHK_CODE, 'featchk', reply=REPLY_FEATURES)
+_command(JVS_MAINID_CODE, 'mainid', counted='z')
+# Data I/O commands
+_command(JVS_READSWITCH_CODE, 'switch', 'BB', reply=_switchLayout, decode=_decodeSwitches)
+_command(JVS_READCOIN_CODE, 'coin', 'B', reply=lambda args: str(args[0]) + 'H', decode=_decodeCoins)
+_command(JVS_READANALOG_CODE, 'analog', 'B', reply=lambda args: str(args[0]) + 'H', decode=tuple)
+_command(JVS_READROTARY_CODE, 'rotary', 'B', reply=lambda args: str(args[0]) + 'H', decode=tuple)
+_command(JVS_READKEY_CODE, 'key', reply='B')
+_command(JVS_READSCREENPOS_CODE, 'screenpos', 'B', reply='HH', decode=tuple)
+_command(JVS_READMISC_CODE, 'misc', 'B', reply=lambda args: str(args[0]) + 's', decode=lambda values: int.from_bytes(values[0], 'big'))
+# Output commands
+_command(JVS_READPAYOUT_CODE, 'payout', 'B', reply='B3s', decode=lambda values: (values[0], int.from_bytes(values[1], 'big')))
+_command(JVS_DATARETRY_CODE, 'retry', idempotent=False)
+_command(JVS_COINDECREASE_CODE, 'coindec', 'BH', idempotent=False)
+_command(JVS_PAYOUTINCREASE_CODE, 'payoutinc', 'BH', idempotent=False)
+_command(JVS_GENERICOUT1_CODE, 'gpo1', counted='s')
+_command(JVS_ANALOGOUT_CODE, 'analogout', counted='H')
+_command(JVS_CHARACTEROUT_CODE, 'charout', counted='s')
+_command(JVS_COININCREASE_CODE, 'coininc', 'BH', idempotent=False)
+_command(JVS_PAYOUTDECREASE_CODE, 'payoutdec', 'BH', idempotent=False)
+_command(JVS_GENERICOUT2_CODE, 'gpo2', 'BB')
+_command(JVS_GENERICOUT3_CODE, 'gpo3', 'BB')
+
+# Feature entries and the JVSIO fields their parameters fill in, in parameter order (None = unused)
+JVS_FEATURE_FIELDS = {
+    JVS_FeatureCodes.JVS_FEATURE_SWITCH: ('playerCount', 'switchCount', None),
+    JVS_FeatureCodes.JVS_FEATURE_COIN: ('coinCount', None, None),
+    JVS_FeatureCodes.JVS_FEATURE_ANALOG: ('analogCount', 'analogPrecision', None),
+    JVS_FeatureCodes.JVS_FEATURE_ROTARY: ('rotaryCount', None, None),
+    JVS_FeatureCodes.JVS_FEATURE_KEYCODE: (None, None, None),
+    JVS_FeatureCodes.JVS_FEATURE_SCREEN: ('screen_x', 'screen_y', 'screen_c'),
+    JVS_FeatureCodes.JVS_FEATURE_MISC: (None, None, None),      # 16 bit count, see applyFeatures()
+    JVS_FeatureCodes.JVS_FEATURE_CARD: ('cardCount', None, None),
+    JVS_FeatureCodes.JVS_FEATURE_MEDAL: ('medalCount', None, None),
+    JVS_FeatureCodes.JVS_FEATURE_GPO: ('gpoCount', None, None),
+    JVS_FeatureCodes.JVS_FEATURE_ANALOG_OUT: ('analogOutCount', None, None),
+    JVS_FeatureCodes.JVS_FEATURE_CHARACTER: ('character_w', 'character_h', 'character_type'),
+    JVS_FeatureCodes.JVS_FEATURE_BACKUP: (None, None, None)
+}
+
+def applyFeatures(ioBoard, features):
+    """Fills in a JVSIO from decoded feature entries (code, p1, p2, p3)."""
+    for code, p1, p2, p3 in features:
+        fields = JVS_FEATURE_FIELDS.get(code)
+        if fields is None:
+            continue
+        for name, value in zip(fields, (p1, p2, p3)):
+            if name:
+                setattr(ioBoard, name, value)
+        if code == JVS_FeatureCodes.JVS_FEATURE_MISC:
+            ioBoard.extraSwitchCount = (p2 + (p1 << 8))
+        elif code == JVS_FeatureCodes.JVS_FEATURE_BACKUP:
+            ioBoard.backupSupport = True
+        elif code == JVS_FeatureCodes.JVS_FEATURE_CHARACTER:
+            try:
+                ioBoard.character_type = JVS_CharaOutputTypes(p3)
+            except ValueError:
+                pass    # Leave unknown types as the raw number
+    return ioBoard
+
+def switchBytes(ioBoard):
+    """Bytes per player in a switch report, as requested by JVS.getInputs()."""
+    return int((1 * (ioBoard.switchCount / 8))) + 1
+
+def gpoBytes(ioBoard):
+    """Bytes in the board's GPO bitmap, one bit per output."""
+    return (ioBoard.gpoCount + 7) // 8
+
+def packGPO(outputs: int, gpoCount: int):
+    """Turns an int with bit n set for output n + 1 into the GPO bitmap as the board takes it: GPO 1 is the top bit of the first byte."""
+    state = bytearray((gpoCount + 7) // 8)
+    for n in range(0, gpoCount):
+        if outputs >> n & 1:
+            state[n >> 3] |= 0x80 >> (n & 7)
+    return bytes(state)
+
+def gpoCommands(state: bytes, shown: bytes = None):
+    """Smallest set of commands to take the outputs from shown to state (both bitmaps as packGPO() gives), or the whole bitmap with GENERICOUT1 if shown is None.
+    Each changed byte costs 3 bytes with GENERICOUT2 (or GENERICOUT3 when only one of its bits changed, which leaves the others to the board), against 2 plus the bitmap for GENERICOUT1."""
+    if shown is None or len(shown) != len(state):
+        return [(JVS_GENERICOUT1_CODE, bytes(state))]
+    commands = []
+    for index in range(0, len(state)):
+        changed = state[index] ^ shown[index]
+        if not changed:
+            continue
+        if changed & (changed - 1):
+            commands.append((JVS_GENERICOUT2_CODE, index, state[index]))
+        else:
+            commands.append((JVS_GENERICOUT3_CODE, (index << 3) + 8 - changed.bit_length(), 1 if state[index] & changed else 0))
+    if 3 * len(commands) >= 2 + len(state):
+        return [(JVS_GENERICOUT1_CODE, bytes(state))]
+    return commands
+
+def decodeSwitches(data, players: int, switchBytes: int):
+    """Splits a raw switch report (as returned by JVS.getInputs()) into the cabinet byte and one int per player, first byte in the high bits."""
+    return data[0], tuple(int.from_bytes(data[1 + (p * switchBytes):1 + ((p + 1) * switchBytes)], 'big') for p in range(0, players))
+
+def decodeCoins(data):
+    """Splits a raw coin report (as returned by JVS.getCoinCount()) into (condition, count) for each slot."""
+    return _decodeCoins(struct.unpack_from('>' + str(len(data) // 2) + 'H', data))
+
+def packSwitches(cabinet: int, players, switchBytes: int):
+    """Raw switch report from what decodeSwitches() (or JVS.poll()) gives, the other way round."""
+    return bytes((cabinet,)) + b''.join(player.to_bytes(switchBytes, 'big') for player in players)
+
+def packCoins(coins):
+    """Raw coin report from (condition, count) pairs as decodeCoins() (or JVS.poll()) gives them."""
+    return struct.pack('>' + str(len(coins)) + 'H', *((condition << 14) | count for condition, count in coins))
+
+def packAnalog(values):
+    """Raw analog report from the values JVS.poll() gives, 2 bytes each MSB first."""
+    return struct.pack('>' + str(len(values)) + 'H', *values)
+
+_structs = {}
+
+def _struct(fmt: str):
+    compiled = _structs.get(fmt)
+    if compiled is None:
+        compiled = _structs[fmt] = struct.Struct('>' + fmt)
+    return compiled
+
+class JVS_Codec():
+    def __init__(self, ioBoard = None):
+        """Packs requests and decodes replies for one IO board. Call compile() again after the board's features change."""
+        self.ioBoard = ioBoard
+        self._layouts = {}
+        self.compile()
+
+    def compile(self):
+        """Precompiles the reply layouts for the board's usual polls from its feature counts."""
+        self._layouts.clear()
+        board = self.ioBoard
+        if board is None:
+            return
+        if board.playerCount:
+            self.layout(JVS_COMMANDS[JVS_READSWITCH_CODE], (board.playerCount, switchBytes(board)))
+        if board.coinCount:
+            self.layout(JVS_COMMANDS[JVS_READCOIN_CODE], (board.coinCount,))
+        if board.analogCount:
+            self.layout(JVS_COMMANDS[JVS_READANALOG_CODE], (board.analogCount,))
+        if board.rotaryCount:
+            self.layout(JVS_COMMANDS[JVS_READROTARY_CODE], (board.rotaryCount,))
+        if board.extraSwitchCount:
+            self.layout(JVS_COMMANDS[JVS_READMISC_CODE], ((board.extraSwitchCount + 7) // 8,))
+
+    def layout(self, spec: JVS_CommandSpec, args: tuple):
+        """Returns the compiled reply Struct for a command with the given parameters."""
+        if not callable(spec.reply):
+            return _struct(spec.reply)
+        key = (spec.code, args)
+        compiled = self._layouts.get(key)
+        if compiled is None:
+            compiled = self._layouts[key] = _struct(spec.reply(args))
+        return compiled
+
+    def pack(self, command, *args):
+        """Packs one command and its parameters. command is a code or name from JVS_COMMANDS.
+        Counted commands take their items as the last argument (bytes, a sequence of ints or a str for 'z'), the count is filled in."""
+        spec = JVS_COMMANDS[command]
+        packet = bytearray((spec.code,))
+        if spec.counted:
+            fixed = args[:-1]
+            items = args[-1]
+        else:
+            fixed = args
+            items = None
+        if spec.request:
+            packet += _struct(spec.request).pack(*fixed)
+        if spec.counted == 'z':
+            packet += (items.encode('ascii') if isinstance(items, str) else bytes(items)) + b'\x00'
+        elif spec.counted == 's':
+            packet.append(len(items))
+            packet += bytes(items)
+        elif spec.counted:
+            packet.append(len(items))
+            packet += _struct(str(len(items)) + spec.counted).pack(*items)
+        return packet
+
+    def packAll(self, commands):
+        """Packs a list of (command, *args) tuples into one frame payload."""
+        packet = bytearray()
+        for command in commands:
+            packet += self.pack(*command)
+        return packet
+
+    def unpackRequest(self, data, offset: int = 0):
+        """Reads one command from a request payload. Returns (spec, args, next offset), with args shaped as pack() takes them. Raises KeyError for unknown commands."""
+        spec = JVS_COMMANDS[data[offset]]
+        offset += 1
+        args = ()
+        if spec.request:
+            fixed = _struct(spec.request)
+            args = fixed.unpack_from(data, offset)
+            offset += fixed.size
+        if spec.counted == 'z':
+            end = bytes(data).find(b'\x00', offset)
+            end = end if end >= 0 else len(data)
+            args += (bytes(data[offset:end]).decode('ascii', errors='replace'),)
+            offset = end + 1
+        elif spec.counted == 's':
+            count = data[offset]
+            args += (bytes(data[offset + 1:offset + 1 + count]),)
+            offset += 1 + count
+        elif spec.counted:
+            count = data[offset]
+            items = _struct(str(count) + spec.counted)
+            args += (items.unpack_from(data, offset + 1),)
+            offset += 1 + items.size
+        return spec, args, offset
+
+    def unpackRequests(self, data):
+        """Reads every command in a request payload. Returns a list of (spec, args)."""
+        commands = []
+        offset = 0
+        while offset < len(data):
+            spec, args, offset = self.unpackRequest(data, offset)
+            commands.append((spec, args))
+        return commands
+
+    def idempotent(self, data):
+        """True if running the commands in a request payload twice has the same effect as running them once. Payloads that don't parse count as not."""
+        try:
+            return all(spec.idempotent for spec, args in self.unpackRequests(data))
+        except (KeyError, IndexError, struct.error):
+            return False
+
+    def decodeReport(self, spec: JVS_CommandSpec, args: tuple, data, offset: int = 0):
+        """Decodes one report (report byte and data) starting at offset. Returns (result, next offset). result is None if the board didn't report normal."""
+        if not spec.report:
+            return None, offset
+        if offset >= len(data):
+            raise JVS_Error('Reply too short for ' + spec.name)
+        if data[offset] != JVS_ReportCodes.JVS_REPORT_NORMAL:
+            return None, offset + 1
+        offset += 1
+        match spec.reply:
+            case 'z':
+                end = offset
+                while end < len(data) and data[end] != 0:
+                    end += 1
+                return bytes(data[offset:end]).decode('ascii', errors='replace'), end + 1
+            case 'features':
+                features = []
+                while offset + 4 <= len(data):
+                    code = bcd2dec(data[offset])
+                    if code == JVS_FeatureCodes.JVS_FEATURE_END:
+                        offset += 1
+                        break
+                    features.append((code, data[offset + 1], data[offset + 2], data[offset + 3]))
+                    offset += 4
+                else:
+                    offset = len(data)
+                return tuple(features), offset
+        layout = self.layout(spec, args)
+        if offset + layout.size > len(data):
+            raise JVS_Error('Reply too short for ' + spec.name)
+        values = layout.unpack_from(data, offset)
+        offset += layout.size
+        if spec.decode:
+            result = spec.decode(values)
+        elif not values:
+            result = True
+        elif len(values) == 1:
+            result = values[0]
+        else:
+            result = values
+        return result, offset
+
+    def decodeReply(self, commands, data):
+        """Decodes the reports for a list of (command, *args) requests from one reply payload, in a single pass. Returns a list of results."""
+        results = []
+        offset = 0
+        for command in commands:
+            spec = JVS_COMMANDS[command[0]]
+            result, offset = self.decodeReport(spec, tuple(command[1:]), data, offset)
+            if spec.report:
+                results.append(result)
+        return results
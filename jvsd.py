@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+# JVS bus multiplexer daemon.
+#
+# Owns the serial port and the JVS object and serves local clients over a Unix domain socket, so the
+# test tools, the Tk app and game bridges can share one IO board. Messages are one JSON object per line.
+#
+# Reads are coalesced: every client asking for inputs, coins or analog while the bus is busy is answered
+# from a single JVS.poll() frame, which reads all three, made after their request arrived. Writes (GPO,
+# coin counters) are run one at a time in the order they arrived, between polls.
+
+from argparse import ArgumentParser
+import sys, os, json, socket, selectors
+from time import monotonic
+
+JVSD_DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'jvsd.sock')
+
+# Read commands, in the order JVS.poll() returns their reports
+JVSD_READS = ('inputs', 'coins', 'analog')
+JVSD_WRITES = ('gpo', 'coin-dec', 'coin-inc')
+
+class JVSD_Error(Exception):
+    pass
+
+class _Client():
+    def __init__(self, sock):
+        self.sock = sock
+        self.rxBuffer = bytearray()
+        self.txBuffer = bytearray()
+
+class JVS_Daemon():
+    def __init__(self, jvsIO, path: str = JVSD_DEFAULT_SOCKET):
+        """Serves a connected JVS object to local clients on a Unix domain socket at path."""
+        self.jvs = jvsIO
+        self.path = path
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}
+        self.pendingReads = {}  # command -> list of clients waiting on the next poll
+        self.pendingWrites = [] # (client, request) in arrival order
+        self.requestCount = 0
+        self.busCount = 0
+        self.startTime = monotonic()
+        self.running = False
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(64)
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+
+    def close(self):
+        self.running = False
+        for client in list(self.clients.values()):
+            self._drop(client)
+        self.selector.unregister(self.server)
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def serve(self):
+        """Runs until stop() is called or the board is lost."""
+        from jvs import ConnectState
+        self.running = True
+        while self.running:
+            # Don't block on sockets while there is bus work queued
+            timeout = 0 if (self.pendingReads or self.pendingWrites) else 0.1
+            for key, events in self.selector.select(timeout):
+                if key.data is None:
+                    self._accept()
+                else:
+                    if events & selectors.EVENT_READ:
+                        self._receive(key.data)
+                    if events & selectors.EVENT_WRITE:
+                        self._flush(key.data)
+            self._runBus()
+            if self.jvs.connectState == ConnectState.LOST:
+                print('IO board lost, stopping')
+                self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def _accept(self):
+        sock, _ = self.server.accept()
+        sock.setblocking(False)
+        client = _Client(sock)
+        self.clients[sock.fileno()] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def _drop(self, client):
+        self.clients.pop(client.sock.fileno(), None)
+        for waiting in self.pendingReads.values():
+            while client in waiting:
+                waiting.remove(client)
+        self.pendingWrites = [w for w in self.pendingWrites if w[0] is not client]
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _receive(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        client.rxBuffer += data
+        while True:
+            end = client.rxBuffer.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(client.rxBuffer[:end])
+            del client.rxBuffer[:end + 1]
+            self._dispatch(client, line)
+
+    def _dispatch(self, client, line: bytes):
+        self.requestCount += 1
+        try:
+            request = json.loads(line)
+            cmd = request['cmd']
+        except (ValueError, KeyError, TypeError):
+            self._reply(client, {'ok': False, 'error': 'bad request'})
+            return
+        if not isinstance(cmd, str):
+            self._reply(client, {'ok': False, 'error': 'bad request: cmd must be a string'})
+            return
+        if cmd in JVSD_READS:
+            self.pendingReads.setdefault(cmd, []).append(client)
+        elif cmd in JVSD_WRITES:
+            # Check arguments now so nothing a client sends can fail once it's on the bus
+            error = self._checkWrite(request)
+            if error:
+                self._reply(client, {'ok': False, 'error': 'bad request: ' + error})
+            else:
+                self.pendingWrites.append((client, request))
+        elif cmd == 'info':
+            self._reply(client, self.info())
+        else:
+            self._reply(client, {'ok': False, 'error': 'unknown command ' + str(cmd)})
+
+    def info(self):
+        """Board identity and multiplexing statistics."""
+        board = self.jvs.ioBoard
+        return {
+            'ok': True,
+            'name': board.name,
+            'players': board.playerCount,
+            'switches': board.switchCount,
+            'coins': board.coinCount,
+            'analog': board.analogCount,
+            'gpo': board.gpoCount,
+            'clients': len(self.clients),
+            'requests': self.requestCount,
+            'busTransactions': self.busCount,
+            'uptime': monotonic() - self.startTime
+        }
+
+    def _runBus(self):
+        # Writes go first and one at a time so clients see outputs in the order they were asked for
+        writes = self.pendingWrites
+        self.pendingWrites = []
+        for client, request in writes:
+            self._reply(client, self._write(request))
+        reads = self.pendingReads
+        self.pendingReads = {}
+        if not reads:
+            return
+        # One frame for everyone, whichever reports they asked for
+        self.busCount += 1
+        reports = self._poll()
+        for cmd, waiting in reads.items():
+            result = reports.get(cmd)
+            if result:
+                reply = {'ok': True, 'data': result.hex(), 'poll': self.busCount}
+            else:
+                reply = {'ok': False, 'error': cmd + ' read failed'}
+            encoded = (json.dumps(reply) + '\n').encode()
+            for client in waiting:
+                self._send(client, encoded)
+
+    def _poll(self):
+        """Raw reports by read command from one JVS.poll(), as getInputs(), getCoinCount() and getAnalog() would have returned them. Missing reports are left out."""
+        from jvscodec import packSwitches, packCoins, packAnalog, switchBytes
+        polled = self.jvs.poll()
+        if polled is None:
+            return {}
+        switches, coins, analog = polled
+        reports = {}
+        if switches is not None:
+            reports['inputs'] = packSwitches(*switches, switchBytes(self.jvs.ioBoard))
+        if coins is not None:
+            reports['coins'] = packCoins(coins)
+        if analog is not None:
+            reports['analog'] = packAnalog(analog)
+        return reports
+
+    def _checkWrite(self, request: dict):
+        """Why a write request can't be run, or None if it's fine."""
+        if request['cmd'] == 'gpo':
+            data = request.get('data')
+            if not isinstance(data, str):
+                return 'data must be a hex string'
+            try:
+                bytes.fromhex(data)
+            except ValueError:
+                return 'data must be a hex string'
+        else:
+            slot = request.get('slot', 0)
+            if not isinstance(slot, int) or isinstance(slot, bool) or not 0 <= slot <= 0xFF:
+                return 'slot must be an integer from 0 to 255'
+        return None
+
+    def _write(self, request: dict):
+        self.busCount += 1
+        try:
+            match request['cmd']:
+                case 'gpo':
+                    result = self.jvs.setGPO(bytes.fromhex(request['data']))
+                case 'coin-dec':
+                    result = self.jvs.decCoinCounter(request.get('slot', 0))
+                case 'coin-inc':
+                    result = self.jvs.incCoinCounter(request.get('slot', 0))
+        except (KeyError, ValueError, TypeError, OverflowError) as e:
+            return {'ok': False, 'error': 'bad request: ' + str(e)}
+        if not result:
+            return {'ok': False, 'error': request['cmd'] + ' failed'}
+        return {'ok': True, 'poll': self.busCount}
+
+    def _reply(self, client, reply: dict):
+        self._send(client, (json.dumps(reply) + '\n').encode())
+
+    def _send(self, client, data: bytes):
+        if client.sock.fileno() not in self.clients:
+            return
+        client.txBuffer += data
+        self._flush(client)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.txBuffer)
+            del client.txBuffer[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._drop(client)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.txBuffer else 0)
+        self.selector.modify(client.sock, events, client)
+
+class JVS_Client():
+    def __init__(self, path: str = JVSD_DEFAULT_SOCKET, timeout: float = 2):
+        """Client for jvsd. Has the same read/write methods as JVS so it can stand in for one."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._file = self.sock.makefile('rb')
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def request(self, cmd: str, **args):
+        """Sends one request and waits for its reply. Raises JVSD_Error if the daemon reports a failure."""
+        args['cmd'] = cmd
+        self.sock.sendall((json.dumps(args) + '\n').encode())
+        line = self._file.readline()
+        if not line:
+            raise JVSD_Error('jvsd closed the connection')
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise JVSD_Error(reply.get('error', 'request failed'))
+        return reply
+
+    def info(self):
+        return self.request('info')
+
+    def _read(self, cmd: str):
+        try:
+            return bytearray.fromhex(self.request(cmd)['data'])
+        except JVSD_Error:
+            return 0
+
+    def getInputs(self):
+        return self._read('inputs')
+
+    def getCoinCount(self):
+        return self._read('coins')
+
+    def getAnalog(self):
+        return self._read('analog')
+
+    def _write(self, cmd: str, **args):
+        try:
+            self.request(cmd, **args)
+            return 1
+        except JVSD_Error:
+            return 0
+
+    def setGPO(self, state: bytes):
+        return self._write('gpo', data=bytes(state).hex())
+
+    def decCoinCounter(self, slots: int = 0):
+        return self._write('coin-dec', slot=slots)
+
+    def incCoinCounter(self, slots: int = 0):
+        return self._write('coin-inc', slot=slots)
+
+def main(args = None):
+    from jvs import JVS, JVSIO, ConnectState, DIRECTION_MODES
+    parser = ArgumentParser(description = "JVS bus multiplexer daemon.")
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		required = True,
+		help = "serial port to use, tty:<device> for the raw tty transport or loopback for an emulated board",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-s", "--sense",
+		type = str,
+		choices = ["DSR", "DCD"],
+		help = "modem status line wired to JVS sense",
+	)
+    parser.add_argument(
+		"-d", "--direction",
+		type = str,
+		choices = list(DIRECTION_MODES),
+		default = "auto",
+		help = "RS-485 transmitter switching: kernel (TIOCSRS485), rts toggling, none, or auto to use kernel if the port supports it (default)",
+	)
+    parser.add_argument(
+		"--socket",
+		type = str,
+		default = JVSD_DEFAULT_SOCKET,
+		help = "unix socket to serve on (default " + JVSD_DEFAULT_SOCKET + ")",
+		metavar = "path"
+	)
+    args = parser.parse_args(args)
+
+    from jvstransport import openTransport
+    port = openTransport(args.port, args.baud)
+    jvsIO = JVS(port, JVSIO(), sense=args.sense)
+    jvsIO.setDirectionControl(args.direction)
+    if jvsIO.connect() != ConnectState.CONNECTED:
+        print('Couldn\'t connect to an IO board on ' + args.port)
+        return 1
+    jvsIO.printName()
+    daemon = JVS_Daemon(jvsIO, args.socket)
+    print('Serving on ' + args.socket)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    daemon.close()
+    jvsIO.disconnect()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Terminal dashboard for watching a board without slowing the poll loop down.
+#
+# Callers set whole lines of text whenever their values change; that's a string compare when nothing
+# did. render() does nothing until the next frame is due, then compares each line with what the terminal
+# is showing and writes only the span that differs, positioned with an ANSI cursor move, in one write().
+# Plain ANSI sequences rather than curses so it also works in Windows terminals without extra packages.
+
+from time import monotonic
+import sys
+
+class JVS_Dashboard():
+    def __init__(self, out = None, fps: float = 30):
+        """Diffing ANSI renderer, out is the stream to draw on (default stdout). Redraws at most fps times a second."""
+        self.out = out if out else sys.stdout
+        self.period = 1 / fps
+        self.lines = []     # What should be on screen
+        self.shown = []     # What is on screen
+        self.nextFrame = 0.0
+        self.frames = 0
+        self.bytesWritten = 0
+        self._started = False
+
+    def start(self):
+        """Clears the screen and hides the cursor."""
+        self.out.write('\033[2J\033[H\033[?25l')
+        self.out.flush()
+        self.shown = []
+        self._started = True
+
+    def close(self):
+        """Draws anything outstanding, puts the cursor under the dashboard and shows it again."""
+        if not self._started:
+            return
+        self.render(force=True)
+        self.out.write('\033[' + str(len(self.shown) + 1) + ';1H\033[?25h')
+        self.out.flush()
+        self._started = False
+
+    def set(self, row: int, text: str):
+        """Sets line row (from 0) of the dashboard."""
+        lines = self.lines
+        if row >= len(lines):
+            lines.extend([''] * (row + 1 - len(lines)))
+        lines[row] = text
+
+    def truncate(self, rows: int):
+        """Drops lines from rows on, e.g. when a board with fewer players is connected."""
+        del self.lines[rows:]
+
+    def due(self, now: float = None):
+        """True when the next frame is due, so callers can leave per-frame figures (rates, timings) until then."""
+        return (monotonic() if now is None else now) >= self.nextFrame
+
+    def render(self, force: bool = False):
+        """Writes the changed parts of the screen if a frame is due. Returns the number of characters written."""
+        now = monotonic()
+        if not force and now < self.nextFrame:
+            return 0
+        self.nextFrame = now + self.period
+        lines = self.lines
+        shown = self.shown
+        out = []
+        for row in range(0, max(len(lines), len(shown))):
+            new = lines[row] if row < len(lines) else ''
+            old = shown[row] if row < len(shown) else ''
+            if new == old:
+                continue
+            # First and last differing columns
+            start = 0
+            limit = min(len(new), len(old))
+            while start < limit and new[start] == old[start]:
+                start += 1
+            end = len(new)
+            if len(new) == len(old):
+                while end > start and new[end - 1] == old[end - 1]:
+                    end -= 1
+            out.append('\033[' + str(row + 1) + ';' + str(start + 1) + 'H')
+            if len(new) < len(old):
+                # Shorter than before, rewrite the tail and clear the rest of the line
+                out.append(new[start:] + '\033[K')
+            else:
+                out.append(new[start:end])
+        self.shown = list(lines)
+        self.frames += 1
+        if not out:
+            return 0
+        data = ''.join(out)
+        self.out.write(data)
+        self.out.flush()
+        self.bytesWritten += len(data)
+        return len(data)
+
+class JVS_PollStats():
+    def __init__(self, window: float = 1.0):
+        """Polls per second and request round trip times over a sliding window of about window seconds."""
+        self.window = window
+        self.rate = 0.0
+        self.last = 0.0
+        self.mean = 0.0
+        self.max = 0.0
+        self._count = 0
+        self._total = 0.0
+        self._worst = 0.0
+        self._start = monotonic()
+
+    def add(self, latency: float):
+        """Counts one poll that took latency seconds."""
+        self._count += 1
+        self._total += latency
+        self.last = latency
+        if latency > self._worst:
+            self._worst = latency
+        now = monotonic()
+        if now - self._start >= self.window:
+            elapsed = now - self._start
+            self.rate = self._count / elapsed
+            self.mean = self._total / self._count
+            self.max = self._worst
+            self._count = 0
+            self._total = 0.0
+            self._worst = 0.0
+            self._start = now
+
+    def text(self):
+        return 'Polls/s: ' + format(self.rate, '7.1f') + '   Latency: last ' + format(self.last * 1000, '6.2f') \
+            + ' ms, mean ' + format(self.mean * 1000, '6.2f') + ' ms, max ' + format(self.max * 1000, '6.2f') + ' ms'
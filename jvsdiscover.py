@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+# Serial port discovery and JVS board auto-detection.
+#
+# candidatePorts() lists the ttys a board could be on. probePort() resets the bus, addresses the first
+# board and asks for its identity, with replies given only a fraction of a tight deadline so a port with
+# nothing on it fails fast. JVS_PortDiscovery probes every candidate at once on a thread pool, so a scan
+# takes about one deadline however many ports there are, and keeps the result until the set of device
+# nodes changes (a USB adapter plugged in or pulled out), which only needs a few stat() calls to notice.
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from time import monotonic
+import sys, os, glob, json
+
+# Where serial adapters show up, by-id links first so the stable name is kept when both point at one device
+DISCOVER_PATTERNS = (
+    '/dev/serial/by-id/*',
+    '/dev/ttyUSB*',
+    '/dev/ttyACM*',
+    '/dev/ttyS*',
+    '/dev/cu.*'         # macOS
+)
+
+@dataclass
+class JVS_DiscoveredPort:
+    port: str = ""          # Path to open, the by-id link when there is one
+    device: str = ""        # What it resolves to
+    found: bool = False     # A board answered
+    name: str = ""          # Its identity string
+    duration: float = 0.0
+    error: str = ""
+
+def _isPlaceholder(device: str):
+    """True for 8250 ttyS nodes with no UART behind them, which Linux creates whether or not the hardware exists."""
+    name = os.path.basename(device)
+    if not name.startswith('ttyS'):
+        return False
+    try:
+        with open('/sys/class/tty/' + name + '/type') as f:
+            return f.read().strip() == '0'
+    except OSError:
+        return False
+
+def candidatePorts(patterns: tuple = DISCOVER_PATTERNS):
+    """Returns (port, device) for every tty a board could be on, one entry per device."""
+    ports = []
+    seen = set()
+    for pattern in patterns:
+        for port in sorted(glob.glob(pattern)):
+            device = os.path.realpath(port)
+            if device in seen or _isPlaceholder(device):
+                continue
+            seen.add(device)
+            ports.append((port, device))
+    if not ports and sys.platform == 'win32':
+        from serial.tools import list_ports
+        ports = [(info.device, info.device) for info in list_ports.comports()]
+    return ports
+
+def probePort(port: str, baud: int = 115200, deadline: float = 0.5, openPort = None):
+    """Resets the bus on port, addresses the first board and reads its name, giving up after about deadline seconds. Returns a JVS_DiscoveredPort.
+    The board is reset again afterwards so the next connect() starts clean."""
+    from jvs import JVS, JVSIO, ConnectState, JVS_Error
+    from jvstransport import openTransport
+    result = JVS_DiscoveredPort(port=port, device=os.path.realpath(port))
+    start = monotonic()
+    jvsIO = None
+    try:
+        transport = openPort(port, baud) if openPort else openTransport(port, baud)
+        jvsIO = JVS(transport, JVSIO())
+        # Fit every attempt waitForReply() may make in the deadline
+        jvsIO.replyTimeout = deadline / (1 + jvsIO.replyRetries)
+        jvsIO.replyInterval = 0.001
+        jvsIO.setConnectState(ConnectState.CONNECTING)
+        transport.reset_input_buffer()
+        jvsIO.sendReset()
+        jvsIO.assignID()
+        jvsIO.requestName()
+        result.found = True
+        result.name = jvsIO.ioBoard.name.strip('\x00\x01')
+    except (JVS_Error, OSError, ValueError) as e:
+        result.error = str(e) if str(e) else type(e).__name__
+    except Exception as e:
+        # pyserial raises its own SerialException for ports that can't be opened
+        result.error = str(e)
+    finally:
+        if jvsIO:
+            try:
+                if result.found:
+                    jvsIO.sendReset()
+                jvsIO.cuPort.close()
+            except Exception:
+                pass
+            jvsIO.setConnectState(ConnectState.DISCONNECTED)
+        result.duration = monotonic() - start
+    return result
+
+class JVS_PortDiscovery():
+    def __init__(self, baud: int = 115200, deadline: float = 0.5, patterns: tuple = DISCOVER_PATTERNS, openPort = None):
+        """Finds the ports with a JVS board on them and caches the answer until devices are plugged or unplugged."""
+        self.baud = baud
+        self.deadline = deadline
+        self.patterns = patterns
+        self.openPort = openPort
+        self.results = None
+        self._signature = None
+        self._excluded = frozenset()     # Ports the cached scan skipped
+
+    def signature(self):
+        """Identifies the current set of device nodes. Replugging an adapter recreates its node, which changes this."""
+        signature = []
+        for port, device in candidatePorts(self.patterns):
+            try:
+                st = os.stat(device)
+            except OSError:
+                continue
+            signature.append((port, st.st_rdev, st.st_ctime_ns))
+        return tuple(signature)
+
+    def changed(self):
+        """True if devices have come or gone since the last scan."""
+        return self.results is None or self.signature() != self._signature
+
+    def invalidate(self):
+        self.results = None
+
+    def scan(self, exclude: tuple = ()):
+        """Probes every candidate port concurrently. Returns a JVS_DiscoveredPort per port, boards found first. Ports in exclude (e.g. already connected) are skipped."""
+        signature = self.signature()
+        ports = [port for port, *_ in signature if port not in exclude]
+        results = []
+        if ports:
+            with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+                results = list(pool.map(lambda port: probePort(port, self.baud, self.deadline, self.openPort), ports))
+        results.sort(key=lambda r: not r.found)
+        self.results = results
+        self._signature = signature
+        self._excluded = frozenset(exclude)
+        return results
+
+    def discover(self, exclude: tuple = ()):
+        """The cached scan, rescanning first if devices changed or it skipped ports that are wanted now. Ports in exclude are left out."""
+        if self.changed() or not self._excluded <= set(exclude):
+            return self.scan(exclude)
+        return [r for r in self.results if r.port not in exclude]
+
+    def boards(self):
+        """Ports with a board on them, from the cache when it's still good."""
+        return [r for r in self.discover() if r.found]
+
+def main(args = None):
+    parser = ArgumentParser(description = "Find serial ports with a JVS IO board on them.")
+    parser.add_argument(
+		"ports",
+		nargs = "*",
+		help = "ports or glob patterns to check (default: usual serial device names)",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-t", "--deadline",
+		type = float,
+		default = 0.5,
+		help = "seconds to give each port (default 0.5)",
+		metavar = "seconds"
+	)
+    parser.add_argument(
+		"-a", "--all",
+		action = "store_true",
+		help = "list ports without a board too"
+	)
+    parser.add_argument(
+		"--json",
+		action = "store_true",
+		help = "print the results as JSON"
+	)
+    args = parser.parse_args(args)
+
+    discovery = JVS_PortDiscovery(args.baud, args.deadline, tuple(args.ports) if args.ports else DISCOVER_PATTERNS)
+    start = monotonic()
+    from contextlib import redirect_stdout
+    # JVS reports timeouts on stdout, keep that for the results
+    with redirect_stdout(sys.stderr):
+        results = discovery.scan()
+    elapsed = monotonic() - start
+    shown = results if args.all else [r for r in results if r.found]
+    if args.json:
+        print(json.dumps([asdict(r) for r in shown], indent=2))
+    else:
+        for r in shown:
+            print(r.port + ('' if r.device == r.port else ' (' + r.device + ')') + ': ' + (r.name if r.found else 'no board, ' + r.error))
+        print(str(sum(1 for r in results if r.found)) + ' board(s) on ' + str(len(results)) + ' port(s) in ' + format(elapsed, '.2f') + ' s', file=sys.stderr)
+    return 0 if any(r.found for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Character display output (JVS_CHARACTEROUT_CODE) with a framebuffer.
+#
+# Text is drawn into a local framebuffer of the size and character set the board reports in its
+# features. refresh() compares it with what was last sent and only sends the changed runs, each
+# prefixed with a cursor move, so updating a status line costs a few bytes instead of the whole screen.
+
+from jvsmacros import *
+
+JVS_DISPLAY_ESC = 0x1B
+JVS_DISPLAY_LOCATE = 0x48       # ESC H <address>, cursor move used by most VFD modules fitted to JVS boards
+JVS_DISPLAY_LOCATE_CELLS = 256  # The address is one byte, so ESC H only reaches this many cells
+
+# Python codec for each character type. Kanji cells hold Shift-JIS bytes, 2 cells per character.
+JVS_DISPLAY_ENCODINGS = {
+    JVS_CharaOutputTypes.JVS_CHARACTER_ASCII: 'ascii',
+    JVS_CharaOutputTypes.JVS_CHARACTER_ALPHA: 'ascii',
+    JVS_CharaOutputTypes.JVS_CHARACTER_KATA: 'shift_jis',
+    JVS_CharaOutputTypes.JVS_CHARACTER_KANJI: 'shift_jis'
+}
+
+class JVS_CharacterDisplay():
+    def __init__(self, jvsIO, width: int = 0, height: int = 0, charType: int = None):
+        """Framebuffer for an IO board's character display. Size and type default to what the board reported in requestFeatures()."""
+        board = jvsIO.ioBoard
+        self.jvs = jvsIO
+        self.width = width if width else board.character_w
+        self.height = height if height else board.character_h
+        self.charType = charType if charType is not None else board.character_type
+        if not self.width or not self.height:
+            raise ValueError('IO board has no character display')
+        if self.width * self.height > JVS_DISPLAY_LOCATE_CELLS and type(self).locate is JVS_CharacterDisplay.locate:
+            raise ValueError(str(self.width) + 'x' + str(self.height) + ' display is too big for ESC H addressing (' + str(JVS_DISPLAY_LOCATE_CELLS)
+                + ' cells), subclass and override locate() for it')
+        self.encoding = JVS_DISPLAY_ENCODINGS.get(self.charType, 'ascii')
+        self.blank = 0x20
+        self.buffer = bytearray([self.blank]) * (self.width * self.height)
+        self.shown = None   # What the display is showing, None until the first full refresh
+        self.maxPayload = 200   # Characters per frame, leaves room for the frame header and escapes
+        self.bytesSent = 0
+
+    def locate(self, x: int, y: int):
+        """Cursor move sequence for a cell. ESC H takes a one byte address, so this only reaches the first 256 cells; override it for larger displays or ones that position differently."""
+        return bytes((JVS_DISPLAY_ESC, JVS_DISPLAY_LOCATE, (y * self.width) + x))
+
+    def encode(self, text: str):
+        """Encodes text to one byte per cell in the display's character set. Characters it can't show become '?'."""
+        if self.charType == JVS_CharaOutputTypes.JVS_CHARACTER_ALPHA:
+            text = text.upper()
+        if self.charType == JVS_CharaOutputTypes.JVS_CHARACTER_KATA:
+            # Half width katakana and ASCII are one byte each in JIS X 0201, anything wider doesn't fit a cell
+            out = bytearray()
+            for c in text:
+                b = c.encode(self.encoding, errors='replace')
+                out += b if len(b) == 1 else b'?'
+            return bytes(out)
+        return text.encode(self.encoding, errors='replace')
+
+    def clear(self):
+        """Blanks the framebuffer."""
+        self.buffer[:] = bytes([self.blank]) * len(self.buffer)
+
+    def write(self, x: int, y: int, text: str):
+        """Draws text into the framebuffer at a cell, clipped to the end of the line. Returns the cells written."""
+        if not (0 <= y < self.height) or not (0 <= x < self.width):
+            return 0
+        room = self.width - x
+        data = self.encode(text)
+        if len(data) > room:
+            # Clip on whole characters, half a Kanji would leave a stray lead byte on the display
+            data = bytearray()
+            for c in text:
+                b = self.encode(c)
+                if len(data) + len(b) > room:
+                    break
+                data += b
+        start = (y * self.width) + x
+        self.buffer[start:start + len(data)] = data
+        return len(data)
+
+    def setLine(self, y: int, text: str):
+        """Replaces a whole line, padding with blanks."""
+        if not (0 <= y < self.height):
+            return
+        written = self.write(0, y, text)
+        start = (y * self.width) + written
+        self.buffer[start:(y + 1) * self.width] = bytes([self.blank]) * (self.width - written)
+
+    def scroll(self, text: str):
+        """Moves every line up one and puts text on the bottom line, for status message logs."""
+        self.buffer[0:len(self.buffer) - self.width] = self.buffer[self.width:]
+        self.setLine(self.height - 1, text)
+
+    def changedRuns(self):
+        """Returns (start, end) cell ranges that differ from what's shown. Runs closer together than a cursor move are merged, runs never cross a line."""
+        if self.shown is None:
+            return [(0, len(self.buffer))]
+        runs = []
+        gap = len(self.locate(0, 0))
+        for y in range(0, self.height):
+            lineStart = y * self.width
+            lineEnd = lineStart + self.width
+            if self.buffer[lineStart:lineEnd] == self.shown[lineStart:lineEnd]:
+                continue
+            start = None
+            last = 0
+            for i in range(lineStart, lineEnd):
+                if self.buffer[i] != self.shown[i]:
+                    if start is None:
+                        start = i
+                    elif i - last > gap:
+                        runs.append((start, last + 1))
+                        start = i
+                    last = i
+            runs.append((start, last + 1))
+        return runs
+
+    def refresh(self, full: bool = False):
+        """Sends the changed parts of the framebuffer to the display. Returns the number of bytes of display data sent, or -1 if the board didn't accept it."""
+        runs = [(0, len(self.buffer))] if full else self.changedRuns()
+        if not runs:
+            return 0
+        payload = bytearray()
+        for start, end in runs:
+            payload += self.locate(start % self.width, start // self.width)
+            payload += self.buffer[start:end]
+        if len(payload) >= len(self.buffer) + len(self.locate(0, 0)):
+            # Cheaper to redraw everything from the top
+            payload = bytearray(self.locate(0, 0)) + self.buffer
+        sent = 0
+        while sent < len(payload):
+            chunk = bytes(payload[sent:sent + self.maxPayload])
+            results = self.jvs.request((JVS_CHARACTEROUT_CODE, chunk))
+            if not results or results[0] is None:
+                # Don't know what made it, redraw everything next time
+                self.shown = None
+                return -1
+            sent += len(chunk)
+        self.shown = bytearray(self.buffer)
+        self.bytesSent += sent
+        return sent
+
+    def text(self):
+        """The framebuffer as lines of text."""
+        return [bytes(self.buffer[y * self.width:(y + 1) * self.width]).decode(self.encoding, errors='replace') for y in range(0, self.height)]
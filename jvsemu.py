@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from time import sleep, monotonic
+import sys, os, select, struct
+import threading
+from jvsmacros import *
+from jvscodec import JVS_Codec, switchBytes
+from jvs import JVS, JVSIO, ConnectState, SENSE_LINES
+
+def defaultBoard():
+    """Returns a JVSIO describing a typical 2 player cabinet IO board, used when the emulator isn't given one."""
+    board = JVSIO()
+    board.name = "PyIO-Tester;Emulated I/O Board;Ver1.00"
+    board.cmdver = 13
+    board.jvsver = 30
+    board.comver = 10
+    board.playerCount = 2
+    board.switchCount = 13
+    board.coinCount = 2
+    board.analogCount = 8
+    board.analogPrecision = 10
+    board.gpoCount = 20
+    return board
+
+class JVS_Emulator():
+    def __init__(self, ioBoard: JVSIO = None):
+        """Stand-in JVS IO board. Answers host frames either directly through process() or over a pty with start()."""
+        self.ioBoard = ioBoard if ioBoard else defaultBoard()
+        self.nodeID = 0     # 0 = not yet addressed
+        self.switches = bytearray(1 + (self.ioBoard.playerCount * switchBytes(self.ioBoard)))
+        self.coins = [0] * self.ioBoard.coinCount
+        self.coinCondition = [JVS_CoinCodes.JVS_COIN_NORMAL] * self.ioBoard.coinCount
+        self.analog = [0] * self.ioBoard.analogCount
+        self.rotary = [0] * self.ioBoard.rotaryCount
+        self.keycode = 0
+        self.misc = 0
+        self.payout = [0] * self.ioBoard.medalCount
+        self.gpo = bytearray((self.ioBoard.gpoCount + 7) // 8)
+        self.analogOut = [0] * self.ioBoard.analogOutCount
+        self.characterOut = bytearray()  # Everything sent with JVS_CHARACTEROUT_CODE, in order
+        self.display = bytearray(b' ') * (self.ioBoard.character_w * self.ioBoard.character_h)
+        self._displayCursor = 0
+        self._displayEscape = 0
+        self.mainID = ""
+        self.codec = JVS_Codec(self.ioBoard)
+        self.sense = True   # Board present on the sense line
+        self.frameCount = 0 # Host frames addressed to this board
+        self.byteCount = 0  # Raw bytes received from the host
+        self.lastReply = bytes()
+        self.unsupported = set()    # Command codes to answer with unknown command, e.g. {JVS_GENERICOUT2_CODE, JVS_GENERICOUT3_CODE} like a Sega Type 1
+        self.baudrate = None    # When set, the pty stand-in holds replies back for as long as the frames would take on a wire at this rate
+        self._rxBuffer = bytearray()
+        self._masterFD = None
+        self._slaveFD = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._senseEvent = threading.Condition()
+
+    def features(self):
+        """Builds the feature check report for the emulated board."""
+        features = bytearray()
+        board = self.ioBoard
+        if board.playerCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_SWITCH), board.playerCount, board.switchCount, 0])
+        if board.coinCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_COIN), board.coinCount, 0, 0])
+        if board.analogCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_ANALOG), board.analogCount, board.analogPrecision, 0])
+        if board.rotaryCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_ROTARY), board.rotaryCount, 0, 0])
+        if board.screen_c:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_SCREEN), board.screen_x, board.screen_y, board.screen_c])
+        if board.extraSwitchCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_MISC), board.extraSwitchCount >> 8, board.extraSwitchCount & 0xFF, 0])
+        if board.cardCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_CARD), board.cardCount, 0, 0])
+        if board.medalCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_MEDAL), board.medalCount, 0, 0])
+        if board.gpoCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_GPO), board.gpoCount, 0, 0])
+        if board.analogOutCount:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_ANALOG_OUT), board.analogOutCount, 0, 0])
+        if board.character_w:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_CHARACTER), board.character_w, board.character_h, board.character_type])
+        if board.backupSupport:
+            features += bytes([DEC2BCD(JVS_FeatureCodes.JVS_FEATURE_BACKUP), 0, 0, 0])
+        features.append(JVS_FeatureCodes.JVS_FEATURE_END)
+        return features
+
+    def handle(self, data: bytes):
+        """Runs the commands in one host frame payload. Returns (status, report data)."""
+        reply = bytearray()
+        offset = 0
+        board = self.ioBoard
+        while offset < len(data):
+            if data[offset] == JVS_DATARETRY_CODE:
+                return None, self.lastReply
+            try:
+                spec, args, offset = self.codec.unpackRequest(data, offset)
+            except (KeyError, IndexError, struct.error):
+                return JVS_StatusCodes.JVS_STATUS_UNKNOWNCMD, reply
+            if spec.code in self.unsupported:
+                return JVS_StatusCodes.JVS_STATUS_UNKNOWNCMD, reply
+            if spec.report:
+                reply.append(JVS_ReportCodes.JVS_REPORT_NORMAL)
+            match spec.code:
+                case 0xF0:  # JVS_RESET_CODE
+                    self.nodeID = 0
+                    return None, None
+                case 0xF1:  # JVS_SETADDR_CODE
+                    self.nodeID = args[0]
+                case 0x10:  # JVS_IOIDENT_CODE
+                    reply += board.name.encode('ascii') + b'\x00'
+                case 0x11:  # JVS_CMDREV_CODE
+                    reply.append(DEC2BCD(board.cmdver))
+                case 0x12:  # JVS_JVSREV_CODE
+                    reply.append(DEC2BCD(board.jvsver))
+                case 0x13:  # JVS_COMVER_CODE
+                    reply.append(DEC2BCD(board.comver))
+                case 0x14:  # JVS_FEATCHK_CODE
+                    reply += self.features()
+                case 0x15:  # JVS_MAINID_CODE
+                    self.mainID = args[0]
+                case 0x20:  # JVS_READSWITCH_CODE
+                    players, switchBytes = args
+                    stride = (len(self.switches) - 1) // max(board.playerCount, 1)
+                    reply.append(self.switches[0])
+                    for p in range(0, players):
+                        start = 1 + (p * stride)
+                        reply += self.switches[start:start + switchBytes].ljust(switchBytes, b'\x00')
+                case 0x21:  # JVS_READCOIN_CODE
+                    for c in range(0, args[0]):
+                        count = self.coins[c] if c < len(self.coins) else 0
+                        condition = self.coinCondition[c] if c < len(self.coinCondition) else JVS_CoinCodes.JVS_COIN_NOCOUNTER
+                        reply += bytes([(condition << 6) | ((count >> 8) & 0x3F), count & 0xFF])
+                case 0x22 | 0x23:  # JVS_READANALOG_CODE, JVS_READROTARY_CODE
+                    values = self.analog if spec.code == JVS_READANALOG_CODE else self.rotary
+                    for a in range(0, args[0]):
+                        reply += (values[a] if a < len(values) else 0).to_bytes(2, 'big')
+                case 0x24:  # JVS_READKEY_CODE
+                    reply.append(self.keycode)
+                case 0x25:  # JVS_READSCREENPOS_CODE
+                    reply += bytes(4)
+                case 0x26:  # JVS_READMISC_CODE
+                    reply += self.misc.to_bytes(args[0], 'big')
+                case 0x2E:  # JVS_READPAYOUT_CODE
+                    slot = args[0] - 1
+                    count = self.payout[slot] if 0 <= slot < len(self.payout) else 0
+                    reply.append(0)
+                    reply += count.to_bytes(3, 'big')
+                case 0x30 | 0x35:  # JVS_COINDECREASE_CODE, JVS_COININCREASE_CODE
+                    slot = args[0] - 1
+                    if 0 <= slot < len(self.coins):
+                        if spec.code == JVS_COINDECREASE_CODE:
+                            self.coins[slot] = max(self.coins[slot] - args[1], 0)
+                        else:
+                            self.coins[slot] = min(self.coins[slot] + args[1], 0x3FFF)
+                case 0x31 | 0x36:  # JVS_PAYOUTINCREASE_CODE, JVS_PAYOUTDECREASE_CODE
+                    slot = args[0] - 1
+                    if 0 <= slot < len(self.payout):
+                        change = args[1] if spec.code == JVS_PAYOUTINCREASE_CODE else -args[1]
+                        self.payout[slot] = max(self.payout[slot] + change, 0)
+                case 0x32:  # JVS_GENERICOUT1_CODE
+                    count = min(len(args[0]), len(self.gpo))
+                    self.gpo[0:count] = args[0][0:count]
+                case 0x33:  # JVS_ANALOGOUT_CODE
+                    for channel, value in enumerate(args[0][0:len(self.analogOut)]):
+                        self.analogOut[channel] = value
+                case 0x34:  # JVS_CHARACTEROUT_CODE
+                    self.characterOut += args[0]
+                    self._drawCharacters(args[0])
+                case 0x37:  # JVS_GENERICOUT2_CODE
+                    if args[0] < len(self.gpo):
+                        self.gpo[args[0]] = args[1]
+                case 0x38:  # JVS_GENERICOUT3_CODE
+                    byte, bit = divmod(args[0], 8)
+                    if byte < len(self.gpo):
+                        if args[1]:
+                            self.gpo[byte] |= (0x80 >> bit)
+                        else:
+                            self.gpo[byte] &= ~(0x80 >> bit) & 0xFF
+        return JVS_StatusCodes.JVS_STATUS_NORMAL, reply
+
+    def _drawCharacters(self, data: bytes):
+        # Same ESC H <address> cursor moves as jvsdisplay uses
+        for b in data:
+            if self._displayEscape == 1:
+                self._displayEscape = 2 if b == 0x48 else 0
+            elif self._displayEscape == 2:
+                self._displayCursor = b
+                self._displayEscape = 0
+            elif b == 0x1B:
+                self._displayEscape = 1
+            else:
+                if self._displayCursor < len(self.display):
+                    self.display[self._displayCursor] = b
+                self._displayCursor += 1
+
+    def encodeReply(self, status: int, data: bytes):
+        """Builds a wire frame (with escaping) for a reply to the host."""
+        body = bytearray([JVS_HOST_ADDR, len(data) + 2, status])
+        body += data
+        body.append(sum(body) % 256)
+        packet = bytearray([JVS_SYNC])
+        for b in body:
+            if b == JVS_SYNC or b == JVS_MARK:
+                packet.append(JVS_MARK)
+                packet.append(b - 1)
+            else:
+                packet.append(b)
+        return bytes(packet)
+
+    def process(self, raw: bytes):
+        """Feeds raw bytes from the host into the emulator and returns the raw reply bytes (possibly empty)."""
+        self.byteCount += len(raw)
+        if not self.sense:
+            # Unplugged boards don't answer
+            return bytes()
+        self._rxBuffer += raw
+        out = bytearray()
+        while True:
+            start = self._rxBuffer.find(JVS_SYNC)
+            if start < 0:
+                self._rxBuffer.clear()
+                break
+            del self._rxBuffer[:start]
+            # Unescape far enough to read node and length
+            frame = bytearray()
+            index = 1
+            mark = False
+            complete = False
+            resync = False
+            while index < len(self._rxBuffer):
+                byte = self._rxBuffer[index]
+                index += 1
+                if byte == JVS_SYNC:
+                    resync = True
+                    break
+                if byte == JVS_MARK:
+                    mark = True
+                    continue
+                if mark:
+                    byte += 1
+                    mark = False
+                frame.append(byte)
+                if len(frame) >= 2 and len(frame) == frame[1] + 2:
+                    complete = True
+                    break
+            if resync:
+                # Frame was cut off by a new sync byte, drop it
+                del self._rxBuffer[:index - 1]
+                continue
+            if not complete:
+                break
+            del self._rxBuffer[:index]
+            if (sum(frame[:-1]) % 256) != frame[-1]:
+                if frame[0] == self.nodeID and self.nodeID != 0:
+                    out += self.encodeReply(JVS_StatusCodes.JVS_STATUS_CHECKSUMERROR, b'')
+                continue
+            node = frame[0]
+            if node != JVS_BROADCAST_ADDR and (node != self.nodeID or self.nodeID == 0):
+                continue
+            if node == JVS_BROADCAST_ADDR and len(frame) > 2 and frame[2] == JVS_SETADDR_CODE and self.nodeID != 0:
+                # Already addressed, the next board down the chain takes this one
+                continue
+            self.frameCount += 1
+            status, data = self.handle(bytes(frame[2:-1]))
+            if data is None:
+                continue
+            if status is None:
+                out += data     # Retry request, resend verbatim
+                continue
+            reply = self.encodeReply(status, data)
+            self.lastReply = reply
+            out += reply
+        return bytes(out)
+
+    def setSense(self, level: bool):
+        """Sets the board's sense line. Returns the monotonic() time of the change."""
+        with self._senseEvent:
+            self.sense = level
+            changedAt = monotonic()
+            self._senseEvent.notify_all()
+        return changedAt
+
+    def setSwitch(self, bit: int, level: bool):
+        """Sets one switch, numbered from the MSB of the system byte (0 = Test, 8 = Player 1 Start...). Returns the monotonic() time of the change."""
+        index, shift = divmod(bit, 8)
+        mask = 0x80 >> shift
+        if level:
+            self.switches[index] |= mask
+        else:
+            self.switches[index] &= ~mask & 0xFF
+        return monotonic()
+
+    def waitSenseChange(self, timeout: float):
+        """Blocks until the sense line changes or timeout expires."""
+        with self._senseEvent:
+            self._senseEvent.wait(timeout)
+
+    # pty stand-in
+    def start(self):
+        """Opens a pty and starts answering frames on it in the background. Returns the tty path for the host side."""
+        # Only the pty stand-in needs these, the loopback transport runs anywhere
+        import tty
+        self._masterFD, self._slaveFD = os.openpty()
+        tty.setraw(self._slaveFD)
+        self.portName = os.ttyname(self._slaveFD)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='JVS emulator', daemon=True)
+        self._thread.start()
+        return self.portName
+
+    def stop(self):
+        """Stops the pty stand-in and closes it."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(1)
+            self._thread = None
+        for fd in (self._masterFD, self._slaveFD):
+            if fd is not None:
+                os.close(fd)
+        self._masterFD = self._slaveFD = None
+
+    def openPort(self, baudrate: int = 115200):
+        """Opens the host side of the pty as a Serial object whose modem status lines follow this emulator."""
+        return emulatedSerial()(self, port=self.portName, baudrate=baudrate)
+
+    def _serve(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._masterFD], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                raw = os.read(self._masterFD, 4096)
+            except OSError:
+                break
+            reply = self.process(raw)
+            if reply and self.baudrate:
+                # 10 bits per byte on the wire, for the request and the reply
+                sleep((len(raw) + len(reply)) * 10 / self.baudrate)
+            if reply:
+                os.write(self._masterFD, reply)
+
+_EmulatedSerial = None
+
+def emulatedSerial():
+    """The Serial subclass openPort() returns, made on first use so importing jvsemu (as the loopback transport does) doesn't need pyserial."""
+    global _EmulatedSerial
+    if _EmulatedSerial is not None:
+        return _EmulatedSerial
+    from serial import Serial
+
+    class EmulatedSerial(Serial):
+        """Serial port on an emulator pty. ptys have no modem lines, so RTS/DTR are ignored and the status lines read the emulator's sense."""
+        def __init__(self, emulator: JVS_Emulator, *args, **kwargs):
+            self.emulator = emulator
+            super().__init__(*args, **kwargs)
+
+        def _update_rts_state(self):
+            pass
+
+        def _update_dtr_state(self):
+            pass
+
+        @property
+        def dsr(self):
+            return self.emulator.sense
+
+        @property
+        def cd(self):
+            return self.emulator.sense
+
+        def waitModemChange(self, timeout: float):
+            self.emulator.waitSenseChange(timeout)
+
+    _EmulatedSerial = EmulatedSerial
+    return _EmulatedSerial
+
+def measureSenseLatency(toggle, jvsIO: JVS, count: int = 100):
+    """Flips the sense line with toggle(level), which returns the monotonic() time of the change, and measures how long the JVS sense monitor takes to
+    see each change. Returns a list of latencies in seconds."""
+    results = []
+    jvsIO.startSenseMonitor()
+    level = jvsIO.readSense()
+    for n in range(0, count):
+        level = not level
+        seen = jvsIO.senseChangedAt
+        changedAt = toggle(level)
+        deadline = changedAt + 1
+        while jvsIO.senseChangedAt == seen and monotonic() < deadline:
+            sleep(0.0001)
+        if jvsIO.senseChangedAt != seen:
+            results.append(jvsIO.senseChangedAt - changedAt)
+    toggle(True)
+    return results
+
+def loopbackSense(port):
+    """Toggle for measureSenseLatency() on a real serial port with DTR wired back to the sense input (DSR or DCD), so the change goes through the
+    UART's modem status lines and the monitor's TIOCMIWAIT wait."""
+    def toggle(level: bool):
+        port.dtr = level
+        return monotonic()
+    return toggle
+
+# A switch + coin poll with into= buffers reuses its request frames, pooled reply frames and kept slices of the receive, decode and send buffers,
+# so it shouldn't allocate anything in jvs.py; the limit leaves room for the odd int. Before the frame pool a poll came to 13 or more.
+POLL_ALLOCATION_LIMIT = 2
+
+class _SnapshotPort():
+    def __init__(self, port, traceFilter):
+        """Wraps the host's port for measurePollAllocations(). Every call from jvs.py snapshots the blocks it allocated since start() that are still alive,
+        which takes in the frames and buffers of the poll in flight even if they are freed again before it returns."""
+        self.port = port
+        self.traceFilter = traceFilter
+        self.baseline = None
+        self.seen = {}      # Allocating line -> most of its blocks alive at once
+
+    def start(self):
+        import tracemalloc
+        self.baseline = tracemalloc.take_snapshot().filter_traces(self.traceFilter)
+        self.seen = {}
+
+    def measure(self):
+        import tracemalloc
+        if self.baseline is None:
+            return
+        now = tracemalloc.take_snapshot().filter_traces(self.traceFilter)
+        for stat in now.compare_to(self.baseline, 'lineno'):
+            if stat.count_diff > self.seen.get(stat.traceback, 0):
+                self.seen[stat.traceback] = stat.count_diff
+
+    def allocated(self):
+        return sum(self.seen.values())
+
+    def write(self, data):
+        self.measure()
+        return self.port.write(data)
+
+    def read(self, size: int = 1):
+        self.measure()
+        return self.port.read(size)
+
+    def readinto(self, buffer):
+        self.measure()
+        return self.port.readinto(buffer)
+
+    def flush(self):
+        self.port.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+def measurePollAllocations(jvsIO: JVS, polls: int = 1000, sampled: int = 20):
+    """Polls switches and coins with reused buffers under tracemalloc. Returns the memory blocks allocated in jvs.py per poll (the worst of sampled polls,
+    counting blocks freed again before the poll returns), the blocks still held after all the polls, per poll, and the peak traced bytes above the start (all threads)."""
+    import tracemalloc, jvs
+    switches = bytearray()
+    coins = bytearray()
+    # Warm up the frame pool and buffers first
+    for n in range(0, 10):
+        jvsIO.getInputs(into=switches)
+        jvsIO.getCoinCount(into=coins)
+    onlyJVS = [tracemalloc.Filter(True, jvs.__file__)]
+    tracemalloc.start()
+    port = jvsIO.cuPort
+    jvsIO.cuPort = probe = _SnapshotPort(port, onlyJVS)
+    allocated = 0
+    try:
+        for n in range(0, sampled):
+            probe.start()
+            results = (jvsIO.getInputs(into=switches), jvsIO.getCoinCount(into=coins))
+            # With the results still held, in case they were made for the caller
+            probe.measure()
+            allocated = max(allocated, probe.allocated())
+            del results
+    finally:
+        jvsIO.cuPort = port
+    before = tracemalloc.take_snapshot().filter_traces(onlyJVS)
+    startSize, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for n in range(0, polls):
+        jvsIO.getInputs(into=switches)
+        jvsIO.getCoinCount(into=coins)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot().filter_traces(onlyJVS)
+    tracemalloc.stop()
+    held = sum(stat.count_diff for stat in after.compare_to(before, 'lineno') if stat.count_diff > 0)
+    return allocated, held / polls, peak - startSize
+
+def printSenseLatency(results: list, source: str):
+    if not results:
+        print("Sense changes were never seen")
+        return 1
+    print('Sense latency over ' + str(len(results)) + ' changes (' + source + '):')
+    print('\tmin:\t' + format(results[0] * 1000, '.3f') + ' ms')
+    print('\tmedian:\t' + format(results[len(results) // 2] * 1000, '.3f') + ' ms')
+    print('\tmax:\t' + format(results[-1] * 1000, '.3f') + ' ms')
+    return 0
+
+def main(args = None):
+    parser = ArgumentParser(description = "JVS IO board emulator.")
+    parser.add_argument(
+		"-s", "--sense",
+		type = str,
+		choices = list(SENSE_LINES),
+		default = "DSR",
+		help = "modem status line the host watches for sense (default DSR)",
+	)
+    parser.add_argument(
+		"--sense-latency",
+		type = int,
+		default = 0,
+		help = "toggle the sense line this many times and report detection latency",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		help = "with --sense-latency, time a real serial port with DTR looped back to the sense line instead of the emulated one",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"--alloc-check",
+		type = int,
+		default = 0,
+		help = "poll this many times under tracemalloc and fail if a poll allocates more than a few blocks in jvs.py or holds on to memory",
+		metavar = "polls"
+	)
+    args = parser.parse_args(args)
+
+    if args.sense_latency and args.port:
+        # Real modem lines: DTR drives the sense input and the monitor waits on it with TIOCMIWAIT
+        from serial import Serial
+        jvsIO = JVS(Serial(args.port, 115200), JVSIO(), sense=args.sense)
+        try:
+            jvsIO.cuPort.dtr = True
+        except OSError:
+            print(args.port + ' has no modem control lines')
+            return 1
+        sleep(0.05)
+        if not jvsIO.readSense():
+            print('Sense line (' + args.sense + ') doesn\'t follow DTR on ' + args.port + ', is it looped back?')
+            return 1
+        results = sorted(measureSenseLatency(loopbackSense(jvsIO.cuPort), jvsIO, args.sense_latency))
+        jvsIO.stopSenseMonitor()
+        path = 'TIOCMIWAIT' if jvsIO._senseIoctl else 'polling every ' + format(jvsIO.senseInterval * 1000, 'g') + ' ms (no TIOCMIWAIT on this port)'
+        return printSenseLatency(results, args.port + ', ' + path)
+
+    emulator = JVS_Emulator()
+    portName = emulator.start()
+    print("Emulated IO board on", portName)
+    if args.sense_latency:
+        jvsIO = JVS(emulator.openPort(), JVSIO(), sense=args.sense)
+        if jvsIO.connect() != ConnectState.CONNECTED:
+            print("Couldn't connect to the emulator")
+            return 1
+        results = sorted(measureSenseLatency(emulator.setSense, jvsIO, args.sense_latency))
+        jvsIO.stopSenseMonitor()
+        emulator.stop()
+        # ptys have no modem lines, this only times the monitor thread waking up
+        return printSenseLatency(results, 'emulated sense line, use --port for the TIOCMIWAIT path')
+    if args.alloc_check:
+        jvsIO = JVS(emulator.openPort(), JVSIO())
+        if jvsIO.connect() != ConnectState.CONNECTED:
+            print("Couldn't connect to the emulator")
+            return 1
+        allocated, held, peak = measurePollAllocations(jvsIO, args.alloc_check)
+        print('Blocks allocated per poll: ' + str(allocated) + ' (limit ' + str(POLL_ALLOCATION_LIMIT) + '), held per poll: ' + format(held, '.4f') + ', peak: ' + str(peak) + ' bytes')
+        emulator.stop()
+        return 0 if allocated <= POLL_ALLOCATION_LIMIT and held < 0.01 else 1
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
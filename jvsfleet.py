@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+# Headless fleet tester: connects to many IO boards at once and runs the same test script on each.
+#
+# Each port gets its own JVS object and runs on a worker thread. The JVS calls spend nearly all their
+# time waiting on the serial port, so a thread pool keeps every bus busy at once and the whole run takes
+# about as long as the slowest board instead of the sum of all of them.
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict
+from time import sleep, monotonic
+import sys, glob, json
+
+FLEET_STEPS = ('inputs', 'gpo', 'coins')
+
+@dataclass
+class JVS_StepResult:
+    name: str = ""
+    passed: bool = False
+    detail: str = ""
+    duration: float = 0.0
+
+@dataclass
+class JVS_BoardReport:
+    port: str = ""
+    connected: bool = False
+    name: str = ""
+    versions: str = ""
+    features: dict = field(default_factory = dict)
+    steps: list = field(default_factory = list)
+    duration: float = 0.0
+    error: str = ""
+
+    @property
+    def passed(self):
+        return self.connected and all(step.passed for step in self.steps)
+
+def stepInputs(jvsIO, polls: int = 200, interval: float = 0.005):
+    """Input sweep: polls the switches and reports which bits were seen active at any point."""
+    seen = None
+    failures = 0
+    for n in range(0, polls):
+        switches = jvsIO.getInputs()
+        if not switches:
+            failures += 1
+        else:
+            if seen is None:
+                seen = bytearray(len(switches))
+            for i in range(0, min(len(seen), len(switches))):
+                seen[i] |= switches[i]
+        sleep(interval)
+    if seen is None:
+        return False, 'no switch reads succeeded'
+    active = ' '.join(format(b, '08b') for b in seen)
+    return failures == 0, str(polls - failures) + '/' + str(polls) + ' reads, bits seen: ' + active
+
+def stepGPO(jvsIO, dwell: float = 0.05):
+    """GPO walk: turns each output on by itself in turn, then all off."""
+    from jvscodec import packGPO
+    count = jvsIO.ioBoard.gpoCount
+    if count == 0:
+        return True, 'no GPO outputs'
+    failed = []
+    for bit in range(0, count):
+        if not jvsIO.setGPO(packGPO(1 << bit, count)):
+            failed.append(bit)
+        sleep(dwell)
+    if not jvsIO.setGPO(packGPO(0, count)):
+        failed.append('clear')
+    if failed:
+        return False, 'outputs not acknowledged: ' + ', '.join(str(f) for f in failed)
+    return True, str(count) + ' outputs walked'
+
+def _coinCounts(jvsIO):
+    coins = jvsIO.getCoinCount()
+    if not coins:
+        return None
+    return [(((coins[2 * c] & 0x3F) << 8) + coins[(2 * c) + 1]) for c in range(0, len(coins) // 2)]
+
+def stepCoins(jvsIO):
+    """Coin increment/decrement: adds a coin to each slot and takes it away again, checking the counter follows."""
+    count = jvsIO.ioBoard.coinCount
+    if count == 0:
+        return True, 'no coin slots'
+    problems = []
+    for slot in range(1, count + 1):
+        before = _coinCounts(jvsIO)
+        if before is None or not jvsIO.incCoinCounter(slot):
+            problems.append('slot ' + str(slot) + ' increment failed')
+            continue
+        after = _coinCounts(jvsIO)
+        if after is None or after[slot - 1] != before[slot - 1] + 1:
+            problems.append('slot ' + str(slot) + ' did not count up')
+        if not jvsIO.decCoinCounter(slot):
+            problems.append('slot ' + str(slot) + ' decrement failed')
+            continue
+        restored = _coinCounts(jvsIO)
+        if restored is None or restored[slot - 1] != before[slot - 1]:
+            problems.append('slot ' + str(slot) + ' did not count down')
+    if problems:
+        return False, '; '.join(problems)
+    return True, str(count) + ' slots counted up and down'
+
+def testBoard(port: str, script: list, baud: int = 115200, sense: str = None, options: dict = None, openPort = None):
+    """Connects to the board on port and runs each step of script on it. Returns a JVS_BoardReport."""
+    from jvs import JVS, JVSIO, ConnectState
+    options = options if options else {}
+    report = JVS_BoardReport(port=port)
+    start = monotonic()
+    jvsIO = None
+    try:
+        if openPort:
+            serialPort = openPort(port, baud)
+        else:
+            from jvstransport import openTransport
+            serialPort = openTransport(port, baud)
+        jvsIO = JVS(serialPort, JVSIO(), sense=sense)
+        if jvsIO.connect() != ConnectState.CONNECTED:
+            report.error = 'no IO board responded'
+            return report
+        board = jvsIO.ioBoard
+        report.connected = True
+        report.name = board.name.strip('\x00\x01')
+        report.versions = 'cmd ' + str(board.cmdver) + ', jvs ' + str(board.jvsver) + ', comm ' + str(board.comver)
+        report.features = {
+            'players': board.playerCount, 'switches': board.switchCount, 'coins': board.coinCount,
+            'analog': board.analogCount, 'gpo': board.gpoCount
+        }
+        for name in script:
+            stepStart = monotonic()
+            match name:
+                case 'inputs':
+                    passed, detail = stepInputs(jvsIO, options.get('polls', 200))
+                case 'gpo':
+                    passed, detail = stepGPO(jvsIO, options.get('dwell', 0.05))
+                case 'coins':
+                    passed, detail = stepCoins(jvsIO)
+                case _:
+                    passed, detail = False, 'unknown step'
+            report.steps.append(JVS_StepResult(name, passed, detail, monotonic() - stepStart))
+    except Exception as e:
+        report.error = str(e)
+    finally:
+        if jvsIO:
+            try:
+                jvsIO.disconnect()
+            except Exception:
+                pass
+        report.duration = monotonic() - start
+    return report
+
+def runFleet(ports: list, script: list, jobs: int = 0, **kwargs):
+    """Tests every port concurrently. Returns the reports (in port order) and the total wall time."""
+    start = monotonic()
+    reports = {}
+    with ThreadPoolExecutor(max_workers=jobs if jobs else max(len(ports), 1)) as pool:
+        futures = {pool.submit(testBoard, port, script, **kwargs): port for port in ports}
+        for future in as_completed(futures):
+            reports[futures[future]] = future.result()
+    return [reports[port] for port in ports], monotonic() - start
+
+def printReport(reports: list, wallTime: float):
+    for report in reports:
+        print(report.port + ': ' + ('PASS' if report.passed else 'FAIL') + ' (' + format(report.duration, '.2f') + ' s)')
+        if report.error:
+            print('\tError: ' + report.error)
+        if report.connected:
+            print('\t' + report.name.replace(';', ' / '))
+            print('\t' + report.versions)
+        for step in report.steps:
+            print('\t' + ('ok  ' if step.passed else 'FAIL') + ' ' + step.name + ': ' + step.detail)
+    passed = sum(1 for report in reports if report.passed)
+    slowest = max((report.duration for report in reports), default=0)
+    total = sum(report.duration for report in reports)
+    print(str(passed) + '/' + str(len(reports)) + ' boards passed in ' + format(wallTime, '.2f') + ' s' \
+        + ' (slowest board ' + format(slowest, '.2f') + ' s, sum of boards ' + format(total, '.2f') + ' s)')
+
+def main(args = None):
+    parser = ArgumentParser(description = "Test many JVS IO boards at once.")
+    parser.add_argument(
+		"ports",
+		nargs = "+",
+		help = "ports to test, as for jvs.py -p (loopback, tty:path or a serial port), glob patterns such as /dev/ttyUSB* are expanded",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-s", "--sense",
+		type = str,
+		choices = ["DSR", "DCD"],
+		help = "modem status line wired to JVS sense",
+	)
+    parser.add_argument(
+		"--script",
+		type = str,
+		default = ",".join(FLEET_STEPS),
+		help = "comma separated test steps to run, from " + ", ".join(FLEET_STEPS) + " (default all)",
+		metavar = "steps"
+	)
+    parser.add_argument(
+		"--polls",
+		type = int,
+		default = 200,
+		help = "switch reads in the input sweep (default 200)",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"-j", "--jobs",
+		type = int,
+		default = 0,
+		help = "boards to test at once (default all)",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"--json",
+		action = "store_true",
+		help = "print the report as JSON"
+	)
+    args = parser.parse_args(args)
+
+    ports = []
+    for pattern in args.ports:
+        # Keep any transport prefix (tty:, serial:) on the expanded names
+        prefix = ''
+        for scheme in ('tty:', 'serial:'):
+            if pattern.startswith(scheme):
+                prefix, pattern = scheme, pattern[len(scheme):]
+        matches = sorted(glob.glob(pattern))
+        ports += [prefix + match for match in matches] if matches else [prefix + pattern]
+    script = [step for step in args.script.split(',') if step]
+    for step in script:
+        if step not in FLEET_STEPS:
+            parser.error('unknown test step ' + step)
+
+    from contextlib import redirect_stdout
+    # JVS reports connects and timeouts on stdout, keep that for the results
+    with redirect_stdout(sys.stderr):
+        reports, wallTime = runFleet(ports, script, args.jobs, baud=args.baud, sense=args.sense, options={'polls': args.polls})
+    if args.json:
+        print(json.dumps({
+            'wallTime': wallTime,
+            'boards': [dict(asdict(report), passed=report.passed) for report in reports]
+        }, indent=2))
+    else:
+        printReport(reports, wallTime)
+    return 0 if all(report.passed for report in reports) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+# Stress and fuzz harness for the JVS frame decoder.
+#
+# Builds a long stream of valid host-bound reply frames, each carrying a sequence number, and damages a
+# share of them the way a noisy harness does: flipped bits, dropped bytes, stray SYNC or MARK bytes and
+# frames cut short. The stream is fed to JVS._decodeFrame() in random sized reads, and every frame that
+# comes out is checked against what was sent. Reported: decode throughput, intact frames recovered,
+# damaged frames wrongly accepted, bytes (and intact frames) lost after each damaged frame before the
+# decoder is back in step, peak memory, and the deepest call stack readPacket() reaches on the same
+# noise. Results can be saved as a baseline and later runs fail if they regress against it.
+
+from argparse import ArgumentParser
+from dataclasses import dataclass, field, asdict
+from contextlib import redirect_stdout
+from time import perf_counter
+import sys, io, json, random, tracemalloc
+from jvsmacros import *
+from jvstransport import JVS_Transport
+
+FUZZ_KINDS = ('flip', 'drop', 'sync', 'mark', 'truncate')
+
+# Checked on every run, baseline or not. Throughput depends on the machine so it's only compared with a baseline.
+FUZZ_MIN_RECOVERY = 0.99    # Intact frames that must come through
+FUZZ_MAX_STACK_DEPTH = 10   # Calls under readPacket(), which used to recurse into its retry path
+
+@dataclass
+class JVS_FuzzStream:
+    data: bytes = b''
+    offsets: list = field(default_factory = list)   # Start of each frame in data
+    lengths: list = field(default_factory = list)   # Its length in data after any damage
+    payloads: list = field(default_factory = list)  # Report data as sent
+    damage: list = field(default_factory = list)    # Kind of damage per frame, '' if intact
+
+@dataclass
+class JVS_FuzzResult:
+    frames: int = 0
+    damaged: int = 0
+    intactRecovered: int = 0
+    intactLost: int = 0         # Intact frames the decoder dropped because of a damaged neighbour
+    damagedAccepted: int = 0    # Damaged frames that came out as good, with the wrong contents
+    resyncMean: float = 0.0     # Bytes skipped after a damaged frame before the next good one
+    resyncMax: int = 0
+    bytesPerSecond: float = 0.0
+    framesPerSecond: float = 0.0
+    peakMemory: int = 0         # Bytes traced at peak during a decode pass
+    stackDepth: int = 0         # Deepest nesting of Python calls below readPacket()
+    malformedReports: int = 0   # 'Packet was malformed' messages readPacket() printed
+    byKind: dict = field(default_factory = dict)
+
+    @property
+    def recovery(self):
+        intact = self.frames - self.damaged
+        return (self.intactRecovered / intact) if intact else 1.0
+
+def _escape(values, out: bytearray):
+    for b in values:
+        if b == JVS_SYNC or b == JVS_MARK:
+            out.append(JVS_MARK)
+            out.append(b - 1)
+        else:
+            out.append(b)
+
+def encodeReply(payload: bytes, status: int = JVS_StatusCodes.JVS_STATUS_NORMAL):
+    """A board-to-host frame (node 0) carrying payload as its report data, escaped as on the wire."""
+    body = bytes((JVS_HOST_ADDR, len(payload) + 2, status)) + payload
+    out = bytearray((JVS_SYNC,))
+    _escape(body + bytes((sum(body) % 256,)), out)
+    return bytes(out)
+
+def damageFrame(frame: bytes, kind: str, rng: random.Random):
+    """Returns frame with one kind of line noise applied."""
+    data = bytearray(frame)
+    match kind:
+        case 'flip':
+            i = rng.randrange(0, len(data))
+            data[i] ^= 1 << rng.randrange(0, 8)
+        case 'drop':
+            del data[rng.randrange(0, len(data))]
+        case 'sync':
+            data.insert(rng.randrange(1, len(data) + 1), JVS_SYNC)
+        case 'mark':
+            data.insert(rng.randrange(1, len(data) + 1), JVS_MARK)
+        case 'truncate':
+            del data[rng.randrange(1, len(data)):]
+    return bytes(data)
+
+def buildStream(frames: int = 10000, damageRate: float = 0.05, kinds: tuple = FUZZ_KINDS, seed: int = 1, maxPayload: int = 64):
+    """Makes a stream of frames with sequence numbers, damaging about damageRate of them."""
+    rng = random.Random(seed)
+    stream = JVS_FuzzStream()
+    out = bytearray()
+    for n in range(0, frames):
+        size = rng.randrange(0, maxPayload)
+        payload = bytes((JVS_ReportCodes.JVS_REPORT_NORMAL, (n >> 8) & 0xFF, n & 0xFF)) + rng.randbytes(size)
+        frame = encodeReply(payload)
+        kind = ''
+        if rng.random() < damageRate:
+            kind = rng.choice(kinds)
+            frame = damageFrame(frame, kind, rng)
+        stream.offsets.append(len(out))
+        stream.lengths.append(len(frame))
+        stream.payloads.append(payload)
+        stream.damage.append(kind)
+        out += frame
+    stream.data = bytes(out)
+    return stream
+
+class JVS_StreamTransport(JVS_Transport):
+    def __init__(self, data: bytes, seed: int = 1, maxChunk: int = 96):
+        """Plays back data in random sized reads, as a UART would deliver it. Writes (retry requests) are dropped."""
+        self.data = memoryview(data)
+        self.pos = 0
+        self.is_open = True
+        self.port = 'fuzz'
+        self._rng = random.Random(seed)
+        self.maxChunk = maxChunk
+        self._chunk = 0
+
+    @property
+    def in_waiting(self):
+        if self._chunk == 0:
+            self._chunk = self._rng.randrange(1, self.maxChunk + 1)
+        return min(self._chunk, len(self.data) - self.pos)
+
+    def read(self, size: int = 1):
+        data = bytes(self.data[self.pos:self.pos + size])
+        self.pos += len(data)
+        self._chunk = 0
+        return data
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self.data) - self.pos)
+        buffer[:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        self._chunk = 0
+        return count
+
+    def write(self, data):
+        return len(data)
+
+    @property
+    def exhausted(self):
+        return self.pos >= len(self.data)
+
+def _host(transport):
+    from jvs import JVS, JVSIO, ConnectState
+    jvsIO = JVS(transport, JVSIO())
+    jvsIO.connectState = ConnectState.CONNECTED
+    jvsIO.replyInterval = 0
+    return jvsIO
+
+def decodeStream(stream: JVS_FuzzStream, seed: int = 1, keep: bool = True):
+    """Runs the stream through _decodeFrame(). Returns the decoded payloads in order (just the count if not keep) and the seconds it took."""
+    jvsIO = _host(JVS_StreamTransport(stream.data, seed))
+    transport = jvsIO.cuPort
+    packet = jvsIO.framePool.getReply()
+    decoded = [] if keep else 0
+    start = perf_counter()
+    while True:
+        # Same pattern as readPacket(): read whatever has arrived, then decode one frame
+        jvsIO._fillReceiveBuffer()
+        result = jvsIO._decodeFrame(packet)
+        if result:
+            if keep:
+                decoded.append(bytes(packet.data))
+            else:
+                decoded += 1
+        elif result is None and transport.exhausted:
+            break
+    elapsed = perf_counter() - start
+    jvsIO.framePool.release(packet)
+    return decoded, elapsed
+
+def measureStackDepth(stream: JVS_FuzzStream, seed: int = 1):
+    """Reads the stream with readPacket(), tracking how deep the Python call stack gets below it. Returns (depth, malformed messages)."""
+    jvsIO = _host(JVS_StreamTransport(stream.data, seed))
+    transport = jvsIO.cuPort
+    depth = 0
+    deepest = 0
+
+    def profile(frame, event, arg):
+        nonlocal depth, deepest
+        if event == 'call':
+            depth += 1
+            if depth > deepest:
+                deepest = depth
+        elif event == 'return':
+            depth -= 1
+
+    captured = io.StringIO()
+    with redirect_stdout(captured):
+        while not transport.exhausted:
+            sys.setprofile(profile)
+            try:
+                packet = jvsIO.readPacket()
+            finally:
+                sys.setprofile(None)
+            depth = 0
+            jvsIO.framePool.release(packet)
+    return deepest, captured.getvalue().count('Packet was malformed')
+
+def runFuzz(frames: int = 10000, damageRate: float = 0.05, kinds: tuple = FUZZ_KINDS, seed: int = 1, depthFrames: int = 2000, repeats: int = 3):
+    """Builds a damaged stream, decodes it and works out the results. Returns a JVS_FuzzResult."""
+    stream = buildStream(frames, damageRate, kinds, seed)
+    decoded, elapsed = decodeStream(stream, seed)
+    for n in range(1, repeats):
+        # Best of a few runs, so a busy machine doesn't look like a regression
+        elapsed = min(elapsed, decodeStream(stream, seed, keep=False)[1])
+    result = JVS_FuzzResult(frames=frames, damaged=sum(1 for d in stream.damage if d))
+    result.bytesPerSecond = len(stream.data) / elapsed if elapsed else 0.0
+    result.framesPerSecond = frames / elapsed if elapsed else 0.0
+
+    # Match what came out against what went in by sequence number
+    good = [False] * frames
+    for payload in decoded:
+        n = (payload[1] << 8) | payload[2] if len(payload) >= 3 else -1
+        if 0 <= n < frames and payload == stream.payloads[n] and not stream.damage[n]:
+            good[n] = True
+        else:
+            result.damagedAccepted += 1
+    result.intactRecovered = sum(1 for n in range(0, frames) if good[n])
+    result.intactLost = (frames - result.damaged) - result.intactRecovered
+
+    # Bytes from the end of each damaged frame to the start of the next frame decoded
+    resyncs = []
+    kindStats = {kind: {'count': 0, 'resyncBytes': 0, 'intactLost': 0} for kind in kinds}
+    for n in range(0, frames):
+        kind = stream.damage[n]
+        if not kind:
+            continue
+        following = n + 1
+        while following < frames and not good[following]:
+            following += 1
+        damageEnd = stream.offsets[n] + stream.lengths[n]
+        resyncEnd = stream.offsets[following] if following < frames else len(stream.data)
+        skipped = resyncEnd - damageEnd
+        lost = sum(1 for m in range(n + 1, following) if not stream.damage[m])
+        resyncs.append(skipped)
+        kindStats[kind]['count'] += 1
+        kindStats[kind]['resyncBytes'] += skipped
+        kindStats[kind]['intactLost'] += lost
+    if resyncs:
+        result.resyncMean = sum(resyncs) / len(resyncs)
+        result.resyncMax = max(resyncs)
+    for kind, stats in kindStats.items():
+        if stats['count']:
+            stats['resyncBytes'] = stats['resyncBytes'] / stats['count']
+    result.byKind = kindStats
+
+    # Peak memory on a second pass, tracemalloc slows the first one down too much to time
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    decodeStream(stream, seed, keep=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result.peakMemory = peak - before
+
+    depthStream = buildStream(min(depthFrames, frames), damageRate, kinds, seed + 1)
+    result.stackDepth, result.malformedReports = measureStackDepth(depthStream, seed)
+    return result
+
+def checkRegression(result: JVS_FuzzResult, baseline: dict, tolerance: float = 0.2):
+    """Compares against a saved baseline. Returns a list of what got worse."""
+    problems = []
+    if result.bytesPerSecond < baseline['bytesPerSecond'] * (1 - tolerance):
+        problems.append('throughput ' + format(result.bytesPerSecond / 1e6, '.2f') + ' MB/s, baseline ' + format(baseline['bytesPerSecond'] / 1e6, '.2f'))
+    if result.recovery < baseline['recovery'] - 0.001:
+        problems.append('recovery ' + format(result.recovery, '.4f') + ', baseline ' + format(baseline['recovery'], '.4f'))
+    if result.damagedAccepted > baseline['damagedAccepted']:
+        problems.append('damaged frames accepted ' + str(result.damagedAccepted) + ', baseline ' + str(baseline['damagedAccepted']))
+    if result.resyncMean > baseline['resyncMean'] * (1 + tolerance) + 1:
+        problems.append('mean resync ' + format(result.resyncMean, '.1f') + ' bytes, baseline ' + format(baseline['resyncMean'], '.1f'))
+    if result.peakMemory > baseline['peakMemory'] * (1 + tolerance) + 4096:
+        problems.append('peak memory ' + str(result.peakMemory) + ' bytes, baseline ' + str(baseline['peakMemory']))
+    if result.stackDepth > baseline['stackDepth']:
+        problems.append('stack depth ' + str(result.stackDepth) + ', baseline ' + str(baseline['stackDepth']))
+    return problems
+
+def printResult(result: JVS_FuzzResult):
+    print(str(result.frames) + ' frames, ' + str(result.damaged) + ' damaged')
+    print('\tThroughput:\t' + format(result.bytesPerSecond / 1e6, '.2f') + ' MB/s, ' + format(result.framesPerSecond, '.0f') + ' frames/s')
+    print('\tRecovered:\t' + str(result.intactRecovered) + ' intact frames (' + format(100 * result.recovery, '.2f') + '%), ' + str(result.intactLost) + ' lost')
+    print('\tAccepted bad:\t' + str(result.damagedAccepted))
+    print('\tResync:\t\tmean ' + format(result.resyncMean, '.1f') + ' bytes, max ' + str(result.resyncMax))
+    print('\tPeak memory:\t' + str(result.peakMemory) + ' bytes')
+    print('\tStack depth:\t' + str(result.stackDepth) + ' calls under readPacket(), ' + str(result.malformedReports) + ' malformed reports')
+    for kind, stats in result.byKind.items():
+        if stats['count']:
+            print('\t  ' + kind.ljust(9) + str(stats['count']).rjust(5) + ' frames, resync ' + format(stats['resyncBytes'], '.1f') + ' bytes, ' + str(stats['intactLost']) + ' intact frames lost')
+
+def main(args = None):
+    parser = ArgumentParser(description = "Fuzz the JVS frame decoder with line noise and report how it copes.")
+    parser.add_argument(
+		"-n", "--frames",
+		type = int,
+		default = 20000,
+		help = "frames in the stream (default 20000)",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"-r", "--rate",
+		type = float,
+		default = 0.05,
+		help = "share of frames damaged (default 0.05)",
+		metavar = "fraction"
+	)
+    parser.add_argument(
+		"-k", "--kinds",
+		type = str,
+		default = ",".join(FUZZ_KINDS),
+		help = "damage to apply, from " + ", ".join(FUZZ_KINDS) + " (default all)",
+		metavar = "kinds"
+	)
+    parser.add_argument(
+		"--seed",
+		type = int,
+		default = 1,
+		help = "random seed (default 1)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"--baseline",
+		type = str,
+		help = "fail if results are worse than this saved baseline",
+		metavar = "file"
+	)
+    parser.add_argument(
+		"--save-baseline",
+		type = str,
+		help = "save the results as a baseline",
+		metavar = "file"
+	)
+    parser.add_argument(
+		"--tolerance",
+		type = float,
+		default = 0.2,
+		help = "allowed slowdown/growth against the baseline (default 0.2)",
+		metavar = "fraction"
+	)
+    parser.add_argument(
+		"--json",
+		action = "store_true",
+		help = "print the results as JSON"
+	)
+    args = parser.parse_args(args)
+
+    kinds = tuple(k for k in args.kinds.split(',') if k)
+    for kind in kinds:
+        if kind not in FUZZ_KINDS:
+            parser.error('unknown damage kind ' + kind)
+    result = runFuzz(args.frames, args.rate, kinds, args.seed)
+    report = dict(asdict(result), recovery=result.recovery)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printResult(result)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    problems = []
+    if result.recovery < FUZZ_MIN_RECOVERY:
+        problems.append('recovery ' + format(result.recovery, '.4f') + ', needs ' + str(FUZZ_MIN_RECOVERY))
+    if result.stackDepth > FUZZ_MAX_STACK_DEPTH:
+        problems.append('stack depth ' + str(result.stackDepth) + ', limit ' + str(FUZZ_MAX_STACK_DEPTH))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems += checkRegression(result, baseline, args.tolerance)
+    for problem in problems:
+        print('REGRESSION: ' + problem, file=sys.stderr if args.json else sys.stdout)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
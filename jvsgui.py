@@ -3,17 +3,20 @@
 from tkinter import *
 import tkinter as tk
 from tkinter import ttk
-import glob
+from concurrent.futures import ThreadPoolExecutor, wait
 from jvs import JVS, JVSIO, ConnectState
+from jvscodec import packGPO, decodeCoins, switchBytes
+from jvsmacros import JVS_CoinCodes
+from jvsdiscover import JVS_PortDiscovery, candidatePorts
+from jvsmap import compileProfile, defaultProfile, CABINET_SWITCHES
 from serial import Serial
 from functools import partial
-from bitstring import BitArray
+from time import monotonic
+import sys
 
 #tk.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
 #tk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
 
-lastSwitch = bytearray(0)
-
 class ConnectionState:
     ConnectStatesText = [
         "Disconnected.",
@@ -72,13 +75,17 @@ class jvsApp(tk.Tk):
         #self.geometry(f"{1100}x{500}")
 
         self.dynamic_GPO = []
-        self.gpo_States = BitArray(32)
         self.dynamic_InputC = []
         self.dynamic_InputT = []
         self.dynamic_Coin = []
 
         self.connTryCount = 0
 
+        # Board discovery runs on a worker thread, results are picked up from the Tk loop
+        self.discovery = JVS_PortDiscovery()
+        self.scanPool = ThreadPoolExecutor(max_workers=1)
+        self.scan = None
+
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
 
@@ -128,6 +135,28 @@ class jvsApp(tk.Tk):
         self.jvsComVerL.grid(row=3, column=0)
         self.jvsCom.grid(row=3, column=1)
         self.jvsInfoBox.grid(row=0,column=1, padx=10, pady=10)
+
+        self.after(0, self.checkScan)
+
+    def checkScan(self):
+        """Rescans for boards whenever devices are plugged or unplugged (not while connected, probing resets the bus), and fills the port list with what it found."""
+        idle = self.connection.status not in (ConnectState.CONNECTING, ConnectState.RETRYING, ConnectState.CONNECTED)
+        if self.scan is None:
+            if idle and self.discovery.changed():
+                self.connlabel.configure(text="Searching for IO boards...")
+                self.scan = self.scanPool.submit(self.discovery.scan)
+        elif self.scan.done():
+            results = self.scan.result()
+            self.scan = None
+            found = [r.port for r in results if r.found]
+            self.uartList = found + [r.port for r in results if not r.found]
+            self.port.configure(values=self.uartList)
+            if idle:
+                if found and self.ttyport.get() not in found:
+                    self.ttyport.set(found[0])
+                    self.connBtn.configure(state="normal")
+                self.connlabel.configure(text=(str(len(found)) + " IO board(s) found") if found else self.connection.statusText, fg=self.connection.statusColor)
+        self.after(1000 if self.scan is None else 100, self.checkScan)
         
 
     def checkBeforeConnect(self, string):
@@ -148,8 +177,15 @@ class jvsApp(tk.Tk):
         self.port.configure(state="disabled")
         self.sensePin.configure(state="disabled")
         self.update()
+        if self.scan is not None:
+            # The scan may be probing this very port, don't open it until that's over. checkScan() still picks up the results.
+            if self.scan.cancel():
+                self.scan = None
+            else:
+                wait([self.scan])
         self.jvsPort = Serial(port=self.ttyport.get(), baudrate=115200)
-        self.jvs = JVS(self.jvsPort, self.jvsInfo)
+        self.jvs = JVS(self.jvsPort, self.jvsInfo, sense=self.senseport.get())
+        self.switchMap = None
         result = self.jvs.connect()
         if result == ConnectState.CONNECTED:
             self.connTryCount = 0
@@ -169,8 +205,6 @@ class jvsApp(tk.Tk):
                 self.disconnect()
 
     def drawGPOFrame(self):
-        byteCount = int((1 * (self.jvsInfo.gpoCount / 8)) + 1)
-        self.gpo_States = BitArray(8 * byteCount)
         self.gpoFrame = tk.Frame(master=self)
         self.btnSetGPO = tk.Button(self.gpoFrame, text='All outputs ON', fg='green', command=self.setAllGPO)
         self.btnClrGPO = tk.Button(self.gpoFrame, text='All outputs OFF', fg='red', command=self.clearAllGPO)
@@ -187,7 +221,7 @@ class jvsApp(tk.Tk):
                 gy += 1
             else:
                 gx += 1
-        self.gpoLabel = tk.Label(self.gpoFrame, text=str('Output in hex: 0x') + format(BitArray(self.gpo_States).int, '0X'))
+        self.gpoLabel = tk.Label(self.gpoFrame, text=self.gpoText())
         self.gpoLabel.grid(row=gy+1, columnspan=4)
         self.gpoFrame.grid(row=1,column=0, pady=[0,10])
     
@@ -237,35 +271,34 @@ class jvsApp(tk.Tk):
             rI += 1
         self.inputFrame.grid(row=1,column=1, pady=[0,10])
 
+    def gpoText(self):
+        return 'Output in hex: 0x' + (self.jvs.gpo.hex().upper() if self.jvs and self.jvs.gpo else '0')
+
     def setAllGPO(self):
-        self.gpo_States.set(True)
-        status = self.jvs.setGPO(self.gpo_States.tobytes())
+        status = self.jvs.setGPO(packGPO((1 << self.jvsInfo.gpoCount) - 1, self.jvsInfo.gpoCount))
         if not status:
             self.reconnect()
             return
         for o in range(0, self.jvsInfo.gpoCount):
             self.dynamic_GPO[o].configure(fg='green')
+        self.gpoLabel.configure(text=self.gpoText())
 
     def clearAllGPO(self):
-        self.gpo_States.set(False)
-        status = self.jvs.setGPO(self.gpo_States.tobytes())
+        status = self.jvs.setGPO(packGPO(0, self.jvsInfo.gpoCount))
         if not status:
             self.reconnect()
             return
         for o in range(0, self.jvsInfo.gpoCount):
             self.dynamic_GPO[o].configure(fg='red')
+        self.gpoLabel.configure(text=self.gpoText())
 
     def toggleGPO(self, slot):
-        bit = ((len(self.gpo_States)-1) - slot)
-        self.gpo_States.invert(bit)
-        status = self.jvs.setGPO(self.gpo_States.tobytes())
+        state = not self.jvs.getOutput(slot)
+        status = self.jvs.setOutput(slot, state)
         if not status:
             self.reconnect()
             return
-        state = bool((self.gpo_States._getint()) & (1 << slot))
-        #print(self.gpo_States)
-        #print(state)
-        self.gpoLabel.configure(text=str('Output in hex: 0x') + format(BitArray(self.gpo_States).int, '0X'))
+        self.gpoLabel.configure(text=self.gpoText())
         if state:
             self.dynamic_GPO[slot].configure(fg='green')
         else: 
@@ -275,29 +308,22 @@ class jvsApp(tk.Tk):
         switches = self.jvs.getInputs()
         if not switches:
             return False
-        idx = 0
-        btnInt = int(switches[0])
-        if switches and (switches != lastSwitch):
-            if (bool((btnInt) & 0x80)): 
-                self.machineCanvas.itemconfigure(self.btnTestO, fill='red')
-            else: 
-                self.machineCanvas.itemconfigure(self.btnTestO, fill='red4')
-
+        if self.switchMap is None:
+            # One action per switch, in the order the lamps were drawn
+            self.switchMap = compileProfile(defaultProfile(self.jvsInfo.playerCount, self.jvsInfo.switchCount), self.jvsInfo.playerCount, switchBytes(self.jvsInfo))
+            self.switchLamps = [(self.machineCanvas, self.btnTestO)] + [None] * (len(CABINET_SWITCHES) - 1)
             for p in range(0, self.jvsInfo.playerCount):
-                idx += 1
-                btnInt = int(switches[idx])
-                slot = 0
-                for s in range(0, self.jvsInfo.switchCount):
-                    pOval = 1 + (2 * s)
-                    if (bool((btnInt) & (0x80 >> (s - (8 * slot))))): 
-                        self.playerCanvas[p].itemconfigure(pOval, fill='red')
-                    else:
-                        self.playerCanvas[p].itemconfigure(pOval, fill='red4')
-                    if s == 7:
-                        idx += 1
-                        btnInt = int(switches[idx])
-                        slot += 1
-            lastSwitch[:] = switches
+                self.switchLamps += [(self.playerCanvas[p], 1 + (2 * s)) for s in range(0, self.jvsInfo.switchCount)]
+            self.switchActions = None
+        actions = self.switchMap.decode(switches)
+        changed = actions ^ self.switchActions if self.switchActions is not None else (1 << len(self.switchLamps)) - 1
+        while changed:
+            bit = changed.bit_length() - 1
+            changed &= ~(1 << bit)
+            lamp = self.switchLamps[bit]
+            if lamp is not None:
+                lamp[0].itemconfigure(lamp[1], fill='red' if actions >> bit & 1 else 'red4')
+        self.switchActions = actions
         return True
     
     def reconnect(self):
@@ -375,12 +401,306 @@ class jvsApp(tk.Tk):
         else:
             return string[:index] + '.' + string[index:]
 
-if __name__ == "__main__":
-    cuList = glob.glob("/dev/cu.*")
+# Backoff between connect attempts for boards that failed or went away, in seconds
+RETRY_MIN_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
+class jvsBoardView():
+    """One board's page in the multi-board window. Widgets are only created when the page is first shown, and kept across reconnects unless the board comes back with a different layout."""
+    def __init__(self, master, port: str, baud: int = 115200, sense: str = None):
+        self.port = port
+        self.baud = baud
+        self.sense = sense
+        self.frame = tk.Frame(master)
+        self.statusLabel = tk.Label(self.frame, text="Not connected", fg="red", anchor='w')
+        self.statusLabel.grid(row=0, column=0, columnspan=2, sticky='w', padx=5, pady=5)
+        self.transport = None
+        self.jvs: JVS = None
+        self.state = ConnectState.DISCONNECTED
+        self.layout = None      # Feature counts the widgets were built for, None if not built
+        self.body = None
+        self.switchItems = []   # Canvas oval per switch bit, in report order, None for unused bits
+        self.coinLabels = []
+        self.gpoButtons = []
+        self.lastSwitches = None
+        self.lastCoins = None
+        self.retryDelay = RETRY_MIN_DELAY
+        self.retryAt = None     # monotonic() time of the next connect attempt after a failure
+
+    def title(self):
+        if self.jvs and self.state == ConnectState.CONNECTED:
+            return self.port + ': ' + self.jvs.ioBoard.name.strip('\x00\x01').split(';')[0]
+        return self.port
+
+    def connect(self):
+        """Opens the port if needed and enumerates the board. Blocks, so it's run on a worker thread."""
+        from jvstransport import openTransport
+        if self.transport is None or not self.transport.is_open:
+            self.transport = openTransport(self.port, self.baud)
+            self.jvs = JVS(self.transport, JVSIO(), sense=self.sense)
+        state = self.jvs.connect()
+        if state != ConnectState.CONNECTED:
+            # Open the port afresh next time, the adapter may have been unplugged
+            self.jvs.stopSenseMonitor()
+            self.transport.close()
+        return state
+
+    def scheduleRetry(self):
+        """Sets when to try connecting again after a failure, backing off up to RETRY_MAX_DELAY."""
+        self.retryAt = monotonic() + self.retryDelay
+        self.retryDelay = min(self.retryDelay * 2, RETRY_MAX_DELAY)
+
+    def setState(self, state: int):
+        self.state = state
+        connection = ConnectionState()
+        connection.setState(state)
+        self.statusLabel.configure(text=connection.statusText, fg=connection.statusColor)
+        if self.body is not None:
+            for button in self.gpoButtons:
+                button.configure(state='normal' if state == ConnectState.CONNECTED else 'disabled')
+
+    def boardLayout(self):
+        board = self.jvs.ioBoard
+        return (board.playerCount, board.switchCount, board.coinCount, board.gpoCount)
+
+    def show(self):
+        """Called when the page becomes visible: builds the widgets if there are none for this board's layout yet."""
+        if self.state != ConnectState.CONNECTED:
+            return
+        layout = self.boardLayout()
+        if layout != self.layout:
+            self.destroyBody()
+            self.build(layout)
+        # Hidden pages aren't refreshed, so draw everything on the next poll
+        self.lastSwitches = None
+        self.lastCoins = None
+
+    def build(self, layout: tuple):
+        playerCount, switchCount, coinCount, gpoCount = layout
+        self.layout = layout
+        self.body = tk.Frame(self.frame)
+        row = 0
+        self.coinLabels = []
+        for cn in range(0, coinCount):
+            label = tk.Label(self.body, text='Coin ' + str(cn + 1) + ': 0', anchor='w')
+            label.grid(row=row, column=0, columnspan=2, sticky='w')
+            self.coinLabels.append(label)
+            row += 1
+        # All switch lamps on one canvas, one item per switch, so a page costs a handful of widgets
+        # A line of lamps per report byte, so the canvas matches the report
+        perPlayer = switchBytes(self.jvs.ioBoard)
+        lines = 1 + playerCount * perPlayer
+        self.canvas = tk.Canvas(self.body, height=25 * lines + 5, width=25 * 9 + 60)
+        self.switchItems = [None] * (8 * (1 + playerCount * perPlayer))
+        self.canvas.create_text(30, 12, text='Service')
+        self.switchItems[0] = self.canvas.create_oval(60, 3, 77, 20, fill='red4')
+        line = 1
+        for p in range(0, playerCount):
+            self.canvas.create_text(30, 12 + 25 * line, text='P' + str(p + 1))
+            for b in range(0, switchCount):
+                x = 60 + 25 * (b % 8)
+                y = 3 + 25 * (line + b // 8)
+                self.switchItems[8 * (1 + p * perPlayer) + b] = self.canvas.create_oval(x, y, x + 17, y + 17, fill='red4')
+            line += perPlayer
+        self.canvas.grid(row=row, column=0, columnspan=2, sticky='w')
+        row += 1
+        self.gpoButtons = []
+        gpoFrame = tk.Frame(self.body)
+        for x in range(0, gpoCount):
+            button = tk.Button(gpoFrame, text='GPO' + str(x), fg='green' if self.jvs.getOutput(x) else 'red', width=5, command=partial(self.toggleGPO, x))
+            button.grid(row=x // 8, column=x % 8)
+            self.gpoButtons.append(button)
+        gpoFrame.grid(row=row, column=0, columnspan=2, sticky='w')
+        self.body.grid(row=1, column=0, sticky='nw', padx=5)
+
+    def destroyBody(self):
+        if self.body is not None:
+            self.body.destroy()
+        self.body = None
+        self.layout = None
+        self.switchItems = []
+        self.coinLabels = []
+        self.gpoButtons = []
+
+    def poll(self, visible: bool):
+        """Reads the board. Widgets are only touched when visible, and then only those whose value changed. Returns False if the board didn't answer."""
+        if self.state != ConnectState.CONNECTED:
+            return True
+        if self.jvs.connectState == ConnectState.LOST:
+            return False
+        if not visible or self.body is None:
+            return True
+        switches = self.jvs.getInputs()
+        if not switches:
+            return False
+        if switches != self.lastSwitches:
+            last = self.lastSwitches
+            items = self.switchItems
+            for i in range(0, min(len(switches), len(items) // 8)):
+                changed = switches[i] ^ last[i] if last is not None and i < len(last) else 0xFF
+                while changed:
+                    bit = changed.bit_length() - 1
+                    changed &= ~(1 << bit)
+                    item = items[8 * i + 7 - bit]
+                    if item is not None:
+                        self.canvas.itemconfigure(item, fill='red' if switches[i] & (1 << bit) else 'red4')
+            self.lastSwitches = bytes(switches)
+        if self.coinLabels:
+            coins = self.jvs.getCoinCount()
+            if not coins:
+                return False
+            if coins != self.lastCoins:
+                for c, (condition, count) in enumerate(decodeCoins(coins)):
+                    if c < len(self.coinLabels) and (self.lastCoins is None or coins[2 * c:2 * c + 2] != self.lastCoins[2 * c:2 * c + 2]):
+                        self.coinLabels[c].configure(text='Coin ' + str(c + 1) + ': ' + str(count) + ('' if condition == 0 else ' (' + JVS_CoinCodes(condition).name[9:].lower() + ')'))
+                self.lastCoins = bytes(coins)
+        return True
+
+    def toggleGPO(self, output: int):
+        level = not self.jvs.getOutput(output)
+        if self.jvs.setOutput(output, level):
+            self.gpoButtons[output].configure(fg='green' if level else 'red')
+
+    def close(self):
+        if self.jvs and self.state != ConnectState.DISCONNECTED:
+            try:
+                self.jvs.disconnect()
+            except Exception:
+                pass
+        elif self.transport:
+            self.transport.close()
+
+class jvsMultiApp(tk.Tk):
+    def __init__(self, ports: list = None, baud: int = 115200, sense: str = None, interval: int = 20):
+        """Tabbed window with a page per board. Boards on ports (or, with none given, every port discovery finds a board on) are connected concurrently; only the page on screen is drawn and polled."""
+        super().__init__()
+        self.title("JVS Test Utility")
+        self.baud = baud
+        self.sense = sense
+        self.interval = interval
+        self.views = []
+        self.pending = {}       # Future -> view, for connects in progress
+        self.pool = ThreadPoolExecutor(max_workers=8)
+        self.notebook = ttk.Notebook(self)
+        self.notebook.grid(row=0, column=0, sticky='nsew')
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.notebook.bind('<<NotebookTabChanged>>', self.tabChanged)
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        if ports:
+            self.addBoards(ports)
+        else:
+            discovery = JVS_PortDiscovery(baud)
+            self.discovery = self.pool.submit(lambda: [r.port for r in discovery.boards()])
+        self.after(0, self.tick)
+
+    def addBoards(self, ports: list):
+        for port in ports:
+            view = jvsBoardView(self.notebook, port, self.baud, self.sense)
+            self.views.append(view)
+            self.notebook.add(view.frame, text=port)
+            self.startConnect(view)
+
+    def startConnect(self, view: jvsBoardView):
+        view.setState(ConnectState.CONNECTING)
+        self.pending[self.pool.submit(view.connect)] = view
+
+    def visibleView(self):
+        if not self.views:
+            return None
+        return self.views[self.notebook.index('current')]
+
+    def tabChanged(self, event = None):
+        view = self.visibleView()
+        if view:
+            view.show()
+
+    def tick(self):
+        discovery = getattr(self, 'discovery', None)
+        if discovery is not None and discovery.done():
+            self.discovery = None
+            ports = discovery.result()
+            if ports:
+                self.addBoards(ports)
+            else:
+                tk.Label(self, text='No IO boards found').grid(row=1, column=0)
+        for future in [f for f in self.pending if f.done()]:
+            view = self.pending.pop(future)
+            try:
+                state = future.result()
+            except Exception:
+                state = ConnectState.FAILED
+            if state == ConnectState.CONNECTED:
+                view.setState(state)
+                view.retryDelay = RETRY_MIN_DELAY
+            else:
+                view.setState(ConnectState.FAILED)
+                view.scheduleRetry()
+            self.notebook.tab(view.frame, text=view.title())
+            if view is self.visibleView():
+                view.show()
+        visible = self.visibleView()
+        now = monotonic()
+        for view in self.views:
+            if view.state == ConnectState.FAILED and view.retryAt is not None and now >= view.retryAt:
+                # Boards unplugged at startup or lost and not back yet
+                view.retryAt = None
+                self.startConnect(view)
+            elif not view.poll(view is visible):
+                view.setState(ConnectState.LOST)
+                self.startConnect(view)
+        self.after(self.interval, self.tick)
+
+    def close(self):
+        for view in self.views:
+            view.close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+def main(args = None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description = "JVS test utility GUI.")
+    parser.add_argument(
+		"ports",
+		nargs = "*",
+		help = "with --boards, ports to show (default: every port a board is found on)",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"--boards",
+		action = "store_true",
+		help = "show several boards, a tab each"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-s", "--sense",
+		type = str,
+		choices = ["DSR", "DCD"],
+		help = "modem status line wired to JVS sense (--boards only)",
+	)
+    args = parser.parse_args(args)
+
+    if args.boards:
+        app = jvsMultiApp(args.ports, args.baud, args.sense)
+        app.mainloop()
+        return 0
+    # Every candidate to start with, checkScan() puts the ones with a board first once they're probed
+    cuList = args.ports if args.ports else [port for port, device in candidatePorts()]
     app = jvsApp(cuList)
     while app:
         app.update()
-        if app.connection.status == ConnectState.CONNECTED and app.jvsInfo.switchCount > 0:
+        if app.connection.status == ConnectState.CONNECTED and app.jvs.connectState == ConnectState.LOST:
+            # Sense monitor noticed the board drop off the line
+            app.reconnect()
+        elif app.connection.status == ConnectState.CONNECTED and app.jvsInfo.switchCount > 0:
             if not app.getSwitchStates():
                 app.reconnect()
-            
\ No newline at end of file
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
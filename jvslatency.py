@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# End-to-end input latency measurement.
+#
+# An input is toggled at known instants and the time getInputs() (or poll()) first reports the change
+# is taken as the observation, giving input-to-observation latency as a game polling the board would
+# see it. The stand-in board from jvsemu is used by default; its switch is flipped from a second thread
+# at random gaps so presses land at any point of the poll cycle, and it can hold its replies back for the
+# wire time at each baud rate. On real hardware a GPO output wired back to a switch input is driven with
+# setGPO() between polls instead; the instant taken is just before the setGPO() request goes out, so
+# those figures include the GPO transaction.
+
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from time import sleep, monotonic
+import sys, random, threading
+from jvscodec import packSwitches, switchBytes
+
+FRAME_PERIOD = 1 / 60
+
+def _readInputs(jvsIO, switches):
+    return jvsIO.getInputs(into=switches)
+
+def _readPoll(jvsIO, switches):
+    polled = jvsIO.poll()
+    if not polled or polled[0] is None:
+        return 0
+    switches[:] = packSwitches(*polled[0], switchBytes(jvsIO.ioBoard))
+    return switches
+
+# name: (read function, poll period (0 = back to back), waitForReply sleep interval or None for the default)
+LATENCY_STRATEGIES = {
+    'busy': (_readInputs, 0, None),         # getInputs() back to back
+    'spin': (_readInputs, 0, 0),            # getInputs() back to back, yielding instead of sleeping for the reply
+    'frame': (_readInputs, FRAME_PERIOD, 0),    # getInputs() once per 60 Hz game frame
+    'poll': (_readPoll, 0, 0)               # poll(), switches, coins and analog in one frame
+}
+
+@dataclass
+class JVS_LatencyResult:
+    strategy: str = ""
+    baud: int = 0
+    samples: list = field(default_factory = list)  # Latencies in seconds, sorted
+    missed: int = 0     # Changes never observed
+
+    def percentile(self, p: float):
+        if not self.samples:
+            return 0.0
+        return self.samples[min(int(round((p / 100) * (len(self.samples) - 1))), len(self.samples) - 1)]
+
+def _bitSet(switches, bit: int):
+    index, shift = divmod(bit, 8)
+    return bool(switches[index] & (0x80 >> shift)) if index < len(switches) else False
+
+def measureLatency(jvsIO, strategy: str, toggle, bit: int, count: int = 100, threaded: bool = True, gap: tuple = (0.005, 0.05), timeout: float = 1.0):
+    """Toggles an input count times with toggle(level), which returns the monotonic() time of the change, and times how long the given polling strategy takes to see the watched switch bit follow.
+    threaded runs toggle() from a second thread at random gaps, otherwise it is called from the poll loop (for a GPO loopback, which shares the bus). Returns a list of latencies in seconds and the number of changes missed."""
+    read, period, replyInterval = LATENCY_STRATEGIES[strategy]
+    savedInterval = jvsIO.replyInterval
+    if replyInterval is not None:
+        jvsIO.replyInterval = replyInterval
+    switches = bytearray()
+    results = []
+    missed = 0
+    level = False
+    toggle(False)
+    lock = threading.Lock()
+    changed = {'at': None, 'level': False}  # Set by whoever toggles, cleared by the poll loop once it's seen
+    seen = threading.Event()
+
+    def stimulus():
+        state = False
+        for n in range(0, count):
+            seen.clear()
+            sleep(random.uniform(*gap))
+            state = not state
+            with lock:
+                changed['level'] = state
+                changed['at'] = toggle(state)
+            seen.wait(timeout)
+
+    thread = None
+    if threaded:
+        thread = threading.Thread(target=stimulus, name='latency stimulus', daemon=True)
+        thread.start()
+    try:
+        toggles = 0
+        nextToggle = monotonic() + random.uniform(*gap)
+        tick = monotonic()
+        while True:
+            if not threaded:
+                if changed['at'] is None:
+                    if toggles >= count:
+                        break
+                    if monotonic() >= nextToggle:
+                        level = not level
+                        changed['level'] = level
+                        changed['at'] = toggle(level)
+                        toggles += 1
+            elif not thread.is_alive() and changed['at'] is None:
+                break
+            if period:
+                tick += period
+                wait = tick - monotonic()
+                if wait > 0:
+                    sleep(wait)
+                else:
+                    tick = monotonic()
+            reading = read(jvsIO, switches)
+            now = monotonic()
+            with lock:
+                at = changed['at']
+                if at is None:
+                    continue
+                if reading and _bitSet(reading, bit) == changed['level']:
+                    results.append(now - at)
+                elif now - at < timeout:
+                    continue
+                else:
+                    missed += 1
+                changed['at'] = None
+                seen.set()
+                nextToggle = now + random.uniform(*gap)
+    finally:
+        if thread:
+            thread.join(timeout)
+        jvsIO.replyInterval = savedInterval
+    toggle(False)
+    return results, missed
+
+def printResults(results: list):
+    print('strategy  baud      n     min      median   p99      max      (ms)')
+    for r in results:
+        if not r.samples:
+            print(r.strategy.ljust(10) + str(r.baud).ljust(10) + 'no changes observed')
+            continue
+        line = r.strategy.ljust(10) + str(r.baud).ljust(10) + str(len(r.samples)).ljust(6)
+        for value in (r.samples[0], r.percentile(50), r.percentile(99), r.samples[-1]):
+            line += format(value * 1000, '.3f').ljust(9)
+        if r.missed:
+            line += str(r.missed) + ' missed'
+        print(line)
+
+def main(args = None):
+    parser = ArgumentParser(description = "Measure input-to-observation latency for each polling strategy and baud rate.")
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		help = "serial port of a real IO board with a GPO wired back to a switch input (default: use the emulator)",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = str,
+		default = "115200",
+		help = "comma separated baud rates to test (default 115200)",
+		metavar = "values"
+	)
+    parser.add_argument(
+		"--strategies",
+		type = str,
+		default = ",".join(LATENCY_STRATEGIES),
+		help = "comma separated polling strategies, from " + ", ".join(LATENCY_STRATEGIES) + " (default all)",
+		metavar = "names"
+	)
+    parser.add_argument(
+		"-n", "--count",
+		type = int,
+		default = 100,
+		help = "input changes per measurement (default 100)",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"--bit",
+		type = int,
+		default = 8,
+		help = "switch bit to watch, 0 = Test, 8 = Player 1 Start (default 8)",
+		metavar = "index"
+	)
+    parser.add_argument(
+		"--gpo",
+		type = int,
+		default = 0,
+		help = "GPO output wired to the watched switch, from 0 as for set-gpo, with --port (default 0)",
+		metavar = "index"
+	)
+    args = parser.parse_args(args)
+
+    strategies = [s for s in args.strategies.split(',') if s]
+    for s in strategies:
+        if s not in LATENCY_STRATEGIES:
+            parser.error('unknown strategy ' + s)
+    bauds = [int(b) for b in args.baud.split(',') if b]
+
+    from jvs import JVS, JVSIO, ConnectState, COMCHG_RATES
+    emulator = None
+    if args.port:
+        for baud in bauds:
+            if baud not in COMCHG_RATES:
+                parser.error('a board can\'t be switched to ' + str(baud) + ' baud, use ' + ', '.join(str(b) for b in COMCHG_RATES))
+        from serial import Serial
+        # Boards always start at 115200, the sweep moves them on with COMCHG
+        jvsIO = JVS(Serial(args.port, 115200), JVSIO())
+    else:
+        from jvsemu import JVS_Emulator
+        emulator = JVS_Emulator()
+        emulator.start()
+        jvsIO = JVS(emulator.openPort(bauds[0]), JVSIO())
+    if jvsIO.connect() != ConnectState.CONNECTED:
+        print('Couldn\'t connect to an IO board')
+        return 1
+
+    if emulator:
+        toggle = lambda level: emulator.setSwitch(args.bit, level)
+    else:
+        from jvscodec import packGPO
+        gpoCount = jvsIO.ioBoard.gpoCount
+        if not 0 <= args.gpo < gpoCount:
+            print('Board has no GPO output ' + str(args.gpo))
+            jvsIO.disconnect()
+            return 1
+        def toggle(level):
+            at = monotonic()
+            # Same output numbering as JVS.setOutput(), output 0 is GPO 1
+            jvsIO.setGPO(packGPO((1 << args.gpo) if level else 0, gpoCount))
+            return at
+
+    results = []
+    complete = True
+    for baud in bauds:
+        if emulator:
+            jvsIO.cuPort.baudrate = baud
+            emulator.baudrate = baud
+        else:
+            try:
+                jvsIO.changeBaud(baud)
+            except ValueError as e:
+                print(str(e))
+                complete = False
+                break
+        for strategy in strategies:
+            samples, missed = measureLatency(jvsIO, strategy, toggle, args.bit, args.count, threaded=emulator is not None)
+            results.append(JVS_LatencyResult(strategy, baud, sorted(samples), missed))
+    printResults(results)
+    jvsIO.disconnect()
+    if emulator:
+        emulator.stop()
+    return 0 if complete and all(r.samples for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+# Durable coin and credit ledger.
+#
+# JVS_CoinLedger turns successive coin counter readings into events (coins in, counter taken down by
+# the host, counter reset, slot condition changes) and appends them to a log of fixed size, checksummed
+# records. The poll loop only queues the record; a writer thread writes everything queued in one go
+# and fsyncs once per batch (group commit), so a burst of coins costs one fsync and the poll loop never
+# waits on the disk. Per day, per slot totals are kept in memory and checkpointed to a small index
+# file, recording how much of the log they cover. Opening a ledger loads the checkpoint and replays only
+# the log after it; a torn record at the end of the log from a crash fails its checksum and is cut off,
+# so the totals always match the records that made it to disk.
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import date
+from time import time, monotonic
+import sys, os, struct, threading, zlib
+from jvsmacros import *
+
+# kind values
+LEDGER_COIN = 0         # Coins in, delta > 0
+LEDGER_ADJUST = 1       # Counter went down by delta (host decremented it, credits used)
+LEDGER_RESET = 2        # Counter restarted (board reset or first reading), delta is 0
+LEDGER_CONDITION = 3    # Slot condition changed, delta is 0
+LEDGER_KINDS = ('coin', 'adjust', 'reset', 'condition')
+
+_record = struct.Struct('<dBBhHB')          # timestamp, kind, slot, delta, count, condition
+_crc = struct.Struct('<I')
+LEDGER_RECORD_SIZE = _crc.size + _record.size
+_indexHeader = struct.Struct('<4sQI')       # magic, log bytes covered, entry count
+_indexEntry = struct.Struct('<IBqq')        # day ordinal, slot, coins, adjustments
+LEDGER_INDEX_MAGIC = b'JVL1'
+
+COUNTER_MASK = 0x3FFF   # Coin counters are 14 bits, the top 2 bits of the report are the condition
+
+@dataclass(slots=True)
+class JVS_CoinEvent:
+    timestamp: float = 0.0
+    kind: int = LEDGER_COIN
+    slot: int = 0           # From 1
+    delta: int = 0
+    count: int = 0          # Counter after the change
+    condition: int = JVS_CoinCodes.JVS_COIN_NORMAL
+
+def packEvent(event: JVS_CoinEvent):
+    body = _record.pack(event.timestamp, event.kind, event.slot, event.delta, event.count, event.condition)
+    return _crc.pack(zlib.crc32(body)) + body
+
+def unpackEvents(data, offset: int = 0):
+    """Yields (offset after, event) for each intact record from offset, stopping at the first torn or corrupt one."""
+    end = len(data)
+    while offset + LEDGER_RECORD_SIZE <= end:
+        (crc,) = _crc.unpack_from(data, offset)
+        body = bytes(data[offset + _crc.size:offset + LEDGER_RECORD_SIZE])
+        if zlib.crc32(body) != crc:
+            return
+        offset += LEDGER_RECORD_SIZE
+        yield offset, JVS_CoinEvent(*_record.unpack(body))
+
+def eventDay(timestamp: float):
+    """Local calendar day of a timestamp, as a date ordinal."""
+    return date.fromtimestamp(timestamp).toordinal()
+
+class JVS_CoinLedger():
+    def __init__(self, path: str, commitInterval: float = 0.05, checkpointEvery: int = 256):
+        """Opens (or creates) the ledger at path, recovering it if the last run didn't close it cleanly.
+        The writer thread gathers events for up to commitInterval seconds before each write and fsync, and checkpoints the index after checkpointEvery events."""
+        self.path = path
+        self.indexPath = path + '.idx'
+        self.commitInterval = commitInterval
+        self.checkpointEvery = checkpointEvery
+        self.totals = {}        # (day, slot) -> [coins, adjustments]
+        self.counts = {}        # slot -> last counter value seen
+        self.conditions = {}    # slot -> last condition seen
+        self.events = 0
+        self.commits = 0        # fsyncs done, each covers a batch
+        self.recovered = 0      # Bytes of torn records cut off the log when it was opened
+        self._pending = []
+        self._lock = threading.Condition()
+        self._durable = 0       # Events queued so far that are on disk
+        self._queued = 0
+        self._sinceCheckpoint = 0
+        self._stop = False
+        self.error = None       # What stopped the writer thread, raised again by record(), flush() and close()
+        self._recover()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._thread = threading.Thread(target=self._writer, name='JVS ledger', daemon=True)
+        self._thread.start()
+
+    # Recovery
+    def _recover(self):
+        logSize = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        covered = self._loadIndex(logSize)
+        if covered is None:
+            self.totals = {}
+            self.counts = {}
+            self.conditions = {}
+            covered = 0
+        valid = covered
+        if logSize > covered:
+            with open(self.path, 'rb') as f:
+                if covered == 0:
+                    data = f.read()
+                else:
+                    # Counters aren't in the index, so re-read the last records covered by it for them
+                    back = min(covered, LEDGER_RECORD_SIZE * 64)
+                    f.seek(covered - back)
+                    data = f.read()
+                    for offset, event in unpackEvents(data[:back]):
+                        self._track(event)
+                    data = data[back:]
+            for offset, event in unpackEvents(data):
+                self._apply(event)
+                valid = covered + offset
+        elif covered:
+            with open(self.path, 'rb') as f:
+                back = min(covered, LEDGER_RECORD_SIZE * 64)
+                f.seek(covered - back)
+                for offset, event in unpackEvents(f.read(back)):
+                    self._track(event)
+        if valid < logSize:
+            # Torn write from a crash, cut it off so new records line up
+            self.recovered = logSize - valid
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+                f.flush()
+                os.fsync(f.fileno())
+        self._covered = valid
+
+    def _loadIndex(self, logSize: int):
+        """Loads the checkpointed totals. Returns the log bytes they cover, or None if there's no usable index."""
+        try:
+            with open(self.indexPath, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < _indexHeader.size + _crc.size:
+            return None
+        (crc,) = _crc.unpack_from(data, len(data) - _crc.size)
+        if zlib.crc32(data[:-_crc.size]) != crc:
+            return None
+        magic, covered, entries = _indexHeader.unpack_from(data, 0)
+        if magic != LEDGER_INDEX_MAGIC or covered > logSize or covered % LEDGER_RECORD_SIZE:
+            return None
+        totals = {}
+        offset = _indexHeader.size
+        for n in range(0, entries):
+            day, slot, coins, adjustments = _indexEntry.unpack_from(data, offset)
+            offset += _indexEntry.size
+            totals[(day, slot)] = [coins, adjustments]
+        self.totals = totals
+        self.events = covered // LEDGER_RECORD_SIZE
+        return covered
+
+    def _track(self, event: JVS_CoinEvent):
+        self.counts[event.slot] = event.count
+        self.conditions[event.slot] = event.condition
+
+    def _apply(self, event: JVS_CoinEvent):
+        self._track(event)
+        self.events += 1
+        if event.kind == LEDGER_COIN or event.kind == LEDGER_ADJUST:
+            totals = self.totals.get((eventDay(event.timestamp), event.slot))
+            if totals is None:
+                totals = self.totals[(eventDay(event.timestamp), event.slot)] = [0, 0]
+            if event.kind == LEDGER_COIN:
+                totals[0] += event.delta
+            else:
+                totals[1] += event.delta
+
+    # Recording
+    def update(self, coins, timestamp: float = None):
+        """Takes a coin reading, either the raw report from JVS.getCoinCount() or decoded (condition, count) pairs, and records whatever changed since the last one. Returns the new events."""
+        if isinstance(coins, (bytes, bytearray, memoryview)):
+            from jvscodec import decodeCoins
+            coins = decodeCoins(coins)
+        now = time() if timestamp is None else timestamp
+        events = []
+        for index, (condition, count) in enumerate(coins):
+            slot = index + 1
+            count &= COUNTER_MASK
+            last = self.counts.get(slot)
+            if last is None:
+                events.append(JVS_CoinEvent(now, LEDGER_RESET, slot, 0, count, condition))
+            elif count != last:
+                up = (count - last) & COUNTER_MASK
+                down = (last - count) & COUNTER_MASK
+                if count == 0 and last > 1:
+                    # Counters only go down one at a time from the host, straight to zero is a board reset
+                    events.append(JVS_CoinEvent(now, LEDGER_RESET, slot, 0, count, condition))
+                elif up <= down:
+                    events.append(JVS_CoinEvent(now, LEDGER_COIN, slot, up, count, condition))
+                else:
+                    events.append(JVS_CoinEvent(now, LEDGER_ADJUST, slot, down, count, condition))
+            elif condition != self.conditions.get(slot):
+                events.append(JVS_CoinEvent(now, LEDGER_CONDITION, slot, 0, count, condition))
+        for event in events:
+            self.record(event)
+        return events
+
+    def record(self, event: JVS_CoinEvent):
+        """Queues an event for the writer thread and counts it in the totals straight away. Never waits on the disk."""
+        record = packEvent(event)
+        with self._lock:
+            if self.error is not None:
+                raise self.error
+            self._apply(event)
+            self._pending.append(record)
+            self._queued += 1
+            self._lock.notify_all()
+
+    def flush(self, timeout: float = None):
+        """Waits until everything recorded so far is on disk. Returns False on timeout, raises what stopped the writer if it died."""
+        with self._lock:
+            target = self._queued
+            done = self._lock.wait_for(lambda: self._durable >= target or self._stop or self.error is not None or not self._thread.is_alive(), timeout)
+            if self.error is not None:
+                raise self.error
+            return done
+
+    def close(self):
+        """Writes what's queued, checkpoints the index and stops the writer."""
+        with self._lock:
+            self._stop = True
+            self._lock.notify_all()
+        self._thread.join()
+        os.close(self._fd)
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _writer(self):
+        try:
+            self._writeBatches()
+        except BaseException as e:
+            # e.g. the disk filled up or went away. Nothing more gets written, so wake anyone waiting on a flush.
+            with self._lock:
+                self.error = e
+                self._pending = []
+                self._lock.notify_all()
+
+    def _writeBatches(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._pending or self._stop)
+                if not self._pending and self._stop:
+                    break
+            if not self._stop and self.commitInterval:
+                # Let the rest of a burst arrive so it shares the fsync
+                deadline = monotonic() + self.commitInterval
+                with self._lock:
+                    while not self._stop and monotonic() < deadline:
+                        self._lock.wait(deadline - monotonic())
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+                # Totals as of this batch, for the checkpoint
+                snapshot = {key: list(value) for key, value in self.totals.items()} if self._sinceCheckpoint + len(batch) >= self.checkpointEvery or self._stop else None
+            data = b''.join(batch)
+            written = 0
+            while written < len(data):
+                written += os.write(self._fd, data[written:])
+            os.fsync(self._fd)
+            self._covered += len(data)
+            self._sinceCheckpoint += len(batch)
+            if snapshot is not None:
+                self._checkpoint(snapshot, self._covered)
+            with self._lock:
+                self.commits += 1
+                self._durable += len(batch)
+                self._lock.notify_all()
+        self._checkpoint({key: list(value) for key, value in self.totals.items()}, self._covered)
+        with self._lock:
+            self._lock.notify_all()
+
+    def _checkpoint(self, totals: dict, covered: int):
+        """Writes the totals and how much of the log they cover, atomically."""
+        data = bytearray(_indexHeader.pack(LEDGER_INDEX_MAGIC, covered, len(totals)))
+        for (day, slot), (coins, adjustments) in sorted(totals.items()):
+            data += _indexEntry.pack(day, slot, coins, adjustments)
+        data += _crc.pack(zlib.crc32(data))
+        temp = self.indexPath + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.indexPath)
+        self._sinceCheckpoint = 0
+
+    # Queries
+    def total(self, slot: int = None, day: date = None):
+        """Coins in, for one slot and/or one day, or everything."""
+        ordinal = day.toordinal() if day is not None else None
+        with self._lock:
+            return sum(coins for (d, s), (coins, adjustments) in self.totals.items()
+                if (slot is None or s == slot) and (ordinal is None or d == ordinal))
+
+    def dayTotals(self):
+        """{date: {slot: (coins, adjustments)}}."""
+        days = {}
+        with self._lock:
+            for (d, s), (coins, adjustments) in sorted(self.totals.items()):
+                days.setdefault(date.fromordinal(d), {})[s] = (coins, adjustments)
+        return days
+
+def readLog(path: str):
+    """Every intact event in a ledger log, oldest first."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [event for offset, event in unpackEvents(data)]
+
+def main(args = None):
+    parser = ArgumentParser(description = "Show or check a coin ledger.")
+    parser.add_argument(
+		"path",
+		type = str,
+		help = "ledger log file",
+	)
+    parser.add_argument(
+		"--verify",
+		action = "store_true",
+		help = "replay the whole log and check the index totals match it"
+	)
+    parser.add_argument(
+		"--events",
+		action = "store_true",
+		help = "list every event"
+	)
+    args = parser.parse_args(args)
+
+    if args.events:
+        for event in readLog(args.path):
+            print(format(event.timestamp, '.3f') + ' slot ' + str(event.slot) + ' ' + LEDGER_KINDS[event.kind].ljust(10) \
+                + ('+' if event.kind == LEDGER_COIN else '-' if event.kind == LEDGER_ADJUST else ' ') + str(event.delta).ljust(4) \
+                + ' count ' + str(event.count) + ' condition ' + str(event.condition))
+    with JVS_CoinLedger(args.path) as ledger:
+        if ledger.recovered:
+            print('Cut ' + str(ledger.recovered) + ' bytes of torn records off the end of the log')
+        for day, slots in ledger.dayTotals().items():
+            print(day.isoformat() + ': ' + ', '.join('slot ' + str(s) + ' ' + str(coins) + ' in, ' + str(adjustments) + ' used' for s, (coins, adjustments) in slots.items()))
+        print('Total: ' + str(ledger.total()) + ' coins in ' + str(ledger.events) + ' events')
+        if args.verify:
+            replayed = {}
+            for event in readLog(args.path):
+                if event.kind == LEDGER_COIN:
+                    key = (eventDay(event.timestamp), event.slot)
+                    replayed[key] = replayed.get(key, 0) + event.delta
+            indexed = {key: value[0] for key, value in ledger.totals.items() if value[0]}
+            if replayed != indexed:
+                print('Index does not match the log')
+                return 1
+            print('Index matches the log')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
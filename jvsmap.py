@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Input mapping: switch report bits to game actions.
+#
+# A profile names actions and the switch each one comes from, plus combos (actions that fire when all
+# of a set of others are held). compileProfile() gives every action a bit in an int and builds, for each
+# byte of the switch report that has a mapped switch in it, a 256 entry table from that byte's value to
+# the actions it holds. Decoding a whole getInputs() report is then one lookup and OR per used byte,
+# and a mask test per combo.
+#
+# JVS_InputMapper loads a profile file and sits in the JVS input pipeline (JVS.inputFilters) like
+# JVS_InputHistory does, leaving the current actions in .actions. It checks the file for changes every
+# so often from the poll loop and swaps in the recompiled tables in one assignment, so edits take effect
+# without restarting anything; a profile with mistakes is reported and the old tables are kept.
+#
+# Profile (JSON):
+#   {
+#       "actions": {"coin": "cab.test", "jump": "p1.button1", "p2_fire": "p2.6"},
+#       "combos": {"menu": ["p1_start", "p2_start"]}
+#   }
+# Switches are cab.<n> or p<player>.<n>, numbered from the MSB of the first byte as in the layout main()
+# prints in jvs.py ("T123xxxx" for the cabinet, "S$UDLR12 345678+" per player), or by the names below.
+
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from time import monotonic
+import sys, os, json
+from jvscodec import switchBytes
+
+CABINET_SWITCHES = ('test', 'tilt1', 'tilt2', 'tilt3')
+PLAYER_SWITCHES = ('start', 'service', 'up', 'down', 'left', 'right', 'button1', 'button2', 'button3', 'button4', 'button5', 'button6', 'button7', 'button8')
+
+class JVS_MapError(Exception):
+    pass
+
+@dataclass
+class JVS_CompiledMap:
+    names: list = field(default_factory = list)     # Action name for each bit of the mask
+    tables: list = field(default_factory = list)    # (report byte index, 256 masks)
+    combos: list = field(default_factory = list)    # (mask of actions that must all be held, combo's bit)
+    reportBytes: int = 0
+
+    def decode(self, switches):
+        """Actions held in a switch report, as a mask with bit n for names[n]."""
+        mask = 0
+        length = len(switches)
+        for index, table in self.tables:
+            if index < length:
+                mask |= table[switches[index]]
+        for needed, bit in self.combos:
+            if mask & needed == needed:
+                mask |= bit
+        return mask
+
+    def bit(self, name: str):
+        """Mask bit for an action."""
+        return 1 << self.names.index(name)
+
+    def held(self, mask: int):
+        """Names of the actions in a mask."""
+        return [name for n, name in enumerate(self.names) if mask >> n & 1]
+
+def switchBit(spec: str, switchBytes: int):
+    """Report bit index for a switch spec such as 'cab.test', 'p1.start' or 'p2.6' (index 0 = MSB of the first byte of the report)."""
+    try:
+        group, switch = spec.strip().lower().split('.')
+        if group == 'cab':
+            names = CABINET_SWITCHES
+            base = 0
+            width = 8
+        elif group.startswith('p') and int(group[1:]) >= 1:
+            names = PLAYER_SWITCHES
+            base = 8 + (int(group[1:]) - 1) * 8 * switchBytes
+            width = 8 * switchBytes
+        else:
+            raise ValueError
+        index = names.index(switch) if switch in names else int(switch)
+    except ValueError:
+        raise JVS_MapError('Not a switch: ' + repr(spec))
+    if not 0 <= index < width:
+        raise JVS_MapError('Switch out of range: ' + repr(spec))
+    return base + index
+
+def compileProfile(profile: dict, players: int, switchBytes: int):
+    """Builds the lookup tables for a profile on a board with players players and switchBytes bytes each. Raises JVS_MapError if the profile doesn't fit."""
+    if not isinstance(profile, dict):
+        raise JVS_MapError('Profile must be an object')
+    actions = profile.get('actions', {})
+    combos = profile.get('combos', {})
+    if not isinstance(actions, dict) or not isinstance(combos, dict):
+        raise JVS_MapError('actions and combos must be objects')
+    compiled = JVS_CompiledMap(reportBytes=1 + players * switchBytes)
+    for name in combos:
+        if name in actions:
+            raise JVS_MapError('Combo ' + repr(name) + ' has the same name as an action')
+    compiled.names = list(actions) + list(combos)
+    byTable = {}
+    for n, (name, specs) in enumerate(actions.items()):
+        # An action can come from several switches, e.g. the same button on both players
+        if isinstance(specs, str):
+            specs = [specs]
+        if not isinstance(specs, list) or not all(isinstance(spec, str) for spec in specs):
+            raise JVS_MapError('Action ' + repr(name) + ' must name a switch or a list of them')
+        for spec in specs:
+            bit = switchBit(spec, switchBytes)
+            index, shift = divmod(bit, 8)
+            if index >= compiled.reportBytes:
+                raise JVS_MapError('Board has no switch ' + repr(spec))
+            table = byTable.get(index)
+            if table is None:
+                table = byTable[index] = [0] * 256
+            switch = 0x80 >> shift
+            for value in range(0, 256):
+                if value & switch:
+                    table[value] |= 1 << n
+    compiled.tables = sorted(byTable.items())
+    for name, parts in combos.items():
+        if not isinstance(parts, list):
+            raise JVS_MapError('Combo ' + repr(name) + ' must be a list of actions')
+        needed = 0
+        for part in parts:
+            if part not in compiled.names or part == name:
+                raise JVS_MapError('Combo ' + repr(name) + ' needs unknown action ' + repr(part))
+            needed |= compiled.bit(part)
+        compiled.combos.append((needed, compiled.bit(name)))
+    return compiled
+
+def defaultProfile(players: int, switchCount: int):
+    """Profile mapping every switch on the board to an action named after it, e.g. 'p1_start'."""
+    actions = {}
+    for n in range(0, len(CABINET_SWITCHES)):
+        actions[CABINET_SWITCHES[n]] = 'cab.' + str(n)
+    for p in range(1, players + 1):
+        for n in range(0, switchCount):
+            actions['p' + str(p) + '_' + (PLAYER_SWITCHES[n] if n < len(PLAYER_SWITCHES) else str(n))] = 'p' + str(p) + '.' + str(n)
+    return {'actions': actions, 'combos': {}}
+
+class JVS_InputMapper():
+    def __init__(self, profile, players: int, switchBytes: int, reloadInterval: float = 1.0):
+        """Maps switch reports to actions. profile is a dict, or the path of a JSON profile that's reloaded when it changes (checked every reloadInterval seconds)."""
+        self.players = players
+        self.switchBytes = switchBytes
+        self.reloadInterval = reloadInterval
+        self.path = None if isinstance(profile, dict) else profile
+        self.actions = 0        # Actions held in the last report
+        self.reloads = 0
+        self.error = None       # Why the last reload was rejected
+        self._signature = None
+        self._nextCheck = 0.0
+        if self.path is None:
+            self.compiled = compileProfile(profile, players, switchBytes)
+        else:
+            self.compiled = None
+            self.reload()
+            if self.compiled is None:
+                raise JVS_MapError(self.error)
+
+    @classmethod
+    def forBoard(cls, profile, ioBoard, **kwargs):
+        return cls(profile, ioBoard.playerCount, switchBytes(ioBoard), **kwargs)
+
+    def _fileSignature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def reload(self):
+        """Recompiles the profile file if it changed. Returns True if new tables were swapped in."""
+        signature = self._fileSignature()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            with open(self.path) as f:
+                compiled = compileProfile(json.load(f), self.players, self.switchBytes)
+        except (OSError, ValueError, JVS_MapError) as e:
+            # Keep going with the old tables, the file may be half saved
+            self.error = str(e)
+            print('Input profile not loaded: ' + self.error)
+            return False
+        self.error = None
+        self.compiled = compiled
+        self.reloads += 1
+        return True
+
+    def decode(self, switches):
+        """Actions held in a switch report, as a mask (see compiled.names)."""
+        if self.path is not None:
+            now = monotonic()
+            if now >= self._nextCheck:
+                self._nextCheck = now + self.reloadInterval
+                self.reload()
+        self.actions = self.compiled.decode(switches)
+        return self.actions
+
+    def __call__(self, switches):
+        """Input pipeline hook for JVS.inputFilters. Updates actions and passes the report through unchanged."""
+        self.decode(switches)
+        return switches
+
+def main(args = None):
+    parser = ArgumentParser(description = "Map switches to game actions with a profile, and show actions as they're pressed.")
+    parser.add_argument(
+		"profile",
+		nargs = "?",
+		help = "JSON profile, reloaded when it changes (default: every switch as its own action)",
+	)
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		default = "loopback",
+		help = "port to use, as for jvs.py -p (default loopback)",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"--write-default",
+		type = str,
+		help = "write a profile mapping every switch on the board to this file and exit",
+		metavar = "path"
+	)
+    parser.add_argument(
+		"--bench",
+		type = int,
+		default = 0,
+		help = "time decoding this many switch reports and exit",
+		metavar = "count"
+	)
+    args = parser.parse_args(args)
+
+    from jvs import JVS, JVSIO, ConnectState
+    from jvstransport import openTransport
+    jvsIO = JVS(openTransport(args.port, args.baud), JVSIO())
+    if jvsIO.connect() != ConnectState.CONNECTED:
+        print('No IO board found on ' + args.port)
+        return 1
+    board = jvsIO.ioBoard
+    if args.write_default:
+        with open(args.write_default, 'w') as f:
+            json.dump(defaultProfile(board.playerCount, board.switchCount), f, indent=4)
+        jvsIO.disconnect()
+        return 0
+    try:
+        mapper = JVS_InputMapper.forBoard(args.profile if args.profile else defaultProfile(board.playerCount, board.switchCount), board)
+    except JVS_MapError as e:
+        print('Input profile not loaded: ' + str(e))
+        jvsIO.disconnect()
+        return 1
+    if args.bench:
+        from time import perf_counter
+        switches = jvsIO.getInputs()
+        compiled = mapper.compiled
+        start = perf_counter()
+        for n in range(0, args.bench):
+            compiled.decode(switches)
+        elapsed = perf_counter() - start
+        print(str(len(compiled.names)) + ' actions from ' + str(len(compiled.tables)) + ' tables: ' + format(elapsed / args.bench * 1000000, '.2f') + ' us per report')
+        jvsIO.disconnect()
+        return 0
+    jvsIO.inputFilters.append(mapper)
+    switches = bytearray()
+    last = None
+    print('Press buttons, Ctrl+C to stop')
+    try:
+        while True:
+            if jvsIO.getInputs(into=switches) and mapper.actions != last:
+                last = mapper.actions
+                print(' '.join(mapper.compiled.held(last)) or '-', flush=True)
+    except KeyboardInterrupt:
+        pass
+    jvsIO.disconnect()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
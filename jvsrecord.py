@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+# Decoded input recorder.
+#
+# JVS_Recorder takes what JVS.poll() returns (cabinet byte and one int per player, coin conditions and
+# counts, analog channels) and fills fixed size NumPy columns, one row per poll. Full chunks go to a
+# writer thread, so the poll loop only pays for the row assignments. The writer stores each chunk as a
+# compressed .npz in the recording directory: timestamps as microsecond deltas, analog channels as
+# deltas, and switches, coins and coin conditions run length encoded (the rows where the value changed,
+# and the values from there on), which for buttons that are mostly idle leaves almost nothing.
+#
+# JVS_Recording reads a recording back one chunk at a time. Each chunk carries its time span and the
+# loader only decompresses the columns a query asks for, so time range queries skip chunks without
+# unpacking them and presses() works straight off the run length encoded switch rows.
+#
+# Switch numbers follow the per player layout main() prints in jvs.py: 0 is the MSB of the player's
+# first byte (Start), 1 is Service, then Up, Down, Left, Right, Button 1...
+
+from argparse import ArgumentParser
+from dataclasses import dataclass, asdict, replace
+from time import time, sleep
+import sys, os, json, queue, threading
+import numpy
+from jvscodec import switchBytes
+
+RECORD_CHUNK_ROWS = 4096
+RECORD_META = 'meta.json'
+
+@dataclass
+class JVS_RecordLayout:
+    name: str = ""
+    players: int = 0
+    switchBytes: int = 0
+    coins: int = 0
+    analog: int = 0
+    chunkRows: int = RECORD_CHUNK_ROWS
+
+def _rle(values):
+    """Run length encodes a column (or a 2D block, row by row). Returns (start rows, values of each run)."""
+    if len(values) == 0:
+        return numpy.zeros(0, dtype=numpy.uint32), values
+    changed = values[1:] != values[:-1]
+    if values.ndim > 1:
+        changed = changed.any(axis=1)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(changed) + 1)).astype(numpy.uint32)
+    return starts, values[starts]
+
+def _unrle(starts, values, rows: int):
+    return numpy.repeat(values, numpy.diff(numpy.append(starts, rows).astype(numpy.int64)), axis=0)
+
+def chunkNumbers(path: str):
+    """Sequence numbers of the chunks in a recording directory."""
+    numbers = []
+    for name in os.listdir(path):
+        if name.startswith('chunk-') and name.endswith('.npz') and not name.endswith('.tmp.npz'):
+            try:
+                numbers.append(int(name[6:-4]))
+            except ValueError:
+                pass
+    return numbers
+
+class JVS_Recorder():
+    def __init__(self, path: str, ioBoard, chunkRows: int = RECORD_CHUNK_ROWS):
+        """Records into the directory path (created if needed) for a board with ioBoard's layout. Feed it with record() from the poll loop, close() when done."""
+        playerBytes = switchBytes(ioBoard)
+        self.path = path
+        self.layout = JVS_RecordLayout(ioBoard.name.strip('\x00\x01'), ioBoard.playerCount, playerBytes, ioBoard.coinCount, ioBoard.analogCount, chunkRows)
+        self.switchType = numpy.uint32 if playerBytes <= 4 else numpy.uint64
+        self.rows = 0               # Rows recorded
+        self.chunks = 0             # Chunks handed to the writer
+        self.bytesWritten = 0
+        self.error = None           # What stopped the writer thread, raised again by record() and close()
+        os.makedirs(path, exist_ok=True)
+        metaPath = os.path.join(path, RECORD_META)
+        if os.path.exists(metaPath):
+            # Carry on after an earlier run into the same directory, but only for the same board, the chunks are read with one layout
+            with open(metaPath) as f:
+                earlier = JVS_RecordLayout(**json.load(f))
+            if replace(earlier, chunkRows=chunkRows) != self.layout:
+                raise ValueError(path + ' holds a recording of a different board (' + earlier.name + ')')
+        else:
+            with open(metaPath, 'w') as f:
+                json.dump(asdict(self.layout), f, indent=2)
+        self._sequence = 1 + max(chunkNumbers(path), default=-1)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, name='JVS recorder', daemon=True)
+        self._thread.start()
+        self._newChunk()
+
+    def _newChunk(self):
+        layout = self.layout
+        rows = layout.chunkRows
+        self._row = 0
+        self._time = numpy.zeros(rows, dtype=numpy.float64)
+        self._cabinet = numpy.zeros(rows, dtype=numpy.uint8)
+        self._switches = numpy.zeros((rows, layout.players), dtype=self.switchType)
+        self._coins = numpy.zeros((rows, layout.coins), dtype=numpy.uint16)
+        self._conditions = numpy.zeros((rows, layout.coins), dtype=numpy.uint8)
+        self._analog = numpy.zeros((rows, layout.analog), dtype=numpy.uint16)
+
+    def record(self, polled, timestamp: float = None):
+        """Adds one poll, as returned by JVS.poll(): (switches, coins, analog), any of which may be None. A failed poll (None) is skipped."""
+        if self.error is not None:
+            raise self.error
+        if polled is None:
+            return
+        switches, coins, analog = polled
+        row = self._row
+        self._time[row] = time() if timestamp is None else timestamp
+        if row:
+            # Anything not read this poll keeps its last value
+            self._cabinet[row] = self._cabinet[row - 1]
+            self._switches[row] = self._switches[row - 1]
+            self._coins[row] = self._coins[row - 1]
+            self._conditions[row] = self._conditions[row - 1]
+            self._analog[row] = self._analog[row - 1]
+        if switches:
+            self._cabinet[row] = switches[0]
+            self._switches[row] = switches[1]
+        if coins:
+            for slot, (condition, count) in enumerate(coins):
+                self._conditions[row, slot] = condition
+                self._coins[row, slot] = count
+        if analog:
+            self._analog[row] = analog
+        self._row = row + 1
+        self.rows += 1
+        if self._row == self.layout.chunkRows:
+            self.flush()
+
+    def flush(self):
+        """Hands the rows so far to the writer as a chunk, even if it isn't full."""
+        if self._row == 0:
+            return
+        rows = self._row
+        chunk = (self._sequence, self._time[:rows], self._cabinet[:rows], self._switches[:rows], self._coins[:rows], self._conditions[:rows], self._analog[:rows])
+        last = (self._cabinet[rows - 1], self._switches[rows - 1].copy(), self._coins[rows - 1].copy(), self._conditions[rows - 1].copy(), self._analog[rows - 1].copy())
+        self._sequence += 1
+        self.chunks += 1
+        self._queue.put(chunk)
+        self._newChunk()
+        # Start the next chunk from the current state so rows that don't read everything carry it over
+        self._cabinet[0], self._switches[0], self._coins[0], self._conditions[0], self._analog[0] = last
+
+    def close(self):
+        """Writes what's left and waits for the writer to finish."""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _writer(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self.error is not None:
+                # Keep draining so the queue doesn't grow while record() reports the error
+                continue
+            try:
+                self._writeChunk(chunk)
+            except Exception as e:
+                self.error = e
+
+    def _writeChunk(self, chunk):
+        sequence, times, cabinet, switches, coins, conditions, analog = chunk
+        micros = numpy.rint((times - times[0]) * 1000000).astype(numpy.int64)
+        columns = {
+            'bounds': numpy.array((times[0], times[-1])),
+            'rows': numpy.array(len(times)),
+            'timeDelta': numpy.diff(micros).astype(numpy.uint32 if len(micros) < 2 or micros[-1] < 1 << 32 else numpy.int64),
+            'analogFirst': analog[:1],
+            'analogDelta': numpy.diff(analog.astype(numpy.int32), axis=0),
+        }
+        for name, values in (('cabinet', cabinet), ('switches', switches), ('coins', coins), ('conditions', conditions)):
+            columns[name + 'At'], columns[name] = _rle(values)
+        name = os.path.join(self.path, 'chunk-' + format(sequence, '06d') + '.npz')
+        temp = name[:-4] + '.tmp.npz'
+        numpy.savez_compressed(temp, **columns)
+        os.replace(temp, name)
+        self.bytesWritten += os.path.getsize(name)
+
+class JVS_Recording():
+    def __init__(self, path: str):
+        """Opens a recording directory written by JVS_Recorder."""
+        self.path = path
+        with open(os.path.join(path, RECORD_META)) as f:
+            self.layout = JVS_RecordLayout(**json.load(f))
+        self.files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.startswith('chunk-') and name.endswith('.npz') and not name.endswith('.tmp.npz'))
+
+    def chunks(self, t0: float = None, t1: float = None):
+        """Yields each chunk overlapping t0..t1 as an open NpzFile. Columns are decompressed when first read."""
+        for name in self.files:
+            with numpy.load(name) as chunk:
+                start, end = chunk['bounds']
+                if (t1 is not None and start > t1) or (t0 is not None and end < t0):
+                    continue
+                yield chunk
+
+    def times(self, chunk):
+        return chunk['bounds'][0] + numpy.concatenate(([0], numpy.cumsum(chunk['timeDelta'], dtype=numpy.int64))) / 1000000
+
+    def decode(self, chunk):
+        """Every column of a chunk, one row per poll."""
+        rows = int(chunk['rows'])
+        columns = {'time': self.times(chunk)}
+        for name in ('cabinet', 'switches', 'coins', 'conditions'):
+            columns[name] = _unrle(chunk[name + 'At'], chunk[name], rows)
+        analog = chunk['analogFirst'].astype(numpy.int32)
+        if len(analog):
+            analog = numpy.concatenate((analog, analog + numpy.cumsum(chunk['analogDelta'], axis=0)))
+        columns['analog'] = analog.astype(numpy.uint16)
+        return columns
+
+    def load(self, t0: float = None, t1: float = None):
+        """All columns between t0 and t1 (default everything) as one set of arrays."""
+        parts = [self.decode(chunk) for chunk in self.chunks(t0, t1)]
+        if not parts:
+            return None
+        columns = {name: numpy.concatenate([part[name] for part in parts]) for name in parts[0]}
+        keep = numpy.ones(len(columns['time']), dtype=bool)
+        if t0 is not None:
+            keep &= columns['time'] >= t0
+        if t1 is not None:
+            keep &= columns['time'] <= t1
+        return {name: values[keep] for name, values in columns.items()}
+
+    def edges(self, player: int, switch: int, t0: float = None, t1: float = None):
+        """Times a player's switch (player from 1, switch from 0 as in the file header) went on and off between t0 and t1. Returns (presses, releases) as arrays of timestamps."""
+        shift = 8 * self.layout.switchBytes - 1 - switch
+        presses = []
+        releases = []
+        previous = None
+        for chunk in self.chunks(t0, t1):
+            starts = chunk['switchesAt']
+            levels = (chunk['switches'][:, player - 1] >> shift) & 1
+            times = self.times(chunk)[starts]
+            before = numpy.concatenate(([levels[0] if previous is None else previous], levels[:-1]))
+            presses.append(times[(levels == 1) & (before == 0)])
+            releases.append(times[(levels == 0) & (before == 1)])
+            previous = levels[-1] if len(levels) else previous
+        presses = numpy.concatenate(presses) if presses else numpy.zeros(0)
+        releases = numpy.concatenate(releases) if releases else numpy.zeros(0)
+        if t0 is not None:
+            presses, releases = presses[presses >= t0], releases[releases >= t0]
+        if t1 is not None:
+            presses, releases = presses[presses <= t1], releases[releases <= t1]
+        return presses, releases
+
+    def presses(self, player: int, switch: int, t0: float = None, t1: float = None):
+        """Times a player's switch went on between t0 and t1."""
+        return self.edges(player, switch, t0, t1)[0]
+
+def _parseTime(value: str):
+    """Epoch seconds, or an ISO date/time in local time."""
+    try:
+        return float(value)
+    except ValueError:
+        from datetime import datetime
+        return datetime.fromisoformat(value).timestamp()
+
+def main(args = None):
+    parser = ArgumentParser(description = "Record decoded inputs to disk and query recordings.")
+    commands = parser.add_subparsers(dest = "command", metavar = "command", required = True)
+    command = commands.add_parser("record", help = "poll a board and record everything it reports")
+    command.add_argument(
+		"path",
+		type = str,
+		help = "recording directory"
+	)
+    command.add_argument(
+		"-p", "--port",
+		type = str,
+		required = True,
+		help = "port to use, as for jvs.py -p",
+		metavar = "port"
+	)
+    command.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    command.add_argument(
+		"-t", "--time",
+		type = float,
+		default = 0,
+		help = "seconds to record (default until interrupted)",
+		metavar = "seconds"
+	)
+    command.add_argument(
+		"-i", "--interval",
+		type = float,
+		default = 0.005,
+		help = "seconds between polls (default 0.005)",
+		metavar = "seconds"
+	)
+    command = commands.add_parser("info", help = "summarize a recording")
+    command.add_argument(
+		"path",
+		type = str,
+		help = "recording directory"
+	)
+    command = commands.add_parser("presses", help = "list the times a switch was pressed")
+    command.add_argument(
+		"path",
+		type = str,
+		help = "recording directory"
+	)
+    command.add_argument(
+		"--player",
+		type = int,
+		default = 1,
+		help = "player, from 1 (default 1)",
+	)
+    command.add_argument(
+		"--switch",
+		type = int,
+		default = 0,
+		help = "switch, from 0 = Start (default 0)",
+	)
+    command.add_argument(
+		"--from",
+		dest = "start",
+		type = _parseTime,
+		help = "start time, epoch seconds or ISO date/time",
+		metavar = "time"
+	)
+    command.add_argument(
+		"--to",
+		dest = "end",
+		type = _parseTime,
+		help = "end time, epoch seconds or ISO date/time",
+		metavar = "time"
+	)
+    args = parser.parse_args(args)
+
+    if args.command == "record":
+        from jvs import JVS, JVSIO, ConnectState
+        from jvstransport import openTransport
+        jvsIO = JVS(openTransport(args.port, args.baud), JVSIO())
+        if jvsIO.connect() != ConnectState.CONNECTED:
+            print('No IO board found on ' + args.port)
+            return 1
+        end = time() + args.time if args.time else None
+        try:
+            recorder = JVS_Recorder(args.path, jvsIO.ioBoard)
+        except ValueError as e:
+            print(str(e))
+            jvsIO.disconnect()
+            return 1
+        try:
+            with recorder:
+                try:
+                    while end is None or time() < end:
+                        recorder.record(jvsIO.poll())
+                        if args.interval:
+                            sleep(args.interval)
+                except KeyboardInterrupt:
+                    pass
+        except OSError as e:
+            print('Recording stopped: ' + str(e))
+            jvsIO.disconnect()
+            return 1
+        jvsIO.disconnect()
+        print(str(recorder.rows) + ' polls in ' + str(recorder.chunks) + ' chunks, ' + str(recorder.bytesWritten) + ' bytes')
+        return 0
+
+    recording = JVS_Recording(args.path)
+    if args.command == "info":
+        layout = recording.layout
+        rows = 0
+        start = end = None
+        size = 0
+        for name in recording.files:
+            size += os.path.getsize(name)
+        for chunk in recording.chunks():
+            rows += int(chunk['rows'])
+            bounds = chunk['bounds']
+            start = bounds[0] if start is None else start
+            end = bounds[1]
+        print(layout.name.replace(';', ' / '))
+        print(str(layout.players) + ' players, ' + str(layout.coins) + ' coin slots, ' + str(layout.analog) + ' analog channels')
+        if rows:
+            raw = rows * (8 + 1 + layout.players * layout.switchBytes + 2 * layout.coins + 2 * layout.analog)
+            print(str(rows) + ' polls in ' + str(len(recording.files)) + ' chunks over ' + format(end - start, '.1f') + ' s, ' \
+                + str(size) + ' bytes (' + format(raw / size, '.1f') + 'x smaller than the decoded rows)')
+        return 0
+    presses = recording.presses(args.player, args.switch, args.start, args.end)
+    for t in presses:
+        print(format(t, '.6f'))
+    print(str(len(presses)) + ' presses', file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Shared memory export of the cabinet's input state.
+#
+# The publisher (running alongside the JVS poll loop) writes the latest switches, coins and analog
+# values into a fixed layout block in an mmap-ed file. Readers in other processes map the same file
+# and take consistent snapshots using the sequence counter (a seqlock): the writer makes the counter
+# odd before changing the block and even again afterwards, a reader retries if the counter was odd or
+# moved while it was copying. Readers never make a syscall or allocate after they've been opened.
+# Readers that want no copy at all use begin(), read straight out of the mapped body (a memoryview)
+# and then check end(), going round again if the writer got in between.
+#
+# This module doesn't import jvs, so game front-ends can use the reader without pyserial installed.
+
+import mmap, os, struct, sys
+from dataclasses import dataclass, field
+from time import monotonic_ns
+
+SHM_MAGIC = b'JVSI'
+SHM_VERSION = 1
+SHM_DEFAULT_PATH = '/dev/shm/jvs-inputs' if os.path.isdir('/dev/shm') else os.path.join(os.path.expanduser('~'), '.jvs-inputs')
+
+SHM_MAX_SWITCH_BYTES = 64   # Cabinet byte plus the player bytes
+SHM_MAX_COINS = 16
+SHM_MAX_ANALOG = 32
+
+# Layout, little endian:
+#   0   magic, version, header size
+#   8   sequence counter
+#   16  body: timestamp (monotonic ns), poll count, player count, bytes per player, coin slots,
+#       analog channels, switches, coin counts, coin conditions, analog values
+_HEADER = struct.Struct('<4sHH')
+_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = 8
+_BODY_OFFSET = 16
+_BODY = struct.Struct('<QQBBBB4x' + str(SHM_MAX_SWITCH_BYTES) + 's' + str(SHM_MAX_COINS) + 'H' \
+    + str(SHM_MAX_COINS) + 'B' + str(SHM_MAX_ANALOG) + 'H')
+SHM_SIZE = 256
+assert _BODY_OFFSET + _BODY.size <= SHM_SIZE
+
+# Offsets into the body for readers that want single fields
+_SWITCH_OFFSET = 24
+_COIN_OFFSET = _SWITCH_OFFSET + SHM_MAX_SWITCH_BYTES
+_CONDITION_OFFSET = _COIN_OFFSET + (2 * SHM_MAX_COINS)
+_ANALOG_OFFSET = _CONDITION_OFFSET + SHM_MAX_COINS
+_COUNTS = struct.Struct('<BBBB')
+_COIN_VALUES = struct.Struct('<' + str(SHM_MAX_COINS) + 'H')
+_ANALOG_VALUES = struct.Struct('<' + str(SHM_MAX_ANALOG) + 'H')
+
+@dataclass
+class JVS_InputSnapshot:
+    seq: int = 0
+    timestamp: int = 0      # time.monotonic_ns() when the state was published
+    pollCount: int = 0
+    playerCount: int = 0
+    switchBytes: int = 0    # Bytes per player
+    coinCount: int = 0
+    analogCount: int = 0
+    switches: bytearray = field(default_factory = bytearray)
+    coins: list = field(default_factory = list)
+    coinConditions: list = field(default_factory = list)
+    analog: list = field(default_factory = list)
+
+class JVS_InputPublisher():
+    def __init__(self, path: str = SHM_DEFAULT_PATH):
+        """Creates (or takes over) the shared memory block at path and publishes input state into it."""
+        self.path = path
+        self._mm = None     # So close() from __del__ is safe if opening fails
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SHM_SIZE)
+            self._mm = mmap.mmap(fd, SHM_SIZE)
+        finally:
+            os.close(fd)
+        _HEADER.pack_into(self._mm, 0, SHM_MAGIC, SHM_VERSION, _BODY_OFFSET)
+        self.seq = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+        if self.seq & 1:
+            # Previous publisher died mid-write
+            self.seq += 1
+        self.pollCount = 0
+        self._coins = [0] * SHM_MAX_COINS
+        self._conditions = [0] * SHM_MAX_COINS
+        self._analog = [0] * SHM_MAX_ANALOG
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+            self._mm = None
+
+    def __del__(self):
+        self.close()
+
+    def publish(self, switches: bytes, coins: bytes = b'', analog: bytes = b'', playerCount: int = 0, switchBytes: int = 0):
+        """Publishes one poll's worth of state. Takes the raw reports as returned by JVS.getInputs(), getCoinCount() and getAnalog()."""
+        coinCount = min(len(coins) // 2, SHM_MAX_COINS)
+        for c in range(0, coinCount):
+            condition = coins[2 * c]
+            self._conditions[c] = condition >> 6
+            self._coins[c] = ((condition & 0x3F) << 8) + coins[(2 * c) + 1]
+        analogCount = min(len(analog) // 2, SHM_MAX_ANALOG)
+        for a in range(0, analogCount):
+            self._analog[a] = (analog[2 * a] << 8) + analog[(2 * a) + 1]
+        return self._write(switches, playerCount, switchBytes, coinCount, analogCount)
+
+    def publishPolled(self, polled, playerCount: int, switchBytes: int):
+        """Publishes what JVS.poll() returned: (cabinet, players), (condition, count) pairs and analog values, any of them None."""
+        switches, coins, analog = polled
+        raw = bytearray()
+        if switches is not None:
+            cabinet, players = switches
+            raw.append(cabinet)
+            for player in players:
+                raw += player.to_bytes(switchBytes, 'big')
+        coinCount = min(len(coins), SHM_MAX_COINS) if coins else 0
+        for c in range(0, coinCount):
+            self._conditions[c], self._coins[c] = coins[c]
+        analogCount = min(len(analog), SHM_MAX_ANALOG) if analog else 0
+        self._analog[:analogCount] = analog[:analogCount]
+        return self._write(raw, playerCount, switchBytes, coinCount, analogCount)
+
+    def _write(self, switches, playerCount: int, switchBytes: int, coinCount: int, analogCount: int):
+        self.pollCount += 1
+        mm = self._mm
+        _SEQ.pack_into(mm, _SEQ_OFFSET, self.seq + 1)     # Odd, readers back off
+        _BODY.pack_into(mm, _BODY_OFFSET, monotonic_ns(), self.pollCount, playerCount, switchBytes, coinCount, analogCount,
+            bytes(switches[:SHM_MAX_SWITCH_BYTES]), *self._coins, *self._conditions, *self._analog)
+        self.seq += 2
+        _SEQ.pack_into(mm, _SEQ_OFFSET, self.seq)
+        return self.seq
+
+    def publishFrom(self, jvsIO):
+        """Polls a connected JVS object for switches, coins and analog values in one frame and publishes them. Returns False if the switch read failed."""
+        polled = jvsIO.poll()
+        if polled is None or polled[0] is None:
+            return False
+        from jvscodec import switchBytes
+        self.publishPolled(polled, jvsIO.ioBoard.playerCount, switchBytes(jvsIO.ioBoard))
+        return True
+
+class JVS_InputReader():
+    def __init__(self, path: str = SHM_DEFAULT_PATH):
+        """Maps a block written by JVS_InputPublisher for reading."""
+        self._mm = None
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self._mm = mmap.mmap(fd, SHM_SIZE, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, version, bodyOffset = _HEADER.unpack_from(self._mm, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            self._mm.close()
+            self._mm = None
+            raise ValueError(path + ' is not a JVS input block')
+        self._view = memoryview(self._mm)
+        self._body = self._view[_BODY_OFFSET:_BODY_OFFSET + _BODY.size]
+        self.body = self._body.toreadonly()     # The live body in shared memory, for reads between begin() and end()
+        self.switches = self.body[_SWITCH_OFFSET:_SWITCH_OFFSET + SHM_MAX_SWITCH_BYTES]    # Switch bytes in body, cabinet byte first
+        self._buffer = bytearray(_BODY.size)
+        self.seq = 0
+
+    def close(self):
+        if self._mm:
+            self.switches.release()
+            self.body.release()
+            self._body.release()
+            self._view.release()
+            self._mm.close()
+            self._mm = None
+
+    def __del__(self):
+        self.close()
+
+    def read(self, retries: int = 1000):
+        """Copies a consistent body into the reader's buffer. Returns the sequence number, or 0 if the writer never settled.
+        This is the hot path: it only touches memory, use the accessors below to pull values out of the buffer."""
+        mm = self._mm
+        buffer = self._buffer
+        body = self._body
+        for n in range(0, retries):
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if seq & 1:
+                continue
+            buffer[:] = body
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq:
+                self.seq = seq
+                return seq
+        return 0
+
+    def begin(self, retries: int = 1000):
+        """Starts a zero-copy read: returns the sequence number once the writer is between updates, or 0 if it never settled.
+        Read what's needed straight out of body (or switches) with struct.unpack_from() and the like, then check with end()."""
+        mm = self._mm
+        for n in range(0, retries):
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if not seq & 1:
+                return seq
+        return 0
+
+    def end(self, seq: int):
+        """True if nothing was published since begin() returned seq, so what was read from body is consistent. Otherwise read again."""
+        if seq and _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0] == seq:
+            self.seq = seq
+            return True
+        return False
+
+    def changed(self):
+        """True if the publisher has written since the last read()."""
+        return _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0] != self.seq
+
+    def switchByte(self, index: int):
+        """Switch byte from the last read(). Index 0 is the cabinet byte, players follow at 1 + (player * switchBytes)."""
+        return self._buffer[_SWITCH_OFFSET + index]
+
+    def switch(self, player: int, bit: int):
+        """State of one switch from the last read(). player=0 is the cabinet, bit 0 is the MSB of the first byte."""
+        playerCount, switchBytes, coinCount, analogCount = _COUNTS.unpack_from(self._buffer, 16)
+        index = 0 if player == 0 else 1 + ((player - 1) * switchBytes) + (bit >> 3)
+        return bool(self._buffer[_SWITCH_OFFSET + index] & (0x80 >> (bit & 7)))
+
+    def coin(self, slot: int):
+        """Coin count for a slot (from 0) from the last read()."""
+        return struct.unpack_from('<H', self._buffer, _COIN_OFFSET + (2 * slot))[0]
+
+    def analog(self, channel: int):
+        """Analog value for a channel (from 0) from the last read()."""
+        return struct.unpack_from('<H', self._buffer, _ANALOG_OFFSET + (2 * channel))[0]
+
+    def snapshot(self, into: JVS_InputSnapshot = None):
+        """Takes a consistent snapshot and decodes all of it. Returns None if no consistent read could be made."""
+        seq = self.read()
+        if not seq:
+            return None
+        values = _BODY.unpack_from(self._buffer, 0)
+        snap = into if into else JVS_InputSnapshot()
+        snap.seq = seq
+        snap.timestamp, snap.pollCount, snap.playerCount, snap.switchBytes, snap.coinCount, snap.analogCount = values[0:6]
+        switchLength = 1 + (snap.playerCount * snap.switchBytes)
+        snap.switches[:] = values[6][:switchLength]
+        coinStart = 7
+        conditionStart = coinStart + SHM_MAX_COINS
+        analogStart = conditionStart + SHM_MAX_COINS
+        snap.coins[:] = values[coinStart:coinStart + snap.coinCount]
+        snap.coinConditions[:] = values[conditionStart:conditionStart + snap.coinCount]
+        snap.analog[:] = values[analogStart:analogStart + snap.analogCount]
+        return snap
+
+def main(args = None):
+    """Prints the published input state, for checking the publisher from a shell."""
+    path = args[0] if args else SHM_DEFAULT_PATH
+    reader = JVS_InputReader(path)
+    snap = reader.snapshot()
+    if not snap:
+        print('Publisher never settled')
+        return 1
+    print('Seq ' + str(snap.seq) + ', poll ' + str(snap.pollCount))
+    print('\t Cab:\t' + format(snap.switches[0], '08b'))
+    for p in range(0, snap.playerCount):
+        start = 1 + (p * snap.switchBytes)
+        print('\t P' + str(p + 1) + ':\t' + ' '.join(format(b, '08b') for b in snap.switches[start:start + snap.switchBytes]))
+    for c in range(0, snap.coinCount):
+        print('Coin slot ' + str(c + 1) + ': ' + str(snap.coins[c]) + ' COIN(S)')
+    if snap.analogCount:
+        print('Analog: ' + ' '.join(format(a, '04X') for a in snap.analog))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+# Soak test: memory growth and latency drift over a long poll run.
+#
+# Runs the monitor's poll loop (switches and coins every poll, a GPO change every so often) against a
+# stand-in board, by default the emulator on the loopback transport so millions of polls take minutes,
+# and samples every so many polls: resident set size, memory traced by tracemalloc and per-poll latency
+# percentiles. Poll timings go into a preallocated array so measuring doesn't allocate. Once the warm up
+# is over, a straight line is fitted to each series; the run fails if memory grows faster than the limit
+# per million polls (and by more than a small floor in all), or the fitted p99 latency at the end is more
+# than the allowed share above its value at the start. The report is one line per sample plus the
+# allocation sites that grew the most.
+
+from argparse import ArgumentParser
+from array import array
+from dataclasses import dataclass, field, asdict
+from contextlib import redirect_stdout
+from time import perf_counter
+import sys, os, json, tracemalloc
+
+# A page of RSS, or a cache or two filling up in traced memory, over a short run extrapolates to a big rate per million polls.
+# Growth is only held against the rate limits once its fitted line has risen more than these over the steady samples.
+SOAK_RSS_FLOOR = 65536      # 16 pages of 4 KiB
+SOAK_TRACED_FLOOR = 16384
+
+@dataclass(slots=True)
+class JVS_SoakSample:
+    polls: int = 0
+    elapsed: float = 0.0    # Seconds since the start
+    rss: int = 0            # Bytes, 0 where it can't be read
+    traced: int = 0         # Bytes held according to tracemalloc, 0 when it's off
+    p50: float = 0.0        # Poll latency over this sample's polls, seconds
+    p99: float = 0.0
+    max: float = 0.0
+    rate: float = 0.0       # Polls per second
+    failures: int = 0
+
+@dataclass
+class JVS_SoakResult:
+    samples: list = field(default_factory = list)
+    warmup: int = 0                 # Samples left out of the trends
+    rssGrowth: float = 0.0          # Bytes per million polls, from the fitted line
+    rssGrown: float = 0.0           # Bytes the fitted line rose over the steady samples
+    tracedGrowth: float = 0.0
+    tracedGrown: float = 0.0
+    p99Drift: float = 0.0           # Fitted p99 at the end over the start, minus 1
+    topAllocators: list = field(default_factory = list)    # (site, bytes grown, blocks grown)
+    failures: list = field(default_factory = list)
+
+    @property
+    def passed(self):
+        return not self.failures
+
+def readRSS():
+    """Resident set size of this process in bytes, or 0 if it can't be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak rather than current outside Linux, still shows growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    except (ImportError, OSError):
+        return 0
+
+def fitSlope(xs, ys):
+    """Least squares line through (xs, ys). Returns (slope, intercept)."""
+    n = len(xs)
+    if n < 2:
+        return 0.0, (ys[0] if ys else 0.0)
+    meanX = sum(xs) / n
+    meanY = sum(ys) / n
+    sxx = sum((x - meanX) ** 2 for x in xs)
+    if sxx == 0:
+        return 0.0, meanY
+    slope = sum((x - meanX) * (y - meanY) for x, y in zip(xs, ys)) / sxx
+    return slope, meanY - slope * meanX
+
+def _percentile(ordered, share: float):
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def runSoak(jvsIO, polls: int = 1000000, samples: int = 50, gpoEvery: int = 64, trace: bool = True, traceFrames: int = 1, progress = None):
+    """Polls jvsIO polls times, taking samples evenly spaced samples. Returns the JVS_SoakSample list, and the tracemalloc snapshots after the first and last sample (None without trace).
+    progress, if given, is called with each sample as it's taken."""
+    from jvscodec import packGPO
+    board = jvsIO.ioBoard
+    switches = bytearray()
+    coins = bytearray()
+    every = max(polls // samples, 1)
+    timings = array('d', bytes(8 * every))
+    # Sample figures go into preallocated columns, a list of objects would grow the traced memory being measured
+    columns = [array('d', bytes(8 * (-(-polls // every)))) for name in JVS_SoakSample.__slots__]
+    taken = 0
+    first = last = None
+    gpo = 0
+    if trace:
+        tracemalloc.start(traceFrames)
+    try:
+        start = perf_counter()
+        sampleStart = start
+        failures = 0
+        done = 0
+        while done < polls:
+            count = min(every, polls - done)
+            for n in range(0, count):
+                began = perf_counter()
+                if not jvsIO.getInputs(into=switches):
+                    failures += 1
+                if board.coinCount and not jvsIO.getCoinCount(into=coins):
+                    failures += 1
+                timings[n] = perf_counter() - began
+                if board.gpoCount and (done + n) % gpoEvery == 0:
+                    # Walk one lit output along, as the monitor's lamp animation does
+                    gpo = (gpo + 1) % board.gpoCount
+                    if not jvsIO.setGPO(packGPO(1 << gpo, board.gpoCount)):
+                        failures += 1
+            done += count
+            now = perf_counter()
+            ordered = sorted(timings[:count])
+            figures = (done, now - start, readRSS(), tracemalloc.get_traced_memory()[0] if trace else 0,
+                _percentile(ordered, 0.5), _percentile(ordered, 0.99), ordered[-1], count / (now - sampleStart), failures)
+            for column, value in zip(columns, figures):
+                column[taken] = value
+            taken += 1
+            failures = 0
+            del ordered
+            if trace:
+                if first is None:
+                    first = tracemalloc.take_snapshot()
+                elif done >= polls:
+                    last = tracemalloc.take_snapshot()
+            if progress:
+                progress(JVS_SoakSample(*figures))
+            # Leave the snapshot and report time out of the next sample
+            sampleStart = perf_counter()
+    finally:
+        if trace:
+            tracemalloc.stop()
+    results = [JVS_SoakSample(int(row[0]), row[1], int(row[2]), int(row[3]), row[4], row[5], row[6], row[7], int(row[8]))
+        for row in zip(*(column[:taken] for column in columns))]
+    return results, first, last
+
+def analyzeSoak(samples: list, first = None, last = None, warmup: float = 0.1, maxGrowth: float = 65536, maxRSSGrowth: float = 1048576, maxDrift: float = 0.5, top: int = 5,
+    rssFloor: float = SOAK_RSS_FLOOR, tracedFloor: float = SOAK_TRACED_FLOOR):
+    """Fits trends to the samples after the warm up share and checks them against the limits (growth in bytes per million polls, drift as a share of p99).
+    Growth under rssFloor or tracedFloor bytes in all is let through whatever its rate. Returns a JVS_SoakResult."""
+    result = JVS_SoakResult(samples=samples)
+    result.warmup = min(int(len(samples) * warmup), max(len(samples) - 2, 0))
+    steady = samples[result.warmup:]
+    xs = [s.polls for s in steady]
+    if len(steady) >= 2:
+        slope, _ = fitSlope(xs, [s.rss for s in steady])
+        result.rssGrowth = slope * 1000000
+        result.rssGrown = slope * (xs[-1] - xs[0])
+        if any(s.traced for s in steady):
+            slope, _ = fitSlope(xs, [s.traced for s in steady])
+            result.tracedGrowth = slope * 1000000
+            result.tracedGrown = slope * (xs[-1] - xs[0])
+        slope, intercept = fitSlope(xs, [s.p99 for s in steady])
+        startP99 = slope * xs[0] + intercept
+        endP99 = slope * xs[-1] + intercept
+        if startP99 > 0:
+            result.p99Drift = endP99 / startP99 - 1
+    if first is not None and last is not None:
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        for stat in last.filter_traces(ignore).compare_to(first.filter_traces(ignore), 'lineno')[:top]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            result.topAllocators.append((os.path.basename(frame.filename) + ':' + str(frame.lineno), stat.size_diff, stat.count_diff))
+    if result.tracedGrowth > maxGrowth and result.tracedGrown > tracedFloor:
+        result.failures.append('traced memory grows ' + format(result.tracedGrowth / 1024, '.1f') + ' KiB per million polls (limit ' + format(maxGrowth / 1024, '.1f') + ')')
+    if result.rssGrowth > maxRSSGrowth and result.rssGrown > rssFloor:
+        result.failures.append('RSS grows ' + format(result.rssGrowth / 1024, '.1f') + ' KiB per million polls (limit ' + format(maxRSSGrowth / 1024, '.1f') + ')')
+    if result.p99Drift > maxDrift:
+        result.failures.append('p99 latency drifts up ' + format(result.p99Drift * 100, '.0f') + '% (limit ' + format(maxDrift * 100, '.0f') + '%)')
+    if sum(s.failures for s in samples):
+        result.failures.append(str(sum(s.failures for s in samples)) + ' failed requests')
+    return result
+
+def formatSample(sample: JVS_SoakSample):
+    return str(sample.polls).rjust(9) + format(sample.elapsed, '9.1f') + format(sample.rss / 1024, '10.0f') + format(sample.traced / 1024, '9.1f') \
+        + format(sample.p50 * 1000000, '9.1f') + format(sample.p99 * 1000000, '9.1f') + format(sample.max * 1000000, '10.1f') + format(sample.rate, '9.0f') \
+        + str(sample.failures).rjust(6)
+
+SOAK_HEADER = '    polls        s   RSS KiB   traced  p50 us   p99 us    max us  polls/s  fail'
+
+def printResult(result: JVS_SoakResult):
+    print('Steady state from sample ' + str(result.warmup + 1) + ':')
+    print('\tRSS growth:\t' + format(result.rssGrowth / 1024, '.1f') + ' KiB per million polls')
+    print('\tTraced growth:\t' + format(result.tracedGrowth / 1024, '.1f') + ' KiB per million polls')
+    print('\tp99 drift:\t' + format(result.p99Drift * 100, '+.1f') + '%')
+    if result.topAllocators:
+        print('Most grown allocation sites:')
+        for site, size, count in result.topAllocators:
+            print('\t' + site.ljust(24) + format(size / 1024, '8.1f') + ' KiB ' + str(count).rjust(7) + ' blocks')
+    for failure in result.failures:
+        print('FAIL: ' + failure)
+    print('PASS' if result.passed else 'FAIL')
+
+def main(args = None):
+    parser = ArgumentParser(description = "Poll a board for a long time and fail if memory or latency creeps up.")
+    parser.add_argument(
+		"-p", "--port",
+		type = str,
+		default = "loopback",
+		help = "port to soak, as for jvs.py -p (default loopback, the emulator in this process)",
+		metavar = "port"
+	)
+    parser.add_argument(
+		"-b", "--baud",
+		type = int,
+		default = 115200,
+		help = "override default baud rate (115200)",
+		metavar = "value"
+	)
+    parser.add_argument(
+		"-n", "--polls",
+		type = int,
+		default = 1000000,
+		help = "polls to run (default 1000000)",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"--samples",
+		type = int,
+		default = 50,
+		help = "samples to take over the run (default 50)",
+		metavar = "count"
+	)
+    parser.add_argument(
+		"--warmup",
+		type = float,
+		default = 0.1,
+		help = "share of the samples left out of the trends (default 0.1)",
+		metavar = "share"
+	)
+    parser.add_argument(
+		"--max-growth",
+		type = float,
+		default = 64,
+		help = "traced memory growth allowed, KiB per million polls (default 64); runs that grow less than " + str(SOAK_TRACED_FLOOR // 1024) + " KiB in all pass",
+		metavar = "KiB"
+	)
+    parser.add_argument(
+		"--max-rss-growth",
+		type = float,
+		default = 1024,
+		help = "RSS growth allowed, KiB per million polls (default 1024); runs that grow less than " + str(SOAK_RSS_FLOOR // 1024) + " KiB in all pass, RSS moves in whole pages",
+		metavar = "KiB"
+	)
+    parser.add_argument(
+		"--max-drift",
+		type = float,
+		default = 0.5,
+		help = "rise allowed in fitted p99 latency from start to end, as a share (default 0.5)",
+		metavar = "share"
+	)
+    parser.add_argument(
+		"--no-trace",
+		action = "store_true",
+		help = "leave tracemalloc off, for latency figures without its overhead (RSS is still checked)"
+	)
+    parser.add_argument(
+		"--json",
+		action = "store_true",
+		help = "print the samples and verdict as JSON"
+	)
+    args = parser.parse_args(args)
+
+    from jvs import JVS, JVSIO, ConnectState
+    from jvstransport import openTransport
+    with redirect_stdout(sys.stderr):
+        jvsIO = JVS(openTransport(args.port, args.baud), JVSIO())
+        if jvsIO.connect() != ConnectState.CONNECTED:
+            print('No IO board found on ' + args.port)
+            return 1
+    out = sys.stdout
+    if not args.json:
+        print('Soaking ' + jvsIO.ioBoard.name.strip('\x00\x01').replace(';', ' / ') + ' on ' + args.port + ' for ' + str(args.polls) + ' polls')
+        print(SOAK_HEADER)
+    try:
+        with redirect_stdout(sys.stderr):
+            samples, first, last = runSoak(jvsIO, args.polls, args.samples, trace=not args.no_trace,
+                progress=None if args.json else lambda sample: print(formatSample(sample), file=out, flush=True))
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        with redirect_stdout(sys.stderr):
+            jvsIO.disconnect()
+    result = analyzeSoak(samples, first, last, args.warmup, args.max_growth * 1024, args.max_rss_growth * 1024, args.max_drift)
+    if args.json:
+        report = asdict(result)
+        report['passed'] = result.passed
+        print(json.dumps(report, indent=2))
+    else:
+        printResult(result)
+    return 0 if result.passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Transports JVS can talk through.
+#
+# JVS only uses a small part of the pyserial Serial interface, so that subset is the transport interface
+# and a Serial object is still the default transport. JVS_Transport spells the subset out and gives
+# defaults for the optional parts. JVS_TTYTransport drives a tty fd directly with os.read/os.write and
+# termios, skipping pyserial's per-call overhead. JVS_LoopbackTransport hands frames straight to an
+# in-process board model (anything with process(raw) -> reply bytes, such as jvsemu.JVS_Emulator) with
+# no syscalls at all, so protocol logic can be benchmarked at memory speed.
+
+from abc import ABC, abstractmethod
+from time import sleep
+import os, sys, struct, select
+try:
+    import fcntl, termios, tty
+except ImportError:     # Windows, only pyserial and loopback transports there
+    fcntl = termios = tty = None
+
+# Linux serial_rs485 ioctl (asm-generic value, a few architectures such as MIPS/PowerPC use others) and flags
+TIOCSRS485 = getattr(termios, 'TIOCSRS485', 0x542F)
+SER_RS485_ENABLED = 1 << 0
+SER_RS485_RTS_ON_SEND = 1 << 1
+SER_RS485_RTS_AFTER_SEND = 1 << 2
+
+def setKernelRS485(port, enable: bool = True, rtsOnSend: bool = False, delayBefore: int = 0, delayAfter: int = 0):
+    """Hands RS-485 transmitter switching to the UART driver (TIOCSRS485) so a frame is one write() with no drain or RTS calls.
+    rtsOnSend is the RTS level while sending; JVS's own toggling drops RTS to send. Delays are in ms. Returns True if the driver accepted it."""
+    fileno = getattr(port, 'fileno', None)
+    if fcntl is None or fileno is None or not sys.platform.startswith('linux'):
+        return False
+    flags = (SER_RS485_ENABLED | (SER_RS485_RTS_ON_SEND if rtsOnSend else SER_RS485_RTS_AFTER_SEND)) if enable else 0
+    try:
+        # struct serial_rs485: flags, delay_rts_before_send, delay_rts_after_send, padding[5]
+        fcntl.ioctl(fileno(), TIOCSRS485, struct.pack('8I', flags, delayBefore, delayAfter, 0, 0, 0, 0, 0))
+    except (OSError, ValueError, AttributeError):
+        # Not an RS-485 capable UART (USB adapters, ptys) or not a real fd
+        return False
+    return True
+
+class JVS_Transport(ABC):
+    """Interface JVS uses to talk to the bus, named after the pyserial calls it replaces.
+    read, write and in_waiting are abstract, so a transport missing one can't be created; readinto, the modem line and buffer calls have defaults."""
+    is_open = False
+
+    @property
+    @abstractmethod
+    def in_waiting(self):
+        """Bytes that can be read without blocking."""
+
+    @abstractmethod
+    def read(self, size: int = 1):
+        """Reads up to size bytes."""
+
+    def readinto(self, buffer):
+        """Reads into a writable buffer, returns the byte count."""
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    @abstractmethod
+    def write(self, data):
+        """Sends data, returns the byte count."""
+
+    def flush(self):
+        """Blocks until everything written has gone out."""
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    # RS-485 direction (RTS) and sense (DSR/DCD) lines
+    @property
+    def rts(self):
+        return True
+
+    @rts.setter
+    def rts(self, level: bool):
+        pass
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def cd(self):
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class JVS_TTYTransport(JVS_Transport):
+    def __init__(self, path: str, baudrate: int = 115200):
+        """Opens a tty device raw, 8N1, at baudrate, and talks to it with plain os.read/os.write."""
+        if termios is None:
+            raise OSError('tty transport needs termios')
+        speed = getattr(termios, 'B' + str(baudrate), None)
+        if speed is None:
+            raise ValueError('Baud rate not supported by termios: ' + str(baudrate))
+        self.path = path
+        self.port = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self.is_open = True
+        self.rtsControl = True  # Cleared if the device has no RTS line (ptys, some USB adapters)
+        self._rts = True
+        self._count = bytearray(struct.calcsize('i'))
+        try:
+            tty.setraw(self.fd)
+            attrs = termios.tcgetattr(self.fd)
+            attrs[2] = (attrs[2] & ~(termios.CSIZE | termios.PARENB | termios.CSTOPB)) | termios.CS8 | termios.CLOCAL | termios.CREAD
+            if hasattr(termios, 'CRTSCTS'):
+                attrs[2] &= ~termios.CRTSCTS
+            attrs[4] = attrs[5] = speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        except (OSError, termios.error):
+            os.close(self.fd)
+            self.is_open = False
+            raise
+        self.baudrate = baudrate
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        fcntl.ioctl(self.fd, termios.FIONREAD, self._count)
+        return struct.unpack('i', self._count)[0]
+
+    def read(self, size: int = 1):
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return b''
+
+    def readinto(self, buffer):
+        try:
+            return os.readv(self.fd, (buffer,))
+        except BlockingIOError:
+            return 0
+
+    def write(self, data):
+        view = memoryview(data)
+        total = len(view)
+        sent = 0
+        while sent < total:
+            try:
+                sent += os.write(self.fd, view[sent:])
+            except BlockingIOError:
+                select.select([], [self.fd], [], 0.1)
+        return total
+
+    def flush(self):
+        termios.tcdrain(self.fd)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def reset_output_buffer(self):
+        termios.tcflush(self.fd, termios.TCOFLUSH)
+
+    def close(self):
+        if self.is_open:
+            os.close(self.fd)
+            self.is_open = False
+
+    def _modemBits(self):
+        bits = fcntl.ioctl(self.fd, termios.TIOCMGET, struct.pack('i', 0))
+        return struct.unpack('i', bits)[0]
+
+    @property
+    def rts(self):
+        return self._rts
+
+    @rts.setter
+    def rts(self, level: bool):
+        self._rts = level
+        if not self.rtsControl:
+            return
+        try:
+            fcntl.ioctl(self.fd, termios.TIOCMBIS if level else termios.TIOCMBIC, struct.pack('i', termios.TIOCM_RTS))
+        except OSError:
+            self.rtsControl = False
+
+    @property
+    def dsr(self):
+        return bool(self._modemBits() & termios.TIOCM_DSR)
+
+    @property
+    def cd(self):
+        return bool(self._modemBits() & termios.TIOCM_CD)
+
+class JVS_LoopbackTransport(JVS_Transport):
+    def __init__(self, board):
+        """Connects straight to an in-process board model. Each write is answered by board.process() before it returns."""
+        self.board = board
+        self.port = 'loopback'
+        self.is_open = True
+        self._rx = bytearray()
+        self._rxStart = 0
+
+    @property
+    def in_waiting(self):
+        return len(self._rx) - self._rxStart
+
+    def read(self, size: int = 1):
+        start = self._rxStart
+        data = bytes(self._rx[start:start + size])
+        self._consume(len(data))
+        return data
+
+    def readinto(self, buffer):
+        start = self._rxStart
+        count = min(len(buffer), len(self._rx) - start)
+        buffer[:count] = self._rx[start:start + count]
+        self._consume(count)
+        return count
+
+    def _consume(self, count: int):
+        self._rxStart += count
+        if self._rxStart >= len(self._rx):
+            # Everything read, start again from the front
+            del self._rx[:]
+            self._rxStart = 0
+
+    def write(self, data):
+        reply = self.board.process(bytes(data))
+        if reply:
+            self._rx += reply
+        return len(data)
+
+    def reset_input_buffer(self):
+        del self._rx[:]
+        self._rxStart = 0
+
+    @property
+    def dsr(self):
+        return getattr(self.board, 'sense', True)
+
+    @property
+    def cd(self):
+        return getattr(self.board, 'sense', True)
+
+    def waitModemChange(self, timeout: float):
+        waiter = getattr(self.board, 'waitSenseChange', None)
+        if waiter:
+            waiter(timeout)
+        else:
+            sleep(timeout)
+
+def openTransport(spec: str, baudrate: int = 115200):
+    """Opens a transport from a port name: 'tty:/dev/ttyUSB0' for the raw tty transport, 'loopback' for an emulated board in this process,
+    anything else (optionally prefixed 'serial:') is opened with pyserial."""
+    if spec.startswith('tty:'):
+        return JVS_TTYTransport(spec[4:], baudrate)
+    if spec == 'loopback':
+        from jvsemu import JVS_Emulator
+        return JVS_LoopbackTransport(JVS_Emulator())
+    if spec.startswith('serial:'):
+        spec = spec[7:]
+    from serial import Serial
+    return Serial(spec, baudrate)